@@ -5,8 +5,13 @@ Passing the scrape_jobs to GoogleScraper is simple:
 
 GoogleScraper --keyword-file keywords.py
 
+Jobs with a higher 'priority' are scraped first (the default is 0). Jobs with
+a 'deadline' that are still waiting when the deadline passed are dropped
+(or deferred to the end with expired_jobs = 'defer').
 """
 
+import datetime
+
 scrape_jobs = [
     {
         'query': 'hello world',
@@ -23,6 +28,14 @@ scrape_jobs = [
         'scrape_method': 'selenium'
     },
 
+    {
+        'query': 'cheap flights',
+        'search_engine': 'google',
+        'scrape_method': 'http',
+        'priority': 10, # rank tracking keywords go before the long tail
+        'deadline': datetime.datetime.now() + datetime.timedelta(hours=1), # worthless after an hour
+    },
+
     {
         'query': 'mountain',
         'search_engine': 'baidu',
@@ -4,7 +4,8 @@ import datetime
 from urllib.parse import urlencode
 from GoogleScraper.parsing import get_parser_by_search_engine, parse_serp
 from GoogleScraper.http_mode import get_GET_params_for_search_engine, headers
-from GoogleScraper.scraping import get_base_search_url_by_search_engine
+from GoogleScraper.scraping import get_base_search_url_by_search_engine, SearchEngineScrape
+from GoogleScraper.negative_cache import job_of
 from GoogleScraper.utils import get_some_words
 from GoogleScraper.output_converter import store_serp_result
 import logging
@@ -39,6 +40,8 @@ class AsyncHttpScrape(object):
                                                        search_type=self.search_type)
         self.headers = headers
         self.status = 'successful'
+        # why the request failed, see negative_cache.REASONS
+        self.outcome = None
 
     async def __call__(self):
 
@@ -49,6 +52,7 @@ class AsyncHttpScrape(object):
 
                 if response.status != 200:
                     self.status = 'not successful: ' + str(response.status)
+                    self.outcome = 'blocked'
 
                 self.requested_at = datetime.datetime.utcnow()
 
@@ -64,10 +68,15 @@ class AsyncHttpScrape(object):
 
                 if response.status == 200:
                     body = await response.text()
+                    needles = SearchEngineScrape.malicious_request_needles.get(self.search_engine_name)
+                    if needles and (needles['inhtml'] in body or needles['inurl'] in str(response.url)):
+                        self.outcome = 'blocked'
                     self.parser = self.parser(config=self.config, html=body)
                     return self
 
-            return None
+            # remembered in the negative cache
+            self.parser = None
+            return self
 
         return request
 
@@ -81,7 +90,8 @@ class AsyncScrapeScheduler(object):
         self.cache_manager = cache_manager
         self.config = config
         self.max_concurrent_requests = self.config.get('max_concurrent_requests')
-        self.scrape_jobs = scrape_jobs
+        # may be a list or a (streamed) generator of scrape jobs
+        self.scrape_jobs = iter(scrape_jobs)
         self.session = session
         self.scraper_search = scraper_search
         self.db_lock = db_lock
@@ -97,13 +107,22 @@ class AsyncScrapeScheduler(object):
 
         while True:
             request_number += 1
-            try:
-                job = self.scrape_jobs.pop()
-            except IndexError:
+            job = next(self.scrape_jobs, None)
+            if job is None:
                 break
 
+            # a request that failed recently is not repeated and doesn't count
+            negative = getattr(self.cache_manager, 'negative', None)
+            if job and negative is not None and negative.get(job, 'localhost'):
+                negative.avoided()
+                request_number -= 1
+                continue
+
             if job:
-                self.requests.append(AsyncHttpScrape(self.config, **job))
+                # jobs may carry more keys, like the priority and the deadline
+                self.requests.append(AsyncHttpScrape(self.config, query=job['query'], page_number=job['page_number'],
+                                                     search_engine=job['search_engine'],
+                                                     scrape_method=job['scrape_method']))
 
             if request_number >= self.max_concurrent_requests:
                 break
@@ -123,9 +142,15 @@ class AsyncScrapeScheduler(object):
 
                 if scrape:
 
+                    outcome = scrape.outcome or (None if scrape.parser and scrape.parser.num_results else 'no_results')
+
                     if self.cache_manager:
-                        self.cache_manager.cache_results(scrape.parser, scrape.query, scrape.search_engine_name, scrape.scrape_method,
-                                      scrape.page_number)
+                        # blocked and empty pages would poison the cache
+                        if outcome is None:
+                            self.cache_manager.cache_results(scrape.parser, scrape.query, scrape.search_engine_name,
+                                                             scrape.scrape_method, scrape.page_number)
+                        elif self.cache_manager.negative is not None:
+                            self.cache_manager.negative.record(job_of(scrape), 'localhost', outcome)
 
                     if scrape.parser:
                         serp = parse_serp(self.config, parser=scrape.parser, scraper=scrape, query=scrape.query)
@@ -137,7 +162,7 @@ class AsyncScrapeScheduler(object):
                             self.session.add(serp)
                             self.session.commit()
 
-                        store_serp_result(serp, self.config)
+                        store_serp_result(serp, self.config, outcome=outcome)
 
 
 if __name__ == '__main__':
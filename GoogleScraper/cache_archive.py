@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import io
+import re
+import sys
+import time
+import hashlib
+import tarfile
+import itertools
+import logging
+from GoogleScraper.compression import decompress
+from GoogleScraper.database import SearchEngineResultsPage as SERP
+
+logger = logging.getLogger(__name__)
+
+"""
+Exports cached pages to a portable archive and imports them on another host.
+
+A new scraping host starts with an empty cache and would fetch the pages
+again that other hosts already hold. `--cache-export archive.tar.gz` writes
+the cached pages to a tar archive, `--cache-import archive.tar.gz` loads it
+into the cache of another host.
+
+The archive holds a member per page, named by the cache name of the page
+(see CacheManager.cached_file_name()), with the uncompressed html and the
+time the page was fetched. The html is stored uncompressed because the zstd
+dictionaries of the exporting host don't exist on the importing one, the
+archive itself is compressed as a whole. Every member carries the sha256 of
+its html in a pax header, which the import verifies; damaged pages are
+skipped. Members with a scrape job in their headers are checked against
+the cache name of the job, too.
+
+Both directions stream the archive page by page, the path '-' is stdout
+or stdin. The export reads the cached pages from the cursors of the cache
+backends as it writes them, so its memory does not grow with the cache.
+The import recompresses the pages as the importing host is configured
+and keeps the newer page when a page is cached already.
+"""
+
+# the suffixes of the archive paths and the compression of the tar stream
+ARCHIVE_FORMATS = (('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2'), ('.tar.xz', 'xz'), ('.tar', ''))
+
+HEADER_PREFIX = 'GoogleScraper.'
+
+JOB_FIELDS = ('query', 'search_engine', 'scrape_method', 'page_number')
+
+# what a cache name looks like, other member names are rejected
+CACHE_NAME = re.compile(r'^[0-9a-f]{64}\.cache$')
+
+
+class CacheArchiveError(Exception):
+    """Used when a cache archive cannot be written or read."""
+    pass
+
+
+def archive_compression(path):
+    """Returns how the tar stream of an archive path is compressed: '', 'gz', 'bz2' or 'xz'."""
+    if path == '-':
+        return 'gz'
+    for suffix, compression in ARCHIVE_FORMATS:
+        if path.endswith(suffix):
+            return compression
+    raise CacheArchiveError('Unknown archive format of {}, use one of: {}'.format(
+        path, ', '.join(suffix for suffix, compression in ARCHIVE_FORMATS)))
+
+
+def open_archive(path, mode):
+    """Open an archive as tar stream for writing ('w') or reading ('r')."""
+    if mode == 'w':
+        stream_mode = 'w|{}'.format(archive_compression(path))
+        if path == '-':
+            return tarfile.open(fileobj=sys.stdout.buffer, mode=stream_mode, format=tarfile.PAX_FORMAT)
+        return tarfile.open(path, mode=stream_mode, format=tarfile.PAX_FORMAT)
+
+    if path == '-':
+        return tarfile.open(fileobj=sys.stdin.buffer, mode='r|*')
+    return tarfile.open(path, mode='r|*')
+
+
+def cached_jobs(session, search_engines):
+    """Yields the scrape jobs of the SERPs in the database that were scraped with some search engines.
+
+    The cache names are hashes, so the search engine of a cached page is only known
+    through the job that fetched it.
+    """
+    rows = session.query(SERP.query, SERP.search_engine_name, SERP.scrape_method, SERP.page_number).filter(
+        SERP.search_engine_name.in_(search_engines)).distinct()
+    for query, search_engine, scrape_method, page_number in rows.yield_per(1000):
+        yield {'query': query, 'search_engine': search_engine, 'scrape_method': scrape_method,
+               'page_number': page_number}
+
+
+def pages_to_export(cache_manager, jobs=None, oldest=0, chunk_size=500):
+    """Yields the (cache name, scrape job or None) of the pages to export.
+
+    Without jobs, the entries of the cache backends are streamed. A page that is
+    cached in the backend and as file is exported from the backend only.
+    """
+    if jobs is not None:
+        for job in jobs:
+            yield cache_manager.cached_file_name(job['query'], job['search_engine'], job['scrape_method'],
+                                                 job['page_number']), job
+        return
+
+    backends = cache_manager._backends()
+    for i, backend in enumerate(backends):
+        entries = backend.iter_entries()
+        while True:
+            chunk = [name for name, size, mtime in itertools.islice(entries, chunk_size) if mtime >= oldest]
+            if not chunk:
+                break
+            shadowed = set()
+            for earlier in backends[:i]:
+                shadowed |= earlier.find(chunk)
+            for name in chunk:
+                if name not in shadowed:
+                    yield name, None
+
+
+def export_cache(cache_manager, path, jobs=None, max_age=None):
+    """Write cached pages to an archive.
+
+    Args:
+        cache_manager: The CacheManager whose pages to export.
+        path: The path of the archive, '-' for stdout. Its suffix determines the compression,
+            see ARCHIVE_FORMATS.
+        jobs: Only export the pages of these scrape jobs. All cached pages when None.
+        max_age: Only export pages younger than this many seconds. Defaults to clean_cache_after.
+
+    Returns:
+        The number of exported pages.
+    """
+    if max_age is None:
+        max_age = 60 * 60 * int(cache_manager.config.get('clean_cache_after', 48))
+    oldest = time.time() - max_age if max_age else 0
+
+    num_exported = 0
+    with open_archive(path, 'w') as tar:
+        for name, job in pages_to_export(cache_manager, jobs, oldest):
+            page = cache_manager._load_cached_page(name)
+            if page is None or page.mtime < oldest:
+                continue
+            try:
+                html = decompress(page.data, page.compression, cache_manager.dictionaries) if page.compression \
+                    else page.data
+            except Exception as e:
+                logger.warning('Cannot export the cached page {}: {}'.format(name, e))
+                continue
+
+            info = tarfile.TarInfo(name)
+            info.size = len(html)
+            info.mtime = page.mtime
+            info.pax_headers = {HEADER_PREFIX + 'sha256': hashlib.sha256(html).hexdigest()}
+            if job is not None:
+                info.pax_headers.update((HEADER_PREFIX + field, str(job[field])) for field in JOB_FIELDS)
+            tar.addfile(info, io.BytesIO(html))
+            # a tar stream remembers all members, which would grow with the archive
+            tar.members = []
+
+            num_exported += 1
+            if num_exported % 10000 == 0:
+                logger.info('Exported {} cached pages.'.format(num_exported))
+
+    logger.info('Exported {} cached pages to {}.'.format(num_exported, path))
+    return num_exported
+
+
+def verify_member(cache_manager, member, html):
+    """Returns why an archive member is damaged or None if it is fine."""
+    if not CACHE_NAME.match(member.name):
+        return 'not a cache name'
+
+    digest = member.pax_headers.get(HEADER_PREFIX + 'sha256')
+    if digest is None:
+        return 'no sha256'
+    if hashlib.sha256(html).hexdigest() != digest:
+        return 'sha256 mismatch'
+
+    job = {field: member.pax_headers.get(HEADER_PREFIX + field) for field in JOB_FIELDS}
+    if all(job.values()):
+        try:
+            name = cache_manager.cached_file_name(job['query'], job['search_engine'], job['scrape_method'],
+                                                  int(job['page_number']))
+        except ValueError:
+            return 'invalid page number'
+        if name != member.name:
+            return 'name does not match its scrape job'
+    return None
+
+
+def import_cache(cache_manager, path, max_age=None):
+    """Load the pages of an archive into the cache.
+
+    Args:
+        cache_manager: The CacheManager to import into.
+        path: The path of the archive, '-' for stdin.
+        max_age: Skip pages older than this many seconds. Defaults to clean_cache_after.
+
+    Returns:
+        A dictionary with the number of imported pages, skipped pages (expired or cached
+        with a newer page already) and damaged pages.
+    """
+    if max_age is None:
+        max_age = 60 * 60 * int(cache_manager.config.get('clean_cache_after', 48))
+    oldest = time.time() - max_age if max_age else 0
+
+    stats = {'imported': 0, 'skipped': 0, 'damaged': 0}
+    try:
+        tar = open_archive(path, 'r')
+    except tarfile.TarError as e:
+        raise CacheArchiveError('Cannot read the cache archive {}: {}'.format(path, e))
+
+    with tar:
+        while True:
+            try:
+                member = tar.next()
+            except tarfile.TarError as e:
+                raise CacheArchiveError('The cache archive {} is damaged: {}'.format(path, e))
+            if member is None:
+                break
+            # a tar stream remembers all members, which would grow with the archive
+            tar.members = []
+            if not member.isfile():
+                continue
+
+            html = tar.extractfile(member).read()
+            problem = verify_member(cache_manager, member, html)
+            if problem:
+                logger.warning('Skipping the damaged page {} of the cache archive: {}'.format(member.name, problem))
+                stats['damaged'] += 1
+                continue
+
+            stored = cache_manager._load_cached_page(member.name)
+            if member.mtime < oldest or (stored is not None and stored.mtime >= member.mtime):
+                stats['skipped'] += 1
+                continue
+
+            data, algorithm = cache_manager._encode_page(html, member.pax_headers.get(HEADER_PREFIX + 'search_engine'))
+            cache_manager.backend.put(member.name, data, algorithm, mtime=member.mtime)
+            if stored is not None and cache_manager.parsed_results is not None:
+                # the results parsed from the replaced page
+                cache_manager.parsed_results.remove([member.name])
+            stats['imported'] += 1
+            if stats['imported'] % 10000 == 0:
+                logger.info('Imported {} cached pages.'.format(stats['imported']))
+
+    logger.info('Imported {imported} cached pages, skipped {skipped} old and {damaged} damaged pages.'.format(**stats))
+    return stats
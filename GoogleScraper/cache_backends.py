@@ -0,0 +1,799 @@
+# -*- coding: utf-8 -*-
+
+import os
+import abc
+import time
+import struct
+import socket
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import collections
+import logging
+from GoogleScraper.compression import ALGORITHMS, decompress
+
+logger = logging.getLogger(__name__)
+
+"""
+The storages of the cached SERP pages.
+
+The CacheManager decides what is cached under which name and compresses
+the pages. A CacheBackend only stores the (possibly compressed) bytes of a
+page by its cache name, together with its compression and the time it was
+cached:
+
+'files': FileBackend, one file per page in the cache directory, found through
+         the CacheIndex.
+'pack':  PackBackend, appended to the pack files of a PackStore.
+'kv':    KeyValueBackend, on a key-value server that several hosts share, so
+         a keyword that one host scraped is a cache hit on all others.
+'dedup': DedupBackend, content addressed: every distinct page is stored once.
+
+Many pages are identical after the html is minimized: pages without results,
+captcha pages or the same SERP scraped with several scrape methods. The
+DedupBackend stores the bodies as blobs named by the sha256 of the
+uncompressed html in the blobs/ subdirectory of the cache directory. An
+sqlite database next to them maps the cache names to the blobs and counts
+the references of every blob, a blob is removed with its last reference.
+
+The key-value server is spoken to with the redis protocol (RESP), so a redis
+server can be used. cache_server.KeyValueServer is a small stand-in that
+implements the few commands the backend needs. Each page is stored under
+{cache_key_prefix}{cache name} as
+
+    mtime (8, double) | compression length (1) | compression | data
+
+and expires on the server after clean_cache_after hours. Lookups of many
+pages, like the check which jobs of a scrape are cached, are pipelined:
+all commands of a chunk are sent at once and the replies are read
+afterwards, which costs one round trip per chunk instead of one per page.
+"""
+
+CachedPage = collections.namedtuple('CachedPage', ['name', 'data', 'compression', 'mtime'])
+
+
+def write_atomically(path, data, mtime=None):
+    """Write bytes to a file such that readers see either the old or the new file.
+
+    The data is written to a temporary file in the same directory, which is then
+    renamed to path. Concurrent writers of the same path don't interleave, the last
+    rename wins. The file gets the modification time mtime, if given.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        if mtime is not None:
+            os.utime(tmp, (mtime, mtime))
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def iter_rows(lock, connection, query, chunk_size=1000):
+    """Yields the rows of an sqlite query ordered by their first column, the name, in chunks.
+
+    The lock is only held while a chunk is read. The query selects the name first and
+    ends with a "name > ?" condition, it is completed with the ORDER BY and LIMIT.
+    """
+    last = ''
+    while True:
+        with lock:
+            rows = connection().execute(query + ' ORDER BY name LIMIT ?', (last, chunk_size)).fetchall()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+class CacheBackendError(Exception):
+    """Used when a cache backend cannot reach its storage."""
+    pass
+
+
+class CacheBackend(metaclass=abc.ABCMeta):
+    """Stores the cached pages by their cache name, see CacheManager.cached_file_name()."""
+
+    @abc.abstractmethod
+    def get(self, name):
+        """Returns the CachedPage of a name or None."""
+
+    def get_many(self, names):
+        """Returns a dictionary of the names that are cached to their CachedPages."""
+        pages = {}
+        for name in names:
+            page = self.get(name)
+            if page is not None:
+                pages[name] = page
+        return pages
+
+    def find(self, names):
+        """Returns the set of the names that are cached, without reading the pages."""
+        return set(self.get_many(names))
+
+    @abc.abstractmethod
+    def put(self, name, data, compression='', mtime=None):
+        """Store a page.
+
+        Args:
+            name: The cache name of the page.
+            data: The bytes of the page.
+            compression: How data is compressed: '' or one of compression.ALGORITHMS.
+            mtime: When the page was fetched, now if None.
+        """
+
+    @abc.abstractmethod
+    def remove(self, names):
+        """Remove the pages of some names. Names that are not cached are ignored."""
+
+    def names(self):
+        """Returns the names of all cached pages."""
+        return [name for name, size, mtime in self.entries()]
+
+    @abc.abstractmethod
+    def entries(self):
+        """Returns a (name, size, mtime) tuple for every cached page."""
+
+    def iter_entries(self):
+        """Yields a (name, size, mtime) tuple for every cached page, without holding all of them in memory."""
+        return iter(self.entries())
+
+    def expire(self, timestamp):
+        """Remove the pages that were cached before timestamp."""
+        self.remove(name for name, size, mtime in self.entries() if mtime < timestamp)
+
+    def close(self):
+        pass
+
+
+class FileBackend(CacheBackend):
+    """One (possibly compressed) file per page in the cache directory."""
+
+    def __init__(self, cachedir, layout='sharded', index=None):
+        """Create a new file backend.
+
+        Args:
+            cachedir: The cache directory.
+            layout: 'sharded' or 'flat', see cache_file_path().
+            index: The CacheIndex of the cache directory or None to look up the files on disk.
+        """
+        self.cachedir = cachedir
+        self.layout = layout
+        self.index = index
+
+    def cache_file_path(self, name):
+        """Returns the path of a cache file relative to the cache directory.
+
+        With the sharded layout, the files are spread over two levels of
+        subdirectories named by the first four characters of the hash:
+        ab/cd/abcd....cache. Otherwise all files are directly in the cache directory.
+        """
+        if self.layout == 'sharded':
+            return os.path.join(name[:2], name[2:4], name)
+        return name
+
+    def path(self, name):
+        """Returns the path of the file of a name or None if the page is not cached."""
+        if self.index is not None:
+            entry = self.index.get(name)
+            return os.path.join(self.cachedir, entry.path) if entry else None
+        return self.find_file(name)
+
+    def find_file(self, name):
+        """Look for a cache file in both layouts and with all compression extensions."""
+        for path in (os.path.join(name[:2], name[2:4], name), name):
+            for fname in [path] + ['{}.{}'.format(path, ext) for ext in ALGORITHMS]:
+                if os.path.exists(os.path.join(self.cachedir, fname)):
+                    return os.path.join(self.cachedir, fname)
+        return None
+
+    def all_files(self):
+        """Returns the paths of all files with "cache" in their name below the cache directory."""
+        files = set()
+        for dirpath, dirnames, filenames in os.walk(self.cachedir):
+            for fname in filenames:
+                if 'cache' in fname:
+                    files.add(os.path.join(dirpath, fname))
+        return files
+
+    def split_name(self, fname):
+        """Returns the name without compression extension and the compression of a cache file name."""
+        for ext in ALGORITHMS:
+            if fname.endswith('.' + ext):
+                return fname[:-len(ext) - 1], ext
+        return fname, ''
+
+    def paths(self):
+        """Returns a dictionary of the names to the paths of their files relative to the cache directory."""
+        if self.index is not None:
+            return {entry.name: entry.path for entry in self.index.entries()}
+        return {self.split_name(os.path.basename(path))[0]: os.path.relpath(path, self.cachedir)
+                for path in self.all_files()}
+
+    def get(self, name):
+        path = self.path(name)
+        if not path:
+            return None
+
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            # maybe the file was moved by CacheManager.migrate_cache_layout() in the meantime
+            path = self.find_file(name)
+            if self.index is not None:
+                if path:
+                    self.index.add(os.path.relpath(path, self.cachedir))
+                else:
+                    self.index.remove(name)
+            if not path:
+                return None
+            mtime = os.path.getmtime(path)
+
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            return None
+        return CachedPage(name, data, self.split_name(os.path.basename(path))[1], mtime)
+
+    def find(self, names):
+        names = set(names)
+        if self.index is not None:
+            return set(self.index.get_many(names))
+        if len(names) <= 10:
+            return {name for name in names if self.find_file(name)}
+        return names & self.paths().keys()
+
+    def put(self, name, data, compression='', mtime=None):
+        path = os.path.join(self.cachedir, self.cache_file_path(name))
+        if compression:
+            path = '{}.{}'.format(path, compression)
+        if self.index is not None:
+            # opened before the file changes the directory, which would make the index look stale
+            self.index.connection()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomically(path, data, mtime=mtime)
+        if self.index is not None:
+            self.index.add(os.path.relpath(path, self.cachedir))
+
+    def remove(self, names):
+        for name in names:
+            path = self.path(name)
+            if path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                if self.index is not None:
+                    self.index.remove(name)
+
+    def names(self):
+        return list(self.paths())
+
+    def entries(self):
+        if self.index is not None:
+            return [(entry.name, entry.size, entry.mtime) for entry in self.index.entries()]
+        entries = []
+        for path in self.all_files():
+            stat = os.stat(path)
+            entries.append((self.split_name(os.path.basename(path))[0], stat.st_size, stat.st_mtime))
+        return entries
+
+    def iter_entries(self):
+        if self.index is not None:
+            for entry in self.index.iter_entries():
+                yield entry.name, entry.size, entry.mtime
+            return
+        for dirpath, dirnames, filenames in os.walk(self.cachedir):
+            for fname in filenames:
+                if 'cache' in fname:
+                    try:
+                        stat = os.stat(os.path.join(dirpath, fname))
+                    except FileNotFoundError:
+                        continue
+                    yield self.split_name(fname)[0], stat.st_size, stat.st_mtime
+
+    def expire(self, timestamp):
+        if self.index is not None:
+            # only the rows of the expired files are removed from the index, without a directory walk
+            expired = self.index.older_than(timestamp)
+            for entry in expired:
+                try:
+                    os.remove(os.path.join(self.cachedir, entry.path))
+                except FileNotFoundError:
+                    # another process expired the same cache
+                    pass
+            self.index.remove_many(entry.name for entry in expired)
+            return
+
+        for path in self.all_files():
+            try:
+                if os.path.getmtime(path) < timestamp:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+
+
+class PackBackend(CacheBackend):
+    """The pages in the pack files of a PackStore."""
+
+    def __init__(self, packs):
+        self.packs = packs
+
+    def get(self, name):
+        for attempt in range(2):
+            entry = self.packs.get(name)
+            if entry is None:
+                return None
+            try:
+                return CachedPage(name, self.packs.pread(entry), entry.compression, entry.mtime)
+            except FileNotFoundError:
+                # the pack was removed by compact() after the lookup
+                pass
+        return None
+
+    def find(self, names):
+        return set(self.packs.get_many(names))
+
+    def put(self, name, data, compression='', mtime=None):
+        self.packs.put_raw(name, data, compression, mtime=mtime)
+
+    def remove(self, names):
+        for name in names:
+            self.packs.remove(name)
+
+    def names(self):
+        return self.packs.names()
+
+    def entries(self):
+        with self.packs.lock:
+            return self.packs.connection().execute('SELECT name, length, mtime FROM entries').fetchall()
+
+    def iter_entries(self):
+        return iter_rows(self.packs.lock, self.packs.connection,
+                         'SELECT name, length, mtime FROM entries WHERE name > ?')
+
+    def expire(self, timestamp):
+        self.packs.expire(timestamp)
+
+    def close(self):
+        self.packs.close()
+
+
+class DedupBackend(CacheBackend):
+    """The pages as content addressed blobs, identical pages are stored once."""
+
+    def __init__(self, cachedir, dictionaries=None):
+        """Create a new dedup backend. The database is opened on first use.
+
+        Args:
+            cachedir: The cache directory. The blobs are stored in its subdirectory blobs/.
+            dictionaries: The DictionaryStore to decompress zstd pages with, to hash pages that are
+                put without digest.
+        """
+        self.directory = os.path.join(cachedir, 'blobs')
+        self.dictionaries = dictionaries
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+
+    def connection(self):
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                # a forked process must not use the connection of its parent
+                self.pid = os.getpid()
+                os.makedirs(self.directory, exist_ok=True)
+                self.conn = sqlite3.connect(os.path.join(self.directory, 'blobs.sqlite'), timeout=60,
+                                            check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode = WAL')
+                self.conn.execute('PRAGMA synchronous = NORMAL')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, compression TEXT, '
+                                  'size INTEGER, refs INTEGER) WITHOUT ROWID')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS refs (name TEXT PRIMARY KEY, digest TEXT, '
+                                  'mtime REAL) WITHOUT ROWID')
+                self.conn.execute('CREATE INDEX IF NOT EXISTS refs_digest ON refs (digest)')
+            return self.conn
+
+    def blob_path(self, digest, compression):
+        """Returns the path of a blob: blobs/ab/abcd...[.compression]."""
+        fname = '{}.{}'.format(digest, compression) if compression else digest
+        return os.path.join(self.directory, digest[:2], fname)
+
+    def digest(self, data, compression=''):
+        """Returns the sha256 of the uncompressed data of a page."""
+        if compression:
+            data = decompress(data, compression, self.dictionaries)
+        return hashlib.sha256(data).hexdigest()
+
+    def lookup(self, names):
+        """Returns a dictionary of names to (digest, compression, mtime)."""
+        names = list(names)
+        found = {}
+        with self.lock:
+            conn = self.connection()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                found.update((name, (digest, compression, mtime)) for name, digest, compression, mtime in conn.execute(
+                    'SELECT name, digest, compression, mtime FROM refs JOIN blobs USING (digest) '
+                    'WHERE name IN ({})'.format(', '.join('?' * len(chunk))), chunk))
+        return found
+
+    def get(self, name):
+        return self.get_many([name]).get(name)
+
+    def get_many(self, names):
+        pages = {}
+        for name, (digest, compression, mtime) in self.lookup(names).items():
+            try:
+                with open(self.blob_path(digest, compression), 'rb') as fd:
+                    pages[name] = CachedPage(name, fd.read(), compression, mtime)
+            except FileNotFoundError:
+                # the last reference was removed after the lookup
+                pass
+        return pages
+
+    def find(self, names):
+        return set(self.lookup(names))
+
+    def link(self, name, digest, mtime=None):
+        """Let a name refer to a stored blob.
+
+        Returns:
+            Whether the blob exists. If not, the page has to be put().
+        """
+        with self.lock:
+            conn = self.connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                exists = conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone() is not None
+                if exists:
+                    self.add_reference(conn, name, digest, mtime)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return exists
+
+    def put(self, name, data, compression='', mtime=None, digest=None):
+        """Store a page, see CacheBackend.put().
+
+        Args:
+            digest: The sha256 of the uncompressed page, computed if None.
+        """
+        if digest is None:
+            digest = self.digest(data, compression)
+        with self.lock:
+            conn = self.connection()
+            # the write lock of the database keeps a blob from being removed while it is linked again
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone() is None:
+                    path = self.blob_path(digest, compression)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    write_atomically(path, data)
+                    conn.execute('INSERT INTO blobs VALUES (?, ?, ?, 0)', (digest, compression, len(data)))
+                self.add_reference(conn, name, digest, mtime)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def add_reference(self, conn, name, digest, mtime=None):
+        """Point a name to a blob, in the transaction of the caller."""
+        row = conn.execute('SELECT digest FROM refs WHERE name = ?', (name,)).fetchone()
+        conn.execute('INSERT OR REPLACE INTO refs VALUES (?, ?, ?)',
+                     (name, digest, time.time() if mtime is None else mtime))
+        if row is None or row[0] != digest:
+            conn.execute('UPDATE blobs SET refs = refs + 1 WHERE digest = ?', (digest,))
+            if row is not None:
+                self.release(conn, [row[0]])
+
+    def release(self, conn, digests):
+        """Drop a reference to each of some blobs and remove the blobs without references."""
+        for digest in digests:
+            conn.execute('UPDATE blobs SET refs = refs - 1 WHERE digest = ?', (digest,))
+            row = conn.execute('SELECT compression, refs FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is not None and row[1] <= 0:
+                conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                try:
+                    os.remove(self.blob_path(digest, row[0]))
+                except FileNotFoundError:
+                    pass
+
+    def remove(self, names):
+        names = list(names)
+        with self.lock:
+            conn = self.connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for i in range(0, len(names), 500):
+                    chunk = names[i:i + 500]
+                    placeholders = ', '.join('?' * len(chunk))
+                    digests = [row[0] for row in conn.execute(
+                        'SELECT digest FROM refs WHERE name IN ({})'.format(placeholders), chunk)]
+                    conn.execute('DELETE FROM refs WHERE name IN ({})'.format(placeholders), chunk)
+                    self.release(conn, digests)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def names(self):
+        with self.lock:
+            return [row[0] for row in self.connection().execute('SELECT name FROM refs')]
+
+    def entries(self):
+        # the size of a page is its share of its blob, so the sizes of all pages add up to the size of the blobs
+        with self.lock:
+            return self.connection().execute(
+                'SELECT name, CAST(size AS REAL) / refs, mtime FROM refs JOIN blobs USING (digest)').fetchall()
+
+    def iter_entries(self):
+        return iter_rows(self.lock, self.connection,
+                         'SELECT name, CAST(size AS REAL) / refs, mtime FROM refs JOIN blobs USING (digest) '
+                         'WHERE name > ?')
+
+    def report(self):
+        """Returns how much space the deduplication saves.
+
+        Returns:
+            A dictionary with the number of pages and blobs, the bytes the pages would take
+            without deduplication and the bytes of the blobs.
+        """
+        with self.lock:
+            conn = self.connection()
+            num_pages, page_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM refs JOIN blobs USING (digest)').fetchone()
+            num_blobs, blob_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return {
+            'pages': num_pages,
+            'blobs': num_blobs,
+            'page_bytes': page_bytes,
+            'blob_bytes': blob_bytes,
+            'saved_bytes': page_bytes - blob_bytes,
+            'saved_ratio': round(1 - blob_bytes / page_bytes, 4) if page_bytes else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
+
+
+class RespError(Exception):
+    """An error reply of a redis protocol server."""
+    pass
+
+
+def encode_command(args):
+    """Encode a command as a RESP array of bulk strings."""
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n' % len(arg))
+        parts.append(arg)
+        parts.append(b'\r\n')
+    return b''.join(parts)
+
+
+def read_reply(fd):
+    """Read one RESP value from a file object.
+
+    Returns:
+        bytes for simple and bulk strings, int for integers, a list for arrays, None for
+        null values and a RespError instance for errors.
+
+    Raises:
+        ConnectionError: When the connection was closed.
+    """
+    line = fd.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('The connection was closed.')
+    kind, value = line[:1], line[1:-2]
+    if kind == b'+':
+        return value
+    elif kind == b'-':
+        return RespError(value.decode(errors='replace'))
+    elif kind == b':':
+        return int(value)
+    elif kind == b'$':
+        length = int(value)
+        if length < 0:
+            return None
+        data = fd.read(length + 2)
+        if len(data) < length + 2:
+            raise ConnectionError('The connection was closed.')
+        return data[:-2]
+    elif kind == b'*':
+        length = int(value)
+        if length < 0:
+            return None
+        return [read_reply(fd) for i in range(length)]
+    raise ConnectionError('Invalid reply: {!r}'.format(line[:50]))
+
+
+class RespConnection(object):
+    """A connection to a redis protocol server that sends commands in pipelines."""
+
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.sock = socket.create_connection(address, timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.fd = self.sock.makefile('rb')
+
+    def pipeline(self, commands):
+        """Send commands at once and return their replies, which may be RespErrors."""
+        self.sock.sendall(b''.join(encode_command(command) for command in commands))
+        return [read_reply(self.fd) for command in commands]
+
+    def close(self):
+        self.fd.close()
+        self.sock.close()
+
+
+VALUE_HEADER = struct.Struct('<dB')
+
+
+class KeyValueBackend(CacheBackend):
+    """The pages on a key-value server that speaks the redis protocol."""
+
+    def __init__(self, address, prefix='googlescraper:', ttl=0, timeout=10, chunk_size=500):
+        """Create a new key-value backend. Connections are opened on first use.
+
+        Args:
+            address: The (host, port) tuple or "host:port" string of the server.
+            prefix: Prepended to the names of the pages to make the keys.
+            ttl: Seconds after which the server removes a page, 0 to keep the pages.
+            timeout: The socket timeout in seconds.
+            chunk_size: How many commands to send in one pipeline.
+        """
+        if isinstance(address, str):
+            host, _, port = address.rpartition(':')
+            address = (host or 'localhost', int(port))
+        self.address = address
+        self.prefix = prefix
+        self.ttl = int(ttl)
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        # every thread has its own connection, a forked process opens new ones
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def key(self, name):
+        return (self.prefix + name).encode()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            try:
+                conn = RespConnection(self.address, self.timeout)
+            except OSError as e:
+                raise CacheBackendError('Cannot connect to the cache server {}:{}: {}'.format(*self.address, e))
+            self.local.conn, self.local.pid = conn, os.getpid()
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def pipeline(self, commands):
+        """Execute commands in pipelines of chunk_size commands and return their replies.
+
+        A broken connection is opened again once.
+
+        Raises:
+            CacheBackendError: When the server cannot be reached or answers with an error.
+        """
+        replies = []
+        for i in range(0, len(commands), self.chunk_size):
+            chunk = commands[i:i + self.chunk_size]
+            for attempt in range(2):
+                try:
+                    chunk_replies = self.connection().pipeline(chunk)
+                    break
+                except OSError as e:
+                    self.local.conn = None
+                    if attempt:
+                        raise CacheBackendError('Lost the connection to the cache server {}:{}: {}'.format(
+                            *self.address, e))
+            for reply in chunk_replies:
+                if isinstance(reply, RespError):
+                    raise CacheBackendError('The cache server {}:{} failed: {}'.format(*self.address, reply))
+            replies.extend(chunk_replies)
+        return replies
+
+    def encode_value(self, data, compression, mtime=None):
+        header = VALUE_HEADER.pack(time.time() if mtime is None else mtime, len(compression))
+        return header + compression.encode() + data
+
+    def decode_value(self, name, value):
+        mtime, length = VALUE_HEADER.unpack_from(value)
+        start = VALUE_HEADER.size + length
+        return CachedPage(name, value[start:], value[VALUE_HEADER.size:start].decode(), mtime)
+
+    def get(self, name):
+        return self.get_many([name]).get(name)
+
+    def get_many(self, names):
+        names = list(names)
+        try:
+            values = self.pipeline([(b'GET', self.key(name)) for name in names])
+        except CacheBackendError as e:
+            logger.warning(e)
+            return {}
+        return {name: self.decode_value(name, value) for name, value in zip(names, values) if value is not None}
+
+    def find(self, names):
+        names = list(names)
+        try:
+            replies = self.pipeline([(b'EXISTS', self.key(name)) for name in names])
+        except CacheBackendError as e:
+            logger.warning(e)
+            return set()
+        return {name for name, exists in zip(names, replies) if exists}
+
+    def put(self, name, data, compression='', mtime=None):
+        command = [b'SET', self.key(name), self.encode_value(data, compression, mtime)]
+        if self.ttl:
+            command += [b'EX', self.ttl]
+        try:
+            self.pipeline([command])
+        except CacheBackendError as e:
+            logger.error('Cannot cache {}: {}'.format(name, e))
+
+    def remove(self, names):
+        self.pipeline([(b'DEL', self.key(name)) for name in names])
+
+    def key_chunks(self):
+        """Yields the keys with our prefix in chunks, scanned in steps so that the server is not blocked."""
+        pattern = self.prefix.replace('\\', '\\\\').replace('*', '\\*').replace('?', '\\?').replace('[', '\\[')
+        cursor = b'0'
+        while True:
+            cursor, chunk = self.pipeline([(b'SCAN', cursor, b'MATCH', pattern + '*', b'COUNT', 1000)])[0]
+            yield chunk
+            if cursor == b'0':
+                return
+
+    def keys(self):
+        """Returns the keys with our prefix."""
+        return [key for chunk in self.key_chunks() for key in chunk]
+
+    def names(self):
+        return [key.decode()[len(self.prefix):] for key in self.keys()]
+
+    def entries(self):
+        return list(self.iter_entries())
+
+    def iter_entries(self):
+        for keys in self.key_chunks():
+            if not keys:
+                continue
+            replies = self.pipeline([command for key in keys for command in
+                                     ((b'STRLEN', key), (b'GETRANGE', key, 0, VALUE_HEADER.size - 1))])
+            for i, key in enumerate(keys):
+                size, header = replies[2 * i:2 * i + 2]
+                if len(header) == VALUE_HEADER.size:
+                    # the page may have expired between the scan and the lookup
+                    yield key.decode()[len(self.prefix):], size, VALUE_HEADER.unpack(header)[0]
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.close()
+                except OSError:
+                    pass
+            self.connections = []
+        self.local = threading.local()
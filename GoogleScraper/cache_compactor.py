@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import heapq
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Keeps the cache within a quota of bytes and/or entries.
+
+The CacheManager counts its hits and misses in CacheStats and remembers
+when and how often each cached page was read. A CacheCompactor thread
+periodically writes these accesses to the UsageLog, an sqlite database in
+the usage/ subdirectory of the cache directory, and checks the size of the
+cache in the cache index:
+
+1. Pages older than clean_cache_after hours are removed, they are misses anyway.
+2. When the cache is above cache_max_bytes or cache_max_entries, pages are
+   evicted until it is 10% below: the least recently read ones first ('lru')
+   or the least often read ones first ('lfu'). Pages that were never read
+   count as read when they were cached. With the dedup backend, a page
+   counts with its share of the blob it refers to, so every blob counts
+   once.
+3. With the pack backend, the packs are compacted when more than half of
+   them is garbage.
+
+All of this runs in the compactor thread, the scrape threads only update
+counters in memory. The accesses are only collected while a compactor
+exists, nothing else drains them.
+"""
+
+
+class CacheStats(object):
+    """Counts the hits, misses and evictions of a cache and collects the accesses of the pages."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired_entries = 0
+        self.evicted_entries = 0
+        self.evicted_bytes = 0
+
+        # name => (last access, number of accesses) since the last flush
+        self.accesses = {}
+        # whether a CacheCompactor takes the accesses
+        self.track_accesses = False
+
+    def hit(self, name):
+        with self.lock:
+            self.hits += 1
+            if self.track_accesses:
+                atime, count = self.accesses.get(name, (0, 0))
+                self.accesses[name] = (time.time(), count + 1)
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def evicted(self, num_entries, num_bytes, expired=False):
+        with self.lock:
+            if expired:
+                self.expired_entries += num_entries
+            else:
+                self.evicted_entries += num_entries
+            self.evicted_bytes += num_bytes
+
+    def take_accesses(self):
+        """Returns and resets the accesses since the last call."""
+        with self.lock:
+            accesses, self.accesses = self.accesses, {}
+        return accesses
+
+    def hit_ratio(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self):
+        hit_ratio = self.hit_ratio()
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(hit_ratio, 4),
+                'expired_entries': self.expired_entries,
+                'evicted_entries': self.evicted_entries,
+                'evicted_bytes': round(self.evicted_bytes),
+            }
+
+
+class UsageLog(object):
+    """Persists when and how often the cached pages were read."""
+
+    def __init__(self, cachedir):
+        self.directory = os.path.join(cachedir, 'usage')
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+
+    def connection(self):
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                # a forked process must not use the connection of its parent
+                self.pid = os.getpid()
+                os.makedirs(self.directory, exist_ok=True)
+                self.conn = sqlite3.connect(os.path.join(self.directory, 'usage.sqlite'), timeout=60,
+                                            check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode = WAL')
+                self.conn.execute('PRAGMA synchronous = NORMAL')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS usage (name TEXT PRIMARY KEY, atime REAL, '
+                                  'hits INTEGER) WITHOUT ROWID')
+            return self.conn
+
+    def record(self, accesses):
+        """Add accesses as returned by CacheStats.take_accesses()."""
+        with self.lock:
+            conn = self.connection()
+            conn.executemany('INSERT INTO usage VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET '
+                             'atime = MAX(atime, excluded.atime), hits = hits + excluded.hits',
+                             ((name, atime, hits) for name, (atime, hits) in accesses.items()))
+            conn.commit()
+
+    def usage(self):
+        """Returns a dictionary of the names to (last access, number of accesses)."""
+        with self.lock:
+            return {name: (atime, hits) for name, atime, hits in self.connection().execute('SELECT * FROM usage')}
+
+    def remove(self, names):
+        names = list(names)
+        with self.lock:
+            conn = self.connection()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                conn.execute('DELETE FROM usage WHERE name IN ({})'.format(', '.join('?' * len(chunk))), chunk)
+            conn.commit()
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
+
+
+class CacheCompactor(threading.Thread):
+    """Expires and evicts cached pages in the background."""
+
+    def __init__(self, cache_manager, max_bytes=0, max_entries=0, policy='lru', interval=60, max_age=48 * 60 * 60):
+        """Create a new compactor. Call start() to run it.
+
+        Args:
+            cache_manager: The CacheManager whose cache to keep within the quota.
+            max_bytes: The maximal size of the cached pages, 0 for no limit.
+            max_entries: The maximal number of cached pages, 0 for no limit.
+            policy: Which pages to evict first: 'lru' or 'lfu'.
+            interval: Seconds between two runs.
+            max_age: Pages older than this many seconds are removed, 0 to keep them.
+        """
+        super().__init__(name='CacheCompactor', daemon=True)
+        assert policy in ('lru', 'lfu'), 'Invalid cache eviction policy: {}'.format(policy)
+        self.cache_manager = cache_manager
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy
+        self.interval = interval
+        self.max_age = max_age
+
+        self.usage_log = UsageLog(cache_manager.config.get('cachedir', '.scrapecache'))
+        self.stopped = threading.Event()
+        cache_manager.stats.track_accesses = True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.run_once()
+
+    def stop(self):
+        """Stop the thread and save the accesses since its last run."""
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        self.cache_manager.stats.track_accesses = False
+        accesses = self.cache_manager.stats.take_accesses()
+        if accesses:
+            self.usage_log.record(accesses)
+        self.usage_log.close()
+
+    def run_once(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error('Cannot compact the cache: {}'.format(e))
+
+    def eviction_key(self, usage):
+        """Returns a function of a (name, size, mtime) entry that sorts the entries to evict first first."""
+        if self.policy == 'lfu':
+            def key(entry):
+                atime, hits = usage.get(entry[0], (entry[2], 0))
+                return hits, atime
+        else:
+            def key(entry):
+                return usage.get(entry[0], (entry[2], 0))[:1]
+        return key
+
+    def eviction_candidates(self, excess_bytes, excess_entries, oldest=None):
+        """Stream the entries and keep the first ones in eviction order that cover the excess.
+
+        Only the candidates are held in memory, in a heap whose top is the one to evict last.
+
+        Returns:
+            The entries to evict, in eviction order.
+        """
+        key = self.eviction_key(self.usage_log.usage())
+        heap, size = [], 0
+        for i, entry in enumerate(self.cache_manager.iter_cache_entries()):
+            if oldest is not None and entry[2] < oldest:
+                continue
+            heapq.heappush(heap, (tuple(-value for value in key(entry)), -i, entry))
+            size += entry[1]
+            # drop the last candidate while the others still cover the excess
+            while len(heap) > excess_entries and size - heap[0][2][1] >= excess_bytes:
+                size -= heapq.heappop(heap)[2][1]
+        return [entry for k, i, entry in sorted(heap, reverse=True)]
+
+    def evict(self, entries, expired=False):
+        if not entries:
+            return
+        names = [name for name, size, mtime in entries]
+        self.cache_manager.evict(names)
+        self.usage_log.remove(names)
+        self.cache_manager.stats.evicted(len(entries), sum(size for name, size, mtime in entries), expired=expired)
+
+    def compact(self):
+        """Record the accesses, remove the expired pages and evict pages until the cache is within its quota.
+
+        The entries of the cache are streamed, only the expired pages of a chunk and the pages
+        to evict are held in memory.
+        """
+        accesses = self.cache_manager.stats.take_accesses()
+        if accesses:
+            self.usage_log.record(accesses)
+
+        oldest = time.time() - self.max_age if self.max_age else None
+        size = num_entries = 0
+        expired = []
+        for entry in self.cache_manager.iter_cache_entries():
+            if oldest is not None and entry[2] < oldest:
+                expired.append(entry)
+                if len(expired) >= 1000:
+                    self.evict(expired, expired=True)
+                    expired = []
+            else:
+                size += entry[1]
+                num_entries += 1
+        self.evict(expired, expired=True)
+
+        too_big = self.max_bytes and size > self.max_bytes
+        too_many = self.max_entries and num_entries > self.max_entries
+        if too_big or too_many:
+            # evict down to 90% of the quota, so that not every run has to evict
+            excess_bytes = size - self.max_bytes * 0.9 if self.max_bytes else 0
+            excess_entries = num_entries - int(self.max_entries * 0.9) if self.max_entries else 0
+
+            evicted = self.eviction_candidates(excess_bytes, excess_entries, oldest)
+            self.evict(evicted)
+            evicted_bytes = sum(entry[1] for entry in evicted)
+            logger.info('Evicted {} cached pages with {:.0f} bytes, {} pages with {:.0f} bytes remain.'.format(
+                len(evicted), evicted_bytes, num_entries - len(evicted), size - evicted_bytes))
+
+        packs = self.cache_manager.packs
+        if packs is not None:
+            total, live = packs.garbage()
+            if total > 2 * live:
+                packs.compact()
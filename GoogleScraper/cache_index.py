@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import threading
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+A persistent index of the files in the cache directory.
+
+Looking up a cached SERP used to list the whole cache directory, which
+takes hundreds of milliseconds with millions of cache files. The
+CacheIndex maps the name of a cache file (without compression extension)
+to its path relative to the cache directory, its size, its mtime and its
+compression. It is stored in a sqlite database in the index/ subdirectory
+of the cache directory, which is memory mapped, so a lookup is a single
+b-tree search without touching the directory. The database is shared by
+the processes of a scrape: it is written in WAL mode and waits for the
+locks of the others. Only a database that fails its integrity check is
+recreated, not one that is merely locked.
+
+The index is updated whenever the CacheManager writes or removes a cache
+file. When the modification time of the cache directory differs from the
+one recorded in the index (for example because cache files were copied
+into it), or the index is missing or corrupt, the index is rebuilt with
+one scan of the cache directory. Files that are added to existing
+subdirectories by other programs are not noticed; rebuild the index
+with rebuild_cache_index = True after doing so.
+"""
+
+CacheEntry = collections.namedtuple('CacheEntry', ['name', 'path', 'size', 'mtime', 'compression'])
+
+
+class CacheIndex(object):
+    """Maps cache file names to their location, size, mtime and compression."""
+
+    # the subdirectory of the database, its WAL files don't change the mtime of the cache directory
+    dirname = 'index'
+    filename = 'index.sqlite'
+
+    def __init__(self, cachedir, compression_algorithms=('gz', 'bz2'), mmap_size=256 * 1024 * 1024):
+        """Create a new index. The database is opened on first use.
+
+        Args:
+            cachedir: The cache directory.
+            compression_algorithms: The file extensions of compressed cache files.
+            mmap_size: How many bytes of the index sqlite may memory map.
+        """
+        self.cachedir = cachedir
+        self.directory = os.path.join(cachedir, self.dirname)
+        self.path = os.path.join(self.directory, self.filename)
+        self.compression_algorithms = compression_algorithms
+        self.mmap_size = mmap_size
+
+        self.lock = threading.RLock()
+        self.conn = None
+
+        # a forked process must not use the connection of its parent
+        self.pid = None
+
+    def connection(self):
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                self.open()
+            return self.conn
+
+    def open(self):
+        self.pid = os.getpid()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        try:
+            self.conn = self.connect()
+            stale = self.dir_mtime() != self.get_meta('dir_mtime')
+        except sqlite3.DatabaseError as e:
+            if not self.is_corrupt(e):
+                raise
+            logger.warning('The cache index {} is corrupt, recreating it: {}'.format(self.path, e))
+            for path in (self.path, self.path + '-wal', self.path + '-shm'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.conn = self.connect()
+            stale = True
+
+        if stale:
+            self.rebuild()
+
+    def is_corrupt(self, error):
+        """Returns whether an error of the database means that its file is corrupt.
+
+        A database that is locked by another process raises an OperationalError, it
+        is fine. Other errors are confirmed with an integrity check.
+        """
+        if isinstance(error, sqlite3.OperationalError):
+            return False
+        try:
+            conn = sqlite3.connect(self.path, timeout=60)
+            try:
+                return conn.execute('PRAGMA quick_check').fetchone()[0] != 'ok'
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            return False
+        except sqlite3.DatabaseError:
+            return True
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA mmap_size = {}'.format(int(self.mmap_size)))
+        conn.execute('CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, path TEXT, size INTEGER, '
+                     'mtime REAL, compression TEXT) WITHOUT ROWID')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID')
+        return conn
+
+    def dir_mtime(self):
+        return str(os.stat(self.cachedir).st_mtime_ns)
+
+    def get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    def split_name(self, fname):
+        """Returns the name without compression extension and the compression of a cache file name."""
+        for ext in self.compression_algorithms:
+            if fname.endswith('.' + ext):
+                return fname[:-len(ext) - 1], ext
+        return fname, ''
+
+    def entry_for_file(self, path):
+        """Returns the (name, path, size, mtime, compression) row of a file below the cache directory."""
+        stat = os.stat(os.path.join(self.cachedir, path))
+        name, compression = self.split_name(os.path.basename(path))
+        return name, path, stat.st_size, stat.st_mtime, compression
+
+    def rebuild(self):
+        """Scan the cache directory and replace the index."""
+        logger.info('Building the index of the cache directory {}.'.format(self.cachedir))
+        with self.lock:
+            self.conn.execute('DELETE FROM entries')
+            rows = []
+            for dirpath, dirnames, filenames in os.walk(self.cachedir):
+                for fname in filenames:
+                    if 'cache' in fname:
+                        rows.append(self.entry_for_file(os.path.relpath(os.path.join(dirpath, fname), self.cachedir)))
+                if len(rows) >= 10000:
+                    self.conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+                    rows = []
+            self.conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+            self.set_meta('dir_mtime', self.dir_mtime())
+            self.conn.commit()
+
+    def get(self, name):
+        """Returns the CacheEntry of a cache file name (without compression extension) or None."""
+        with self.lock:
+            row = self.connection().execute('SELECT * FROM entries WHERE name = ?', (name,)).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def get_many(self, names):
+        """Returns a dictionary of the names (without compression extension) that are indexed to their CacheEntries."""
+        names = list(names)
+        entries = {}
+        with self.lock:
+            conn = self.connection()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                for row in conn.execute('SELECT * FROM entries WHERE name IN ({})'.format(', '.join('?' * len(chunk))),
+                                        chunk):
+                    entries[row[0]] = CacheEntry(*row)
+        return entries
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def entries(self):
+        """Returns all CacheEntries."""
+        with self.lock:
+            return [CacheEntry(*row) for row in self.connection().execute('SELECT * FROM entries')]
+
+    def iter_entries(self, chunk_size=1000):
+        """Yields all CacheEntries ordered by name, reading chunk_size of them at a time."""
+        last = ''
+        while True:
+            with self.lock:
+                rows = self.connection().execute('SELECT * FROM entries WHERE name > ? ORDER BY name LIMIT ?',
+                                                 (last, chunk_size)).fetchall()
+            for row in rows:
+                yield CacheEntry(*row)
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1][0]
+
+    def add(self, path):
+        """Index a cache file that was written.
+
+        Args:
+            path: The path of the file relative to the cache directory.
+        """
+        with self.lock:
+            conn = self.connection()
+            conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', self.entry_for_file(path))
+            self.set_meta('dir_mtime', self.dir_mtime())
+            conn.commit()
+
+    def remove(self, name):
+        """Remove a cache file name (without compression extension) from the index."""
+        self.remove_many([name])
+
+    def remove_many(self, names):
+        """Remove cache file names (without compression extension) from the index."""
+        names = list(names)
+        with self.lock:
+            conn = self.connection()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                conn.execute('DELETE FROM entries WHERE name IN ({})'.format(', '.join('?' * len(chunk))), chunk)
+            self.set_meta('dir_mtime', self.dir_mtime())
+            conn.commit()
+
+    def older_than(self, timestamp):
+        """Returns the CacheEntries of the files that were modified before timestamp."""
+        with self.lock:
+            return [CacheEntry(*row) for row in self.connection().execute(
+                'SELECT * FROM entries WHERE mtime < ?', (timestamp,))]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import time
+import struct
+import sqlite3
+import threading
+import collections
+import logging
+from GoogleScraper.compression import compress, decompress
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+"""
+Stores the cached SERP pages in a few large pack files.
+
+One file per SERP wastes an inode and on average half a disk block per
+page and makes copying the cache slow. The PackStore appends the pages
+as records to pack files of up to max_pack_size bytes in the packs/
+subdirectory of the cache directory:
+
+    magic 'GSPK' | name length (2) | compression length (1) | data length (4) | name | compression | data
+
+A sqlite index maps the name of a cached page to its pack, offset,
+length, compression and the time it was written. Reads look up the index
+and read the data with a single pread() on a kept open file descriptor.
+
+Records are appended with O_APPEND in a single write, so several
+processes can write to the same pack. A page that is cached again gets a
+new record and the old one becomes garbage. compact() rewrites the live
+records to new packs and removes the old ones. Writers hold a shared and
+compact() an exclusive lock on packs/lock. If the index is lost, it can be
+rebuilt from the records with rebuild_index().
+"""
+
+PackEntry = collections.namedtuple('PackEntry', ['name', 'pack', 'offset', 'length', 'compression', 'mtime'])
+
+MAGIC = b'GSPK'
+HEADER = struct.Struct('<4sHBI')
+
+
+def encode_record(name, data, compression):
+    """Returns a pack record. The data is at its end."""
+    encoded_name, encoded_compression = name.encode(), compression.encode()
+    return HEADER.pack(MAGIC, len(encoded_name), len(encoded_compression), len(data)) + \
+        encoded_name + encoded_compression + data
+
+
+class PackStore(object):
+    """Appends cached pages to pack files and reads them by name."""
+
+    def __init__(self, cachedir, max_pack_size=1024 * 1024 * 1024, dictionaries=None):
+        """Create a new pack store. Nothing is opened before the first use.
+
+        Args:
+            cachedir: The cache directory. The packs are stored in its subdirectory packs/.
+            max_pack_size: A new pack is started when the current one is larger.
+            dictionaries: The DictionaryStore to read pages that were compressed with a zstd dictionary.
+        """
+        self.directory = os.path.join(cachedir, 'packs')
+        self.max_pack_size = max_pack_size
+        self.dictionaries = dictionaries
+
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+
+        # pack number => read only file descriptor
+        self.readers = {}
+
+        # the pack that is written and its file descriptor
+        self.current = None
+        self.writer = None
+
+    def pack_path(self, pack):
+        return os.path.join(self.directory, 'pack-{:06d}.dat'.format(pack))
+
+    def pack_numbers(self):
+        numbers = []
+        for fname in os.listdir(self.directory):
+            match = re.match(r'pack-(\d+)\.dat$', fname)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def connection(self):
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                # a forked process must not use the connection and files of its parent
+                self.pid = os.getpid()
+                self.readers = {}
+                self.current = self.writer = None
+                os.makedirs(self.directory, exist_ok=True)
+                self.conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=60,
+                                            check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode = WAL')
+                self.conn.execute('PRAGMA synchronous = NORMAL')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS entries (name TEXT PRIMARY KEY, pack INTEGER, '
+                                  'offset INTEGER, length INTEGER, compression TEXT, mtime REAL) WITHOUT ROWID')
+            return self.conn
+
+    def locked(self, exclusive=False):
+        """A context manager that holds the lock of the packs directory."""
+        return PackLock(os.path.join(self.directory, 'lock'), exclusive)
+
+    def get(self, name):
+        """Returns the PackEntry of a cached page or None."""
+        with self.lock:
+            row = self.connection().execute('SELECT * FROM entries WHERE name = ?', (name,)).fetchone()
+        return PackEntry(*row) if row else None
+
+    def get_many(self, names):
+        """Returns a dictionary of the names that are stored to their PackEntries."""
+        names = list(names)
+        entries = {}
+        with self.lock:
+            conn = self.connection()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                for row in conn.execute('SELECT * FROM entries WHERE name IN ({})'.format(', '.join('?' * len(chunk))),
+                                        chunk):
+                    entries[row[0]] = PackEntry(*row)
+        return entries
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def names(self):
+        with self.lock:
+            return [row[0] for row in self.connection().execute('SELECT name FROM entries')]
+
+    def reader(self, pack):
+        if pack not in self.readers:
+            self.readers[pack] = os.open(self.pack_path(pack), os.O_RDONLY)
+        return self.readers[pack]
+
+    def pread(self, entry):
+        with self.lock:
+            fd = self.reader(entry.pack)
+        if hasattr(os, 'pread'):
+            return os.pread(fd, entry.length, entry.offset)
+        with self.lock:
+            os.lseek(fd, entry.offset, os.SEEK_SET)
+            return os.read(fd, entry.length)
+
+    def read_raw(self, name):
+        """Returns the (possibly compressed) data and the compression of a cached page or None."""
+        for attempt in range(2):
+            entry = self.get(name)
+            if entry is None:
+                return None
+            try:
+                return self.pread(entry), entry.compression
+            except FileNotFoundError:
+                # the pack was removed by compact() after the lookup
+                pass
+        return None
+
+    def read(self, name):
+        """Returns the html of a cached page or None."""
+        raw = self.read_raw(name)
+        if raw is None:
+            return None
+        data, compression = raw
+        return decompress(data, compression, self.dictionaries).decode()
+
+    def writable_pack(self, size):
+        """Returns the number and the file descriptor of the pack to append size bytes to."""
+        if self.writer is not None:
+            stat = os.fstat(self.writer)
+            # a pack that was removed by compact() in another process has no links left
+            if stat.st_nlink > 0 and stat.st_size + size <= self.max_pack_size:
+                return self.current, self.writer
+            os.close(self.writer)
+            self.writer = None
+
+        numbers = self.pack_numbers()
+        pack = numbers[-1] if numbers else 1
+        while os.path.exists(self.pack_path(pack)) and \
+                0 < os.path.getsize(self.pack_path(pack)) and \
+                os.path.getsize(self.pack_path(pack)) + size > self.max_pack_size:
+            pack += 1
+
+        self.current = pack
+        self.writer = os.open(self.pack_path(pack), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self.current, self.writer
+
+    def put_raw(self, name, data, compression='', mtime=None):
+        """Append a (possibly already compressed) page.
+
+        Args:
+            name: The name of the cached page, see CacheManager.cached_file_name().
+            data: The bytes to store.
+            compression: How data is compressed: '' or one of compression.ALGORITHMS.
+            mtime: When the page was fetched, now if None.
+        """
+        record = encode_record(name, data, compression)
+
+        with self.lock:
+            conn = self.connection()
+            with self.locked():
+                pack, fd = self.writable_pack(len(record))
+                os.write(fd, record)
+                # with O_APPEND the offset after the write is the end of our record
+                offset = os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+                conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                             (name, pack, offset, len(data), compression, time.time() if mtime is None else mtime))
+                conn.commit()
+
+    def put(self, name, html, compression='', dictionary=None, level=3):
+        """Compress and append the html of a page.
+
+        Args:
+            name: The name of the cached page.
+            html: The str or bytes of the page.
+            compression: '' or one of compression.ALGORITHMS.
+            dictionary: The zstd dictionary to compress with.
+            level: The zstd compression level.
+        """
+        data = html if isinstance(html, bytes) else html.encode()
+        if compression:
+            data = compress(data, compression, dictionary=dictionary, level=level)
+        self.put_raw(name, data, compression)
+
+    def remove(self, name):
+        with self.lock:
+            conn = self.connection()
+            conn.execute('DELETE FROM entries WHERE name = ?', (name,))
+            conn.commit()
+
+    def expire(self, timestamp):
+        """Remove the pages that were written before timestamp. Their records become garbage."""
+        with self.lock:
+            conn = self.connection()
+            conn.execute('DELETE FROM entries WHERE mtime < ?', (timestamp,))
+            conn.commit()
+
+    def iter_records(self, pack):
+        """Yields (name, offset, length, compression) of all records in a pack."""
+        with open(self.pack_path(pack), 'rb') as fd:
+            position = 0
+            while True:
+                header = fd.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                magic, name_length, compression_length, length = HEADER.unpack(header)
+                if magic != MAGIC:
+                    logger.warning('Corrupt record in pack {} at offset {}.'.format(pack, position))
+                    break
+                name = fd.read(name_length).decode()
+                compression = fd.read(compression_length).decode()
+                offset = position + HEADER.size + name_length + compression_length
+                fd.seek(length, os.SEEK_CUR)
+                position = offset + length
+                yield name, offset, length, compression
+
+    def rebuild_index(self):
+        """Recreate the index from the records of all packs. The last record of a page wins."""
+        with self.lock:
+            conn = self.connection()
+            with self.locked(exclusive=True):
+                conn.execute('DELETE FROM entries')
+                for pack in self.pack_numbers():
+                    mtime = os.path.getmtime(self.pack_path(pack))
+                    conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                                     ((name, pack, offset, length, compression, mtime)
+                                      for name, offset, length, compression in self.iter_records(pack)))
+                conn.commit()
+
+    def garbage(self):
+        """Returns the total size of the packs and the number of bytes in live records."""
+        with self.lock:
+            conn = self.connection()
+            live = conn.execute('SELECT COALESCE(SUM(? + LENGTH(CAST(name AS BLOB)) + LENGTH(CAST(compression AS BLOB)) '
+                                '+ length), 0) FROM entries', (HEADER.size,)).fetchone()[0]
+        total = sum(os.path.getsize(self.pack_path(pack)) for pack in self.pack_numbers())
+        return total, live
+
+    def compact(self):
+        """Copy the live records to new packs and remove the old packs.
+
+        Returns:
+            The number of bytes that were freed.
+        """
+        with self.lock:
+            conn = self.connection()
+            with self.locked(exclusive=True):
+                old_packs = self.pack_numbers()
+                size_before = sum(os.path.getsize(self.pack_path(pack)) for pack in old_packs)
+
+                if self.writer is not None:
+                    os.close(self.writer)
+                self.current = old_packs[-1] + 1 if old_packs else 1
+                self.writer = os.open(self.pack_path(self.current), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+                moved = []
+                for pack in old_packs:
+                    rows = conn.execute('SELECT * FROM entries WHERE pack = ? ORDER BY offset', (pack,)).fetchall()
+                    for row in rows:
+                        entry = PackEntry(*row)
+                        data = self.pread(entry)
+                        record = encode_record(entry.name, data, entry.compression)
+                        pack_number, fd = self.writable_pack(len(record))
+                        os.write(fd, record)
+                        offset = os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+                        moved.append((pack_number, offset, entry.name))
+
+                conn.executemany('UPDATE entries SET pack = ?, offset = ? WHERE name = ?', moved)
+                conn.commit()
+
+                for pack in old_packs:
+                    if pack in self.readers:
+                        os.close(self.readers.pop(pack))
+                    os.remove(self.pack_path(pack))
+
+                size_after = sum(os.path.getsize(self.pack_path(pack)) for pack in self.pack_numbers())
+
+        logger.info('Compacted the cache packs from {} to {} bytes.'.format(size_before, size_after))
+        return size_before - size_after
+
+    def close(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                for fd in self.readers.values():
+                    os.close(fd)
+                if self.writer is not None:
+                    os.close(self.writer)
+                if self.conn is not None:
+                    self.conn.close()
+            self.readers = {}
+            self.current = self.writer = self.conn = None
+
+
+class PackLock(object):
+    """An advisory lock on a file, shared or exclusive. Does nothing where fcntl is unavailable."""
+
+    def __init__(self, path, exclusive=False):
+        self.path = path
+        self.exclusive = exclusive
+        self.fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *args):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
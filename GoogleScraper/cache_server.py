@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import time
+import fnmatch
+import threading
+import socketserver
+import logging
+from GoogleScraper.cache_backends import read_reply, RespError
+
+logger = logging.getLogger(__name__)
+
+"""
+A small in-memory key-value server for the shared cache.
+
+Speaks the subset of the redis protocol that cache_backends.KeyValueBackend
+uses: PING, GET, SET (with EX), DEL, EXISTS, STRLEN, GETRANGE, SCAN and
+FLUSHDB. Meant as a stand-in for a redis server in the tests and for small
+deployments; the pages are lost when it stops.
+
+    python -m GoogleScraper.cache_server localhost:6379
+"""
+
+
+def encode_reply(value):
+    """Encode a reply: bytes as bulk string, int as integer, a list as array and None as null."""
+    if value is None:
+        return b'$-1\r\n'
+    elif isinstance(value, RespError):
+        return b'-' + str(value).encode() + b'\r\n'
+    elif isinstance(value, int):
+        return b':%d\r\n' % value
+    elif isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode_reply(item) for item in value)
+    return b'$%d\r\n' % len(value) + value + b'\r\n'
+
+
+class KeyValueServer(object):
+    """Serves a dictionary of keys to values over the redis protocol."""
+
+    def __init__(self, address=('localhost', 0)):
+        """Create a new server. Call start() to bind it.
+
+        Args:
+            address: The (host, port) tuple to listen on, port 0 for any free port.
+        """
+        self.address = address
+        self.lock = threading.Lock()
+        # key => (value, expiry timestamp or None)
+        self.data = {}
+        self.server = None
+
+    def lookup(self, key):
+        """Returns the value of a key or None. Must hold the lock."""
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, command):
+        """Execute a command and return its reply."""
+        if not command:
+            return RespError('ERR empty command')
+        name, args = command[0].upper(), command[1:]
+        try:
+            with self.lock:
+                if name == b'PING':
+                    return b'OK'
+                elif name == b'GET':
+                    return self.lookup(args[0])
+                elif name == b'SET':
+                    expires = None
+                    if len(args) == 4 and args[2].upper() == b'EX':
+                        expires = time.time() + int(args[3])
+                    self.data[args[0]] = (args[1], expires)
+                    return b'OK'
+                elif name == b'DEL':
+                    return sum(self.data.pop(key, None) is not None for key in args)
+                elif name == b'EXISTS':
+                    return sum(self.lookup(key) is not None for key in args)
+                elif name == b'STRLEN':
+                    return len(self.lookup(args[0]) or b'')
+                elif name == b'GETRANGE':
+                    value, start, end = self.lookup(args[0]) or b'', int(args[1]), int(args[2])
+                    return value[start:end + 1 if end != -1 else None]
+                elif name == b'SCAN':
+                    return self.scan(args)
+                elif name == b'FLUSHDB':
+                    self.data.clear()
+                    return b'OK'
+        except (IndexError, ValueError):
+            return RespError('ERR wrong arguments for {}'.format(name.decode(errors='replace')))
+        return RespError('ERR unknown command {}'.format(name.decode(errors='replace')))
+
+    def scan(self, args):
+        """SCAN cursor [MATCH pattern] [COUNT count]. The cursor is an offset into the sorted keys."""
+        cursor, pattern, count = int(args[0]), None, 10
+        options = dict(zip((arg.upper() for arg in args[1::2]), args[2::2]))
+        if b'MATCH' in options:
+            pattern = options[b'MATCH'].decode()
+        if b'COUNT' in options:
+            count = int(options[b'COUNT'])
+
+        keys = sorted(self.data)
+        chunk = keys[cursor:cursor + count]
+        cursor = cursor + count if cursor + count < len(keys) else 0
+        return [str(cursor).encode(), [key for key in chunk if self.lookup(key) is not None and
+                                       (pattern is None or fnmatch.fnmatchcase(key.decode(), pattern))]]
+
+    def start(self):
+        """Bind the listening socket."""
+        kv_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    try:
+                        command = read_reply(self.rfile)
+                    except (ConnectionError, ValueError):
+                        return
+                    reply = kv_server.execute(command if isinstance(command, list) else [])
+                    self.wfile.write(encode_reply(reply))
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = Server(self.address, Handler)
+        # the actual port, when port 0 was given
+        self.address = self.server.server_address
+
+    def serve_forever(self):
+        if self.server is None:
+            self.start()
+        logger.info('Cache server listening on {}:{}.'.format(*self.address))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+def run_server(address, ready=None):
+    """Run a KeyValueServer, for example in another process.
+
+    Args:
+        address: The (host, port) tuple to listen on.
+        ready: A queue to put the actual address on when the server listens.
+    """
+    server = KeyValueServer(address)
+    server.start()
+    if ready is not None:
+        ready.put(server.address)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    host, _, port = (sys.argv[1] if len(sys.argv) > 1 else 'localhost:6379').rpartition(':')
+    run_server((host or 'localhost', int(port)))
@@ -2,14 +2,24 @@
 
 import os
 import time
+import types
 import hashlib
-import gzip
-import bz2
 import re
+import contextlib
+import collections
+import multiprocessing
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import NoResultFound
 from GoogleScraper.database import SearchEngineResultsPage
-from GoogleScraper.parsing import parse_serp
+from GoogleScraper.parsing import parse_serp, parser_version, parse_selection, get_parser_by_search_engine
 from GoogleScraper.output_converter import store_serp_result
+from GoogleScraper.cache_index import CacheIndex
+from GoogleScraper.cache_pack import PackStore
+from GoogleScraper.cache_backends import FileBackend, PackBackend, KeyValueBackend, DedupBackend, write_atomically
+from GoogleScraper.cache_compactor import CacheStats, CacheCompactor
+from GoogleScraper.parsed_cache import ParsedResultStore, ParsedResults
+from GoogleScraper.negative_cache import NegativeCache
+from GoogleScraper.compression import ALGORITHMS, DictionaryStore, compress, decompress
 import logging
 
 """
@@ -39,7 +49,7 @@ stored in the database and shouldn't be added a second time.
 
 logger = logging.getLogger(__name__)
 
-ALLOWED_COMPRESSION_ALGORITHMS = ('gz', 'bz2')
+ALLOWED_COMPRESSION_ALGORITHMS = ALGORITHMS
 
 class InvalidConfigurationFileException(Exception):
     """
@@ -54,7 +64,7 @@ class CompressedFile(object):
     """Read and write the data of a compressed file.
     Used to cache files for GoogleScraper.s
 
-    Supported algorithms: gz, bz2
+    Supported algorithms: gz, bz2, zst and lz4. See the compression module.
 
     >>> import os
     >>> f = CompressedFile('/tmp/test.txt', algorithm='gz')
@@ -65,18 +75,20 @@ class CompressedFile(object):
     >>> assert f2.read() == 'hello world'
     """
 
-    def __init__(self, path, algorithm='gz'):
+    def __init__(self, path, algorithm='gz', dictionaries=None):
         """Create a new compressed file to read and write data to.
 
         Args:
             algorithm: Which algorithm to use.
             path: A valid file path to the file to read/write. Depends
                 on the action called.
+            dictionaries: The DictionaryStore to read zst files that were compressed with a dictionary.
 
         @todo: it would be a better approach to pass an Algorithm object instead of a string
         """
 
         self.algorithm = algorithm
+        self.dictionaries = dictionaries
 
         assert self.algorithm in ALLOWED_COMPRESSION_ALGORITHMS, \
             '{algo} is not an supported compression algorithm'.format(algo=self.algorithm)
@@ -86,39 +98,22 @@ class CompressedFile(object):
         else:
             self.path = '{path}.{ext}'.format(path=path, ext=algorithm)
 
-        self.readers = {
-            'gz': self.read_gz,
-            'bz2': self.read_bz2
-        }
-        self.writers = {
-            'gz': self.write_gz,
-            'bz2': self.write_bz2
-        }
-
-    def read_gz(self):
-        with gzip.open(self.path, 'rb') as f:
-            return f.read().decode()
-
-    def read_bz2(self):
-        with bz2.open(self.path, 'rb') as f:
-            return f.read().decode()
-
-    def write_gz(self, data):
-        with gzip.open(self.path, 'wb') as f:
-            f.write(data)
-
-    def write_bz2(self, data):
-        with bz2.open(self.path, 'wb') as f:
-            f.write(data)
-
     def read(self):
         assert os.path.exists(self.path)
-        return self.readers[self.algorithm]()
+        with open(self.path, 'rb') as f:
+            return decompress(f.read(), self.algorithm, self.dictionaries).decode()
 
-    def write(self, data):
+    def write(self, data, dictionary=None, level=3):
+        """Compress and write data.
+
+        Args:
+            data: The str or bytes to write.
+            dictionary: The zstd dictionary to compress with.
+            level: The zstd compression level.
+        """
         if not isinstance(data, bytes):
             data = data.encode()
-        return self.writers[self.algorithm](data)
+        write_atomically(self.path, compress(data, self.algorithm, dictionary=dictionary, level=level))
 
 
 
@@ -131,6 +126,60 @@ class CacheManager():
         self.config = config
         self.maybe_create_cache_dir()
 
+        # maps the cache file names to their files, so lookups don't need to list the cache directory
+        self.index = None
+        if self.config.get('do_caching', True) and self.config.get('cache_index', True):
+            self.index = CacheIndex(self.config.get('cachedir', '.scrapecache'),
+                                    compression_algorithms=ALLOWED_COMPRESSION_ALGORITHMS)
+            if self.config.get('rebuild_cache_index', False):
+                self.index.connection()
+                self.index.rebuild()
+
+        shared = self.config.get('do_caching', True) and self.config.get('cache_backend', 'files') == 'kv'
+
+        # the zstd dictionaries of the search engines, trained on the first cached pages. They are
+        # not trained for a shared cache, whose other hosts would lack them to read the pages.
+        self.dictionaries = DictionaryStore(
+            os.path.join(self.config.get('cachedir', '.scrapecache'), 'dictionaries'),
+            num_samples=0 if shared else int(self.config.get('zstd_dictionary_samples', 100)),
+            dict_size=int(self.config.get('zstd_dictionary_size', 112640)),
+            level=int(self.config.get('zstd_level', 3)))
+
+        # with the pack backend, new pages are appended to pack files instead of written to a file each
+        self.packs = None
+        if self.config.get('do_caching', True) and self.config.get('cache_backend', 'files') == 'pack':
+            self.packs = PackStore(self.config.get('cachedir', '.scrapecache'),
+                                   max_pack_size=int(self.config.get('max_pack_size', 1024 * 1024 * 1024)),
+                                   dictionaries=self.dictionaries)
+
+        # where the pages are stored, see the cache_backends module. The cache files are read
+        # with every backend, they can be moved to the backend with migrate_cache_layout().
+        self.files = FileBackend(self.config.get('cachedir', '.scrapecache'),
+                                 layout=self.config.get('cache_layout', 'sharded'), index=self.index)
+        self.backend = self.files
+        if self.packs is not None:
+            self.backend = PackBackend(self.packs)
+        elif shared:
+            self.backend = KeyValueBackend(self.config.get('cache_server_address', 'localhost:6379'),
+                                           prefix=self.config.get('cache_key_prefix', 'googlescraper:'),
+                                           ttl=60 * 60 * int(self.config.get('clean_cache_after', 48)))
+        elif self.config.get('do_caching', True) and self.config.get('cache_backend', 'files') == 'dedup':
+            self.backend = DedupBackend(self.config.get('cachedir', '.scrapecache'), dictionaries=self.dictionaries)
+
+        # the results of the parsers of the cached pages, so replaying the cache needs no parsing
+        self.parsed_results = None
+        if self.config.get('do_caching', True) and self.config.get('cache_parsed_results', True):
+            self.parsed_results = ParsedResultStore(self.config.get('cachedir', '.scrapecache'))
+
+        # the requests that were blocked, timed out or had no results, per job and proxy
+        self.negative = None
+        if self.config.get('do_caching', True) and self.config.get('negative_caching', True):
+            self.negative = NegativeCache(self.config.get('cachedir', '.scrapecache'),
+                                          ttls=self.config.get('negative_cache_ttls', None))
+
+        # hits, misses and evictions
+        self.stats = CacheStats()
+
 
     def maybe_create_cache_dir(self):
         if self.config.get('do_caching', True):
@@ -148,17 +197,66 @@ class CacheManager():
         """
         cachedir = self.config.get('cachedir', '.scrapecache')
         if os.path.exists(cachedir):
-            for fname in os.listdir(cachedir):
-                path = os.path.join(cachedir, fname)
-                if time.time() > os.path.getmtime(path) + (60 * 60 * int(self.config.get('clean_cache_after', 48))):
-                    # Remove the whole directory if necessary
-                    if os.path.isdir(path):
-                        import shutil
+            oldest = time.time() - 60 * 60 * int(self.config.get('clean_cache_after', 48))
+            for backend in self._backends():
+                backend.expire(oldest)
+
+            if self.negative is not None:
+                self.negative.purge()
+
+
+    def start_compactor(self):
+        """Start a CacheCompactor thread if the cache has a quota.
+
+        Returns:
+            The started CacheCompactor or None.
+        """
+        max_bytes = int(self.config.get('cache_max_bytes', 0))
+        max_entries = int(self.config.get('cache_max_entries', 0))
+        if not self.config.get('do_caching', False) or not (max_bytes or max_entries):
+            return None
+
+        compactor = CacheCompactor(self, max_bytes=max_bytes, max_entries=max_entries,
+                                   policy=self.config.get('cache_eviction_policy', 'lru'),
+                                   interval=float(self.config.get('cache_compaction_interval', 60)),
+                                   max_age=60 * 60 * int(self.config.get('clean_cache_after', 48)))
+        compactor.start()
+        return compactor
+
+    def cache_entries(self):
+        """Returns a (name, size, mtime) tuple for every cached page."""
+        entries = []
+        for backend in self._backends():
+            entries.extend(backend.entries())
+        return entries
+
+    def iter_cache_entries(self):
+        """Like cache_entries(), but reads the entries from the backends while they are consumed."""
+        for backend in self._backends():
+            yield from backend.iter_entries()
+
+    def evict(self, names):
+        """Remove cached pages with their parsed results.
+
+        Args:
+            names: The cache names of the pages, see cached_file_name().
+        """
+        names = list(names)
+        for backend in self._backends():
+            backend.remove(names)
+
+        if self.parsed_results is not None:
+            self.parsed_results.remove(names)
 
-                        shutil.rmtree(path)
-                    else:
-                        os.remove(os.path.join(cachedir, fname))
+    def dedup_report(self):
+        """Returns how much space the dedup cache_backend saves, see DedupBackend.report(), or None."""
+        if isinstance(self.backend, DedupBackend):
+            return self.backend.report()
+        return None
 
+    def _backends(self):
+        """Returns the backend and the cache files, if they are not the backend."""
+        return [self.backend] if self.backend is self.files else [self.backend, self.files]
 
     def cached_file_name(self, keyword, search_engine, scrape_mode, page_number):
         """Make a unique file name from the search engine search request.
@@ -188,6 +286,18 @@ class CacheManager():
         return '{file_name}.{extension}'.format(file_name=sha.hexdigest(), extension='cache')
 
 
+    def cache_file_path(self, fname):
+        """Returns the path of a cache file relative to the cache directory.
+
+        With the sharded cache_layout, the files are spread over two levels of
+        subdirectories named by the first four characters of the hash:
+        ab/cd/abcd....cache. Otherwise all files are directly in the cache directory.
+
+        Args:
+            fname: The name of the cache file, see cached_file_name().
+        """
+        return self.files.cache_file_path(fname)
+
     def get_cached(self, keyword, search_engine, scrapemode, page_number):
         """Loads a cached SERP result.
 
@@ -204,24 +314,145 @@ class CacheManager():
         """
         if self.config.get('do_caching', False):
             fname = self.cached_file_name(keyword, search_engine, scrapemode, page_number)
+            html = self._read_cached_page(fname)
+            if html:
+                self.stats.hit(fname)
+            else:
+                self.stats.miss()
+            return html
 
-            cdir = self.config.get('cachedir', '.scrapecache')
+    def _read_cached_page(self, fname):
+        """Returns the html of a cached page or False if it is not cached or too old."""
+        page = self._load_cached_page(fname)
+        if page is None:
+            return False
 
-            if fname in os.listdir(cdir):
-                # If the cached file is older than 12 hours, return False and thus
-                # make a new fresh request.
-                try:
-                    modtime = os.path.getmtime(os.path.join(cdir, fname))
-                except FileNotFoundError:
-                    return False
+        # If the cached page is older than clean_cache_after hours, return False and thus
+        # make a new fresh request.
+        if (time.time() - page.mtime) / 60 / 60 > int(self.config.get('clean_cache_after', 48)):
+            return False
+
+        return self._decode_page(page)
+
+    def _load_cached_page(self, fname):
+        """Returns the CachedPage of a cache name from the backend or the cache files or None."""
+        page = self.backend.get(fname)
+        if page is None and self.backend is not self.files:
+            page = self.files.get(fname)
+        return page
+
+    def _decode_page(self, page):
+        """Returns the html of a CachedPage."""
+        if page.compression:
+            return decompress(page.data, page.compression, self.dictionaries).decode()
+        try:
+            return page.data.decode()
+        except UnicodeDecodeError as e:
+            logger.warning(str(e))
+            # If we get this error, the cache files are probably compressed
+            # but lack the extension of their compression.
+            return None
+
+    def cached_file_path(self, fname):
+        """Returns the path of a cache file or None if the file is not cached.
+
+        Args:
+            fname: The name of the cache file without compression extension, see cached_file_name().
+        """
+        return self.files.path(fname)
+
+    def migrate_cache_layout(self):
+        """Move all cache files to the place where the configured cache_layout expects them.
 
-                if (time.time() - modtime) / 60 / 60 > int(self.config('clean_cache_after', 48)):
-                    return False
+        Works in place while other scrapes use the cache: every file is moved by a
+        single rename and a reader that doesn't find a file at its indexed place
+        looks in the other layout. Files that are written with the old layout while
+        the migration runs are still found and are moved by the next migration.
 
-                path = os.path.join(cdir, fname)
-                return self.read_cached_file(path)
+        With the pack, kv or dedup cache_backend, the files are moved to the backend.
+
+        Returns:
+            The number of moved files.
+        """
+        if self.backend is not self.files:
+            return self._move_files_to_backend()
+
+        cachedir = self.config.get('cachedir', '.scrapecache')
+        num_moved = 0
+
+        for path in self._get_all_cache_files():
+            relpath = os.path.relpath(path, cachedir)
+            name = self._strip_compression_extension(os.path.basename(path))
+            ext = os.path.basename(path)[len(name):]
+
+            target = self.cache_file_path(name) + ext
+            if target == relpath:
+                continue
+
+            dst = os.path.join(cachedir, target)
+            if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(path):
+                # the page was cached again in the new layout
+                os.remove(path)
             else:
-                return False
+                os.makedirs(os.path.dirname(dst) or cachedir, exist_ok=True)
+                os.replace(path, dst)
+
+            if self.index is not None:
+                self.index.add(target)
+
+            # remove the emptied shard directories when migrating to the flat layout
+            shard = os.path.dirname(relpath)
+            while shard:
+                try:
+                    os.rmdir(os.path.join(cachedir, shard))
+                except OSError:
+                    break
+                shard = os.path.dirname(shard)
+
+            num_moved += 1
+            if num_moved % 10000 == 0:
+                logger.info('Moved {} cache files.'.format(num_moved))
+
+        logger.info('Moved {} cache files to the {} layout.'.format(num_moved, self.config.get('cache_layout', 'sharded')))
+        return num_moved
+
+    def _move_files_to_backend(self):
+        """Store all cache files in the backend and remove them. Compressed files are stored as they are.
+
+        Returns:
+            The number of moved files.
+        """
+        num_moved = 0
+
+        for path in self._get_all_cache_files():
+            name = self._strip_compression_extension(os.path.basename(path))
+            page = self.files.get(name)
+            if page is None:
+                continue
+
+            stored = self.backend.get(name)
+            if not stored or stored.mtime < page.mtime:
+                self.backend.put(name, page.data, page.compression)
+            self.files.remove([name])
+
+            num_moved += 1
+            if num_moved % 10000 == 0:
+                logger.info('Moved {} cache files.'.format(num_moved))
+
+        logger.info('Moved {} cache files to the {} cache backend.'.format(
+            num_moved, self.config.get('cache_backend', 'files')))
+        return num_moved
+
+    def compact_cache(self):
+        """Rewrite the cache packs without the pages that were overwritten.
+
+        Returns:
+            The number of bytes that were freed.
+        """
+        if self.packs is None:
+            logger.warning('Only the pack cache backend can be compacted.')
+            return 0
+        return self.packs.compact()
 
     def read_cached_file(self, path):
         """Read a compressed or uncompressed file.
@@ -230,7 +461,7 @@ class CacheManager():
         a file that ends with .gz needs to be gunzipped.
 
         Supported algorithms:
-        gzip and bzip2
+        gzip, bzip2, zstandard and lz4
 
         Args:
             path: The path to the cached file.
@@ -264,7 +495,7 @@ class CacheManager():
                         # but convenient for the end user.
                         self.config['compress_cached_files'] = True
             elif ext in ALLOWED_COMPRESSION_ALGORITHMS:
-                f = CompressedFile(path)
+                f = CompressedFile(path, algorithm=ext, dictionaries=self.dictionaries)
                 return f.read()
             else:
                 raise InvalidConfigurationFileException('"{}" is a invalid configuration file.'.format(path))
@@ -279,42 +510,59 @@ class CacheManager():
         This will always write(overwrite) the cached file. If compress_cached_files is
         True, the page is written in bytes (obviously).
 
+        Safe to call from several threads and processes at once without a lock: the
+        page is compressed by the calling thread and the file is replaced atomically,
+        so readers never see a partly written page.
+
         Args:
             parser: A parser with the data to cache.
             query: The keyword that was used in the search.
             search_engine: The search engine the keyword was scraped for.
             scrape_mode: The scrapemode that was used.
             page_number: The page number that the serp page is.
-            db_lock: If an db_lock is given, all action are wrapped in this lock.
+            db_lock: Not used anymore. Caching doesn't need the database lock.
         """
 
         if self.config.get('do_caching', False):
-            if db_lock:
-                db_lock.acquire()
-
             if self.config.get('minimize_caching_files', True):
                 html = parser.cleaned_html
             else:
                 html = parser.html
 
             fname = self.cached_file_name(query, search_engine, scrape_mode, page_number)
-            cachedir = self.config.get('cachedir', '.scrapecache')
-            path = os.path.join(cachedir, fname)
+            data = html if isinstance(html, bytes) else html.encode()
 
-            if self.config.get('compress_cached_files'):
-                algorithm = self.config.get('compressing_algorithm', 'gz')
-                f = CompressedFile(path, algorithm=algorithm)
-                f.write(html)
+            if isinstance(self.backend, DedupBackend):
+                # a page that is stored already is only linked, without compressing it again
+                digest = hashlib.sha256(data).hexdigest()
+                if not self.backend.link(fname, digest):
+                    self.backend.put(fname, *self._encode_page(data, search_engine), digest=digest)
             else:
-                with open(path, 'w') as fd:
-                    if isinstance(html, bytes):
-                        fd.write(html.decode())
-                    else:
-                        fd.write(html)
+                self.backend.put(fname, *self._encode_page(data, search_engine))
+
+            if self.parsed_results is not None and hasattr(parser, 'search_results'):
+                version = parser_version(type(parser), parser.searchtype, parser.result_types, parser.result_fields)
+                self.parsed_results.put(fname, version, parser)
 
-            if db_lock:
-                db_lock.release()
 
+    def _encode_page(self, data, search_engine=None):
+        """Compress the html of a page as configured.
+
+        Args:
+            data: The bytes of the html.
+            search_engine: The search engine of the page, selects the zstd dictionary. None for no dictionary.
+
+        Returns:
+            A (data, compression algorithm) tuple to store in the backend.
+        """
+        if not self.config.get('compress_cached_files'):
+            return data, ''
+
+        algorithm = self.config.get('compressing_algorithm', 'gz')
+        dictionary = None
+        if algorithm == 'zst' and search_engine:
+            dictionary = self.dictionaries.dictionary_for(search_engine, data)
+        return compress(data, algorithm, dictionary=dictionary, level=int(self.config.get('zstd_level', 3))), algorithm
 
     def _get_all_cache_files(self):
         """Return all files found in the cachedir.
@@ -324,12 +572,18 @@ class CacheManager():
             Files are either uncompressed filename.cache or are compressed with a
             compression algorithm: "filename.cache.zip"
         """
-        files = set()
-        for dirpath, dirname, filenames in os.walk(self.config.get('cachedir', '.scrapecache')):
-            for name in filenames:
-                if 'cache' in name:
-                    files.add(os.path.join(dirpath, name))
-        return files
+        return self.files.all_files()
+
+
+    def _get_cached_file_names(self):
+        """Returns a dictionary of the cache file names (without compression extension) to
+        the paths of the files relative to the cache directory. Pages in the other backends map
+        to their name.
+        """
+        names = self.files.paths()
+        if self.backend is not self.files:
+            names.update((name, name) for name in self.backend.names())
+        return names
 
 
     def _caching_is_one_to_one(self, keywords, search_engine, scrapemode, page_number):
@@ -362,82 +616,279 @@ class CacheManager():
 
 
     def parse_all_cached_files(self, scrape_jobs, session, scraper_search):
-        """Walk recursively through the cachedir (as given by the Config) and parse all cached files.
+        """Load all scrape jobs that are found in the cache and return the others.
+
+        The cached jobs are found with bulk lookups of their cache names in the index
+        and replayed in batches of cache_replay_batch_size: their SERPs are looked up
+        in the database with a few queries and the ones that are missing (or have no
+        links) are parsed in cache_replay_processes processes.
 
         Args:
+            scrape_jobs: The scrape jobs.
             session: An sql alchemy session to add the entities
             scraper_search: Abstract object representing the current search.
 
         Returns:
+            The scrape jobs that couldn't be parsed from the cache directory, in their order.
+        """
+        scrape_jobs = list(scrape_jobs)
+        names = [self.cached_file_name(job['query'], job['search_engine'], job['scrape_method'], job['page_number'])
+                 for job in scrape_jobs]
+        found = self._locate_cached_pages(set(names))
+
+        # the first job of every cached page is replayed
+        cached = {}
+        for name, job in zip(names, scrape_jobs):
+            if name in found and name not in cached:
+                cached[name] = job
+
+        batch_size = max(int(self.config.get('cache_replay_batch_size', 1000)), 1)
+        num_processes = int(self.config.get('cache_replay_processes', 0)) or os.cpu_count() or 1
+        pool, chunksize = None, max(batch_size // (num_processes * 4), 1)
+        if num_processes > 1 and len(cached) > batch_size:
+            # module objects from external config files cannot be sent to other processes
+            config = {k: v for k, v in self.config.items() if not isinstance(v, (types.ModuleType, types.FunctionType))}
+            # the workers only read the pages, the index and the layout are maintained by this process
+            config.update(rebuild_cache_index=False, migrate_cache_layout=False, compact_cache=False)
+            pool = multiprocessing.Pool(num_processes, initializer=_init_replay_worker, initargs=(config,))
+
+        replayed = set()
+        try:
+            batch = []
+            for name, job in cached.items():
+                batch.append((name, job))
+                if len(batch) == batch_size:
+                    replayed.update(self._replay_batch(batch, session, scraper_search, pool, chunksize))
+                    batch = []
+            replayed.update(self._replay_batch(batch, session, scraper_search, pool, chunksize))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        remaining = [job for name, job in zip(names, scrape_jobs) if name not in replayed]
+        for job in remaining:
+            self.stats.miss()
+
+        logger.info('{} of the {} scrape jobs are in the cache {}'.format(
+            len(cached), len(scrape_jobs), self.config.get('cachedir')))
+        logger.info('{}/{} objects have been read from the cache. {} remain to get scraped.'.format(
+            len(scrape_jobs) - len(remaining), len(scrape_jobs), len(remaining)))
+
+        session.add(scraper_search)
+        session.commit()
+
+        return remaining
+
+    def _locate_cached_pages(self, names):
+        """Returns the set of the cache names that are cached, with a bulk lookup in the backend."""
+        found = self.backend.find(names)
+        if self.backend is not self.files and len(found) < len(names):
+            found |= self.files.find(set(names) - found)
+        return found
+
+    def _replay_batch(self, batch, session, scraper_search, pool=None, chunksize=1):
+        """Link the SERPs of a batch of cached jobs to the scraper search and commit.
+
+        Args:
+            batch: A list of (cache name, scrape job) tuples.
+            session: An sql alchemy session to add the entities
+            scraper_search: Abstract object representing the current search.
+            pool: The process pool to parse the pages in, parsed in this process if None.
+            chunksize: How many pages a process of the pool parses at once.
+
+        Returns:
+            The cache names of the replayed jobs.
+        """
+        if not batch:
+            return []
+
+        def key(job):
+            return job['query'], job['search_engine'], job['scrape_method'], job['page_number']
+
+        serps = self.get_serps_from_database(session, [job for name, job in batch])
+
+        # if no serp was found or the serp has no results, parse again
+        to_parse = [(name, job['search_engine'], job['query']) for name, job in batch
+                    if key(job) not in serps or not serps[key(job)].links]
+        if pool is not None:
+            parsed = pool.imap(_parse_cached_page, to_parse, chunksize)
+        else:
+            parsed = (_parse_cached_page(args, self) for args in to_parse)
+
+        replayed = []
+        for name, job in batch:
+            serp = serps.get(key(job))
+            if serp is None or not serp.links:
+                results = next(parsed)
+                if results is False:
+                    # the page cannot be read or parsed, scrape it again
+                    continue
+                serp = parse_serp(self.config, parser=results, query=job['query'])
+                serp.set_values_from_job(job)
+
+            serp.scraper_searches.append(scraper_search)
+            session.add(serp)
+
+            store_serp_result(serp, self.config, job=job)
+            replayed.append(name)
+            self.stats.hit(name)
+
+        session.commit()
+        return replayed
+
+
+    def iter_uncached_jobs(self, scrape_jobs, session, scraper_search, db_lock=None):
+        """Lazy variant of parse_all_cached_files().
+
+        Consumes the scrape jobs one after another, loads the ones that are found in
+        the cache and yields the remaining ones. Used when the scrape jobs are streamed
+        and cannot be held in memory at once.
+
+        Args:
+            scrape_jobs: An iterable of scrape jobs.
+            session: An sql alchemy session to add the entities
+            scraper_search: Abstract object representing the current search.
+            db_lock: If an db_lock is given, all database actions are wrapped in this lock.
+
+        Yields:
             The scrape jobs that couldn't be parsed from the cache directory.
         """
-        files = self._get_all_cache_files()
         num_cached = num_total = 0
-        mapping = {}
+        lock = db_lock or contextlib.nullcontext()
+
         for job in scrape_jobs:
+            num_total += 1
             cache_name = self.cached_file_name(
                 job['query'],
                 job['search_engine'],
                 job['scrape_method'],
                 job['page_number']
             )
-            mapping[cache_name] = job
-            num_total += 1
+            if self._locate_cached_pages({cache_name}):
+                with lock:
+                    self._serp_from_cache(job, cache_name, session, scraper_search)
+                    self.stats.hit(cache_name)
+
+                    num_cached += 1
+                    if num_cached % 200 == 0:
+                        session.commit()
+            else:
+                self.stats.miss()
+                yield job
 
-        for path in files:
-            # strip of the extension of the path if it has eny
-            fname = os.path.split(path)[1]
-            clean_filename = fname
-            for ext in ALLOWED_COMPRESSION_ALGORITHMS:
-                if fname.endswith(ext):
-                    clean_filename = fname.rstrip('.' + ext)
-
-            job = mapping.get(clean_filename, None)
-
-            if job:
-                # We found a file that contains the keyword, search engine name and
-                # search mode that fits our description. Let's see if there is already
-                # an record in the database and link it to our new ScraperSearch object.
-                serp = self.get_serp_from_database(session, job['query'], job['search_engine'], job['scrape_method'],
-                                              job['page_number'])
-
-                # if no serp was found or the serp has no results
-                # parse again
-                if not serp or (serp and len(serp.links) <= 0):
-                    serp = self.parse_again(fname, job['search_engine'], job['scrape_method'], job['query'])
-
-                serp.scraper_searches.append(scraper_search)
-                session.add(serp)
-
-                if num_cached % 200 == 0:
-                    session.commit()
-
-                store_serp_result(serp, self.config)
-                num_cached += 1
-                scrape_jobs.remove(job)
-
-        logger.info('{} cache files found in {}'.format(len(files), self.config.get('cachedir')))
-        logger.info('{}/{} objects have been read from the cache. {} remain to get scraped.'.format(
+        with lock:
+            session.add(scraper_search)
+            session.commit()
+
+        logger.info('{}/{} objects have been read from the cache. {} remained to get scraped.'.format(
             num_cached, num_total, num_total - num_cached))
 
-        session.add(scraper_search)
-        session.commit()
+    def _strip_compression_extension(self, fname):
+        for ext in ALLOWED_COMPRESSION_ALGORITHMS:
+            if fname.endswith('.' + ext):
+                return fname[:-len(ext) - 1]
+        return fname
 
-        return scrape_jobs
+    def _serp_from_cache(self, job, fname, session, scraper_search):
+        """Link the SERP of a cached job to the scraper search.
 
+        We found a file that contains the keyword, search engine name and
+        search mode that fits our description. Let's see if there is already
+        an record in the database and link it to our new ScraperSearch object.
 
-    def parse_again(self, fname, search_engine, scrape_method, query):
+        Args:
+            job: The scrape job that was found in the cache.
+            fname: The cache name or file of the cached page.
+            session: An sql alchemy session to add the entities
+            scraper_search: Abstract object representing the current search.
+
+        Returns:
+            The SERP object of the cached job.
         """
+        serp = self.get_serp_from_database(session, job['query'], job['search_engine'], job['scrape_method'],
+                                           job['page_number'])
+
+        # if no serp was found or the serp has no results
+        # parse again
+        if not serp or (serp and len(serp.links) <= 0):
+            serp = self.parse_again(fname, job['search_engine'], job['scrape_method'], job['query'])
+            serp.set_values_from_job(job)
+
+        serp.scraper_searches.append(scraper_search)
+        session.add(serp)
+
+        store_serp_result(serp, self.config, job=job)
+
+        return serp
+
+    def parse_again(self, fname, search_engine, scrape_method, query):
+        """Make a SERP from a cached page.
+
+        The parsed results that were stored with the page are used if they were
+        made by the current version of the parser. Otherwise the page is parsed
+        and its parsed results are replaced.
+
         @todo: `scrape_method` is not used here -> check if scrape_method is passed to this function and remove it
         """
-        path = os.path.join(self.config.get('cachedir', '.scrapecache'), fname)
-        html = self.read_cached_file(path)
-        return parse_serp(
-            self.config,
-            html=html,
-            search_engine=search_engine,
-            query=query
-        )
+        return parse_serp(self.config, parser=self.parse_cached_page(fname, search_engine, query), query=query)
+
+    def parse_cached_page(self, fname, search_engine, query):
+        """Returns the parser (or the stored ParsedResults) of a cached page or None if the page is empty.
+
+        Args:
+            fname: The cache name of the page or the path of its cache file relative to the cache directory.
+            search_engine: The search engine of the page.
+            query: The query of the page.
+        """
+        parser_class = get_parser_by_search_engine(search_engine)
+
+        name = self._strip_compression_extension(os.path.basename(fname))
+        if self.parsed_results is not None:
+            version = parser_version(parser_class, self.config.get('search_type', 'normal'),
+                                     *parse_selection(self.config))
+            results = self.parsed_results.get(name, version)
+            if results is not None:
+                return results
+
+        page = self._load_cached_page(name)
+        html = self._decode_page(page) if page is not None else None
+        if not html:
+            return None
+
+        parser = parser_class(self.config, query=query)
+        parser.parse(html)
+        if self.parsed_results is not None:
+            self.parsed_results.put(name, version, parser)
+        return parser
+
+    def get_serps_from_database(self, session, jobs):
+        """Look up the SERPs of many scrape jobs with a few queries.
+
+        Args:
+            session: An sql alchemy session.
+            jobs: The scrape jobs.
+
+        Returns:
+            A dictionary of (query, search engine, scrape method, page number) to the first SERP
+            with these values. The links of the SERPs are loaded.
+        """
+        queries = collections.defaultdict(list)
+        for job in jobs:
+            queries[(job['search_engine'], job['scrape_method'], job['page_number'])].append(job['query'])
+
+        serps = {}
+        for (search_engine, scrape_method, page_number), keywords in queries.items():
+            for i in range(0, len(keywords), 500):
+                found = session.query(SearchEngineResultsPage).options(
+                    selectinload(SearchEngineResultsPage.links)).filter(
+                    SearchEngineResultsPage.query.in_(keywords[i:i + 500]),
+                    SearchEngineResultsPage.search_engine_name == search_engine,
+                    SearchEngineResultsPage.scrape_method == scrape_method,
+                    SearchEngineResultsPage.page_number == page_number).order_by(SearchEngineResultsPage.id)
+                for serp in found:
+                    serps.setdefault((serp.query, search_engine, scrape_method, page_number), serp)
+        return serps
 
 
     def get_serp_from_database(self, session, query, search_engine, scrape_method, page_number):
@@ -533,6 +984,34 @@ class CacheManager():
         return wraps
 
 
+# the CacheManager of a worker process of parse_all_cached_files()
+_replay_cache_manager = None
+
+
+def _init_replay_worker(config):
+    global _replay_cache_manager
+    _replay_cache_manager = CacheManager(config)
+
+
+def _parse_cached_page(args, cache_manager=None):
+    """Parse a cached page, possibly in a worker process.
+
+    Args:
+        args: The cache name, search engine and query of the page.
+        cache_manager: The CacheManager to use, the one of the worker process if None.
+
+    Returns:
+        The ParsedResults of the page, None for an empty page and False if the page cannot be parsed.
+    """
+    fname, search_engine, query = args
+    try:
+        parser = (cache_manager or _replay_cache_manager).parse_cached_page(fname, search_engine, query)
+    except Exception as e:
+        logger.error('Cannot parse the cached page {} of "{}": {}'.format(fname, query, e))
+        return False
+    return ParsedResults.from_parser(parser) if parser is not None else None
+
+
 if __name__ == '__main__':
     import doctest
 
@@ -48,6 +48,11 @@ def get_command_line(only_print_help=False):
                                     '.py suffix) where the keywords must be held in a dictionary with the name "scrape_'
                                     'jobs".')
 
+    parser.add_argument('--stream-keyword-file', action='store_true', default=False,
+                        help='Read the keyword file in chunks and feed the keywords to the workers while they are '
+                             'consumed, instead of loading the whole file into memory. Use this for huge keyword '
+                             'files.')
+
     parser.add_argument('-o-', '--output-filename', type=str, action='store', default='',
                         help='The name of the output file. If the file ending is "json", write a json file, if the '
                              'ending is "csv", write a csv file.')
@@ -70,10 +75,29 @@ def get_command_line(only_print_help=False):
                         help='This arguments sets the number of browser instances for selenium mode or the number of '
                              'worker threads in http mode.')
 
+    parser.add_argument('--num-processes', type=int, default=1, action='store',
+                        help='Shard the keywords across this many processes, each with its own workers. Use this to '
+                             'parse and store the results on more than one cpu core.')
+
+    parser.add_argument('--distributed-role', choices=['coordinator', 'worker'], default='',
+                        help='Run one scrape on several machines. The coordinator hands out the keywords to the '
+                             'workers and collects the results.')
+
+    parser.add_argument('--coordinator-address', type=str, action='store', default='localhost:7000',
+                        help='The host:port the coordinator listens on and the workers connect to.')
+
     parser.add_argument('-t', '--search-type', type=str, action='store', default='normal',
                         help='The searchtype to launch. May be normal web search, image search, news search or video '
                              'search.')
 
+    parser.add_argument('--parse-result-types', type=str, action='store', default='', metavar='TYPES',
+                        help='Only parse these comma separated result types of the SERPs, like "results" or '
+                             '"results,ads_main". All result types by default.')
+
+    parser.add_argument('--parse-result-fields', type=str, action='store', default='', metavar='FIELDS',
+                        help='Only parse these comma separated fields of the results, like "link" or "link,title". '
+                             'The rank and the link are always parsed. All fields by default.')
+
     parser.add_argument('--proxy-file', type=str, dest='proxy_file', action='store',
                         required=False, help='A filename for a list of proxies (supported are HTTP PROXIES, SOCKS4/5) '
                                              'with the following format: "Proxyprotocol (proxy_ip|proxy_host):Port\n"'
@@ -121,6 +145,33 @@ NOTSET = 0
     parser.add_argument('--clean', action='store_true', default=False,
                         help='Cleans all stored data. Please be very careful when you use this flag.')
 
+    parser.add_argument('--migrate-cache-layout', action='store_true', default=False,
+                        help='Move the cache files to the layout given by the cache_layout option and exit. Safe to '
+                             'run while other scrapes use the cache.')
+
+    parser.add_argument('--compact-cache', action='store_true', default=False,
+                        help='Rewrite the cache packs without the pages that were cached again or expired and exit. '
+                             'Only for the pack cache_backend.')
+
+    parser.add_argument('--cache-report', action='store_true', default=False,
+                        help='Print the number and size of the cached pages and exit. With the dedup cache_backend, '
+                             'also how many distinct pages are stored and how many bytes the deduplication saves.')
+
+    parser.add_argument('--cache-export', action='store', default='', metavar='ARCHIVE',
+                        help='Write the cached pages to an archive (.tar.gz, .tgz, .tar.bz2, .tar.xz or .tar, "-" for '
+                             'stdout) and exit. With --keyword or --keyword-file, only the pages of these keywords '
+                             'in the search engines of --search-engines are exported, otherwise the pages of the '
+                             'keywords in the results database that were scraped with these search engines. '
+                             'Give --search-engines "*" to export all cached pages.')
+
+    parser.add_argument('--cache-import', action='store', default='', metavar='ARCHIVE',
+                        help='Load the cached pages of an archive written by --cache-export ("-" for stdin) into '
+                             'the cache and exit. Pages whose hash does not match are skipped.')
+
+    parser.add_argument('--cache-max-age', action='store', type=float, default=0, metavar='HOURS',
+                        help='Only export or import cached pages younger than this many hours. Defaults to '
+                             'clean_cache_after.')
+
     parser.add_argument('--mysql-proxy-db', action='store',
                         help="A mysql connection string for proxies to use. Format: mysql://<username>:<password>@"
                              "<host>/<dbname>. Has precedence over proxy files.")
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import bz2
+import gzip
+import threading
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+logger = logging.getLogger(__name__)
+
+"""
+The compression algorithms of the cached SERP pages.
+
+gz:  zlib, in the standard library.
+bz2: better ratio than gz, but very slow to write.
+zst: zstandard, needs the zstandard package. Faster than gz at a better
+     ratio. SERP pages of one search engine share most of their markup,
+     so a small dictionary trained on a sample of the pages of an engine
+     raises the ratio of the (short) pages considerably.
+lz4: needs the lz4 package. The fastest, at the ratio of gz or below.
+
+The algorithm names are the file extensions of the compressed cache files.
+
+A zst frame records the id of the dictionary it was compressed with. The
+dictionaries are stored as {search engine}-{id}.zdict in a directory and
+looked up by that id when a page is decompressed.
+"""
+
+ALGORITHMS = ('gz', 'bz2', 'zst', 'lz4')
+
+
+class CompressionNotAvailable(Exception):
+    """Used when the package of a compression algorithm is not installed."""
+    pass
+
+
+def available_algorithms():
+    """Returns the algorithms whose packages are installed."""
+    return tuple(algorithm for algorithm in ALGORITHMS
+                 if (algorithm != 'zst' or zstandard) and (algorithm != 'lz4' or lz4))
+
+
+def check_available(algorithm):
+    assert algorithm in ALGORITHMS, '{} is not an supported compression algorithm'.format(algorithm)
+    if algorithm == 'zst' and zstandard is None:
+        raise CompressionNotAvailable('Install the zstandard package to use the zst compression.')
+    if algorithm == 'lz4' and lz4 is None:
+        raise CompressionNotAvailable('Install the lz4 package to use the lz4 compression.')
+
+
+_local = threading.local()
+
+
+def _zstd_compressor(level, dictionary):
+    # the compressors are not thread safe and expensive to create with a dictionary
+    compressors = _local.__dict__.setdefault('compressors', {})
+    key = (level, dictionary.dict_id() if dictionary else 0)
+    if key not in compressors:
+        compressors[key] = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+    return compressors[key]
+
+
+def _zstd_decompressor(dictionary):
+    decompressors = _local.__dict__.setdefault('decompressors', {})
+    key = dictionary.dict_id() if dictionary else 0
+    if key not in decompressors:
+        decompressors[key] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return decompressors[key]
+
+
+def compress(data, algorithm, dictionary=None, level=3):
+    """Compress bytes.
+
+    Args:
+        data: The bytes to compress.
+        algorithm: One of ALGORITHMS.
+        dictionary: A zstandard.ZstdCompressionDict to compress zst with.
+        level: The compression level of zst.
+
+    Returns:
+        The compressed bytes.
+
+    Raises:
+        CompressionNotAvailable: When the package of the algorithm is not installed.
+    """
+    check_available(algorithm)
+    if algorithm == 'gz':
+        return gzip.compress(data)
+    elif algorithm == 'bz2':
+        return bz2.compress(data)
+    elif algorithm == 'zst':
+        return _zstd_compressor(level, dictionary).compress(data)
+    else:
+        return lz4.frame.compress(data)
+
+
+def decompress(data, algorithm, dictionaries=None):
+    """Decompress bytes.
+
+    Args:
+        data: The compressed bytes.
+        algorithm: One of ALGORITHMS or '' for uncompressed data.
+        dictionaries: The DictionaryStore with the dictionaries of zst compressed data.
+
+    Returns:
+        The decompressed bytes.
+
+    Raises:
+        CompressionNotAvailable: When the package of the algorithm is not installed.
+    """
+    if not algorithm:
+        return data
+    check_available(algorithm)
+    if algorithm == 'gz':
+        return gzip.decompress(data)
+    elif algorithm == 'bz2':
+        return bz2.decompress(data)
+    elif algorithm == 'zst':
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        dictionary = None
+        if dict_id:
+            dictionary = dictionaries.get(dict_id) if dictionaries is not None else None
+            if dictionary is None:
+                raise ValueError('The zstd dictionary {} is missing.'.format(dict_id))
+        # frames that were written in a stream don't contain their size
+        return _zstd_decompressor(dictionary).decompressobj().decompress(data)
+    else:
+        return lz4.frame.decompress(data)
+
+
+class DictionaryStore(object):
+    """Trains, stores and loads the zstd dictionaries of the search engines.
+
+    The first pages that are compressed for a search engine are collected as
+    samples. When enough are collected, a dictionary is trained and saved and the
+    following pages of the search engine are compressed with it.
+    """
+
+    def __init__(self, directory, num_samples=100, dict_size=112640, level=3):
+        """Create a new dictionary store.
+
+        Args:
+            directory: Where the dictionaries are saved.
+            num_samples: How many pages of a search engine to train its dictionary on.
+                0 disables the training.
+            dict_size: The maximal size of a dictionary in bytes.
+            level: The compression level the dictionaries are prepared for.
+        """
+        self.directory = directory
+        self.num_samples = num_samples
+        self.dict_size = dict_size
+        self.level = level
+
+        self.lock = threading.Lock()
+        # search engine => the dictionary to compress with
+        self.current = {}
+        # dict id => dictionary
+        self.loaded = {}
+        # search engine => collected pages
+        self.samples = {}
+        # search engines whose training failed
+        self.failed = set()
+        # search engines whose dictionary is trained right now
+        self.training = set()
+
+        self.load()
+
+    def load(self):
+        """Load the saved dictionaries. The newest one of each search engine is used to compress."""
+        if zstandard is None or not os.path.isdir(self.directory):
+            return
+        newest = {}
+        for fname in os.listdir(self.directory):
+            match = re.match(r'(.+)-(\d+)\.zdict$', fname)
+            if match:
+                path = os.path.join(self.directory, fname)
+                dictionary = self._read(path)
+                self.loaded[dictionary.dict_id()] = dictionary
+                search_engine, mtime = match.group(1), os.path.getmtime(path)
+                if search_engine not in newest or newest[search_engine][0] < mtime:
+                    newest[search_engine] = (mtime, dictionary)
+        self.current.update((search_engine, dictionary) for search_engine, (mtime, dictionary) in newest.items())
+
+    def _read(self, path):
+        with open(path, 'rb') as fd:
+            dictionary = zstandard.ZstdCompressionDict(fd.read())
+        dictionary.precompute_compress(level=self.level)
+        return dictionary
+
+    def get(self, dict_id):
+        """Returns the dictionary with an id or None. Dictionaries saved by other processes are found too."""
+        with self.lock:
+            if dict_id not in self.loaded and os.path.isdir(self.directory):
+                for fname in os.listdir(self.directory):
+                    if fname.endswith('-{}.zdict'.format(dict_id)):
+                        self.loaded[dict_id] = self._read(os.path.join(self.directory, fname))
+            return self.loaded.get(dict_id)
+
+    def dictionary_for(self, search_engine, sample=None):
+        """Returns the dictionary to compress a page of a search engine with or None.
+
+        Args:
+            search_engine: The search engine of the page.
+            sample: The page, collected to train the dictionary if the search engine has none yet.
+        """
+        with self.lock:
+            if search_engine in self.current:
+                return self.current[search_engine]
+            if not self.num_samples or search_engine in self.failed or search_engine in self.training \
+                    or sample is None:
+                return None
+
+            samples = self.samples.setdefault(search_engine, [])
+            samples.append(sample)
+            if len(samples) < self.num_samples:
+                return None
+
+            del self.samples[search_engine]
+            self.training.add(search_engine)
+
+        # the training takes a while, the pages of other search engines are compressed meanwhile
+        dictionary = None
+        try:
+            trained = zstandard.train_dictionary(self.dict_size, samples)
+            self.save(search_engine, trained)
+            trained.precompute_compress(level=self.level)
+            dictionary = trained
+        except zstandard.ZstdError as e:
+            logger.warning('Cannot train a zstd dictionary for {}: {}'.format(search_engine, e))
+        finally:
+            with self.lock:
+                self.training.discard(search_engine)
+                if dictionary is None:
+                    self.failed.add(search_engine)
+                else:
+                    self.current[search_engine] = self.loaded[dictionary.dict_id()] = dictionary
+
+        if dictionary is not None:
+            logger.info('Trained a zstd dictionary of {} bytes for {} on {} pages.'.format(
+                len(dictionary), search_engine, len(samples)))
+        return dictionary
+
+    def save(self, search_engine, dictionary):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{}-{}.zdict'.format(search_engine, dictionary.dict_id()))
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fd:
+            fd.write(dictionary.as_bytes())
+        os.replace(tmp, path)
@@ -5,6 +5,7 @@ import threading
 import datetime
 import sys
 import hashlib
+import json
 import os
 import queue
 from GoogleScraper.log import setup_logger
@@ -12,10 +13,17 @@ from GoogleScraper.commandline import get_command_line
 from GoogleScraper.database import ScraperSearch, SERP, Link, get_session, fixtures
 from GoogleScraper.proxies import parse_proxy_file, get_proxies_from_mysql_db, add_proxies_to_db
 from GoogleScraper.caching import CacheManager
+from GoogleScraper.cache_archive import export_cache, import_cache, cached_jobs
 from GoogleScraper.config import get_config
-from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords, KeywordFileReader, prioritize_scrape_jobs, \
+    enforce_deadlines
 from GoogleScraper.scraping import ScrapeWorkerFactory
+from GoogleScraper.scheduling import ScrapeJobDispatcher
+from GoogleScraper.pacing import PacingScheduler
+from GoogleScraper.throttling import AdaptiveThrottle
+from GoogleScraper.pipeline import ScrapePipeline
 from GoogleScraper.output_converter import init_outfile
+from GoogleScraper.journal import init_journal, close_journal, load_completed_jobs, skip_completed_jobs
 from GoogleScraper.async_mode import AsyncScrapeScheduler
 import logging
 from GoogleScraper.utils import get_base_path
@@ -117,16 +125,20 @@ class ShowProgressQueue(threading.Thread):
 
         Args:
             queue: A queue.Queue instance to share among the worker threads.
-            num_keywords: The number of total keywords that need to be scraped.
+            num_keywords: The number of total keywords that need to be scraped. None
+                if unknown, for example when the keywords are streamed.
         """
         super().__init__()
         self.queue = queue
         self.num_keywords = num_keywords
         self.num_already_processed = 0
-        self.progress_fmt = '\033[92m{}/{} keywords processed.\033[0m'
+        if num_keywords is None:
+            self.progress_fmt = '\033[92m{} keywords processed.\033[0m'
+        else:
+            self.progress_fmt = '\033[92m{}/{} keywords processed.\033[0m'
 
     def run(self):
-        while self.num_already_processed < self.num_keywords:
+        while self.num_keywords is None or self.num_already_processed < self.num_keywords:
             e = self.queue.get()
 
             if e == 'done':
@@ -142,6 +154,151 @@ class ShowProgressQueue(threading.Thread):
             self.queue.task_done()
 
 
+def run_scrape(config, scrape_jobs, proxies, search_engines, cache_manager=None, session=None, scraper_search=None,
+               db_lock=None, streaming=False):
+    """Scrape the jobs in this process with the configured scrape method.
+
+    Looks up the jobs in the cache first and then scrapes the remaining ones
+    either with one thread per worker (http and selenium mode) or asynchronously.
+
+    Args:
+        config: The configuration dictionary.
+        scrape_jobs: The scrape jobs. A list, or an iterator when streaming.
+        proxies: The proxies to use. None stands for the own ip address.
+        search_engines: The names of the search engines to scrape.
+        cache_manager: The CacheManager to look up and store the SERP pages.
+        session: The sqlalchemy session to store the results in.
+        scraper_search: The ScraperSearch the results are assigned to.
+        db_lock: A lock to synchronize access to the session.
+        streaming: Whether scrape_jobs is streamed from a keyword file.
+    """
+    num_search_engines = len(search_engines)
+    num_workers = int(config.get('num_workers'))
+    method = config.get('scrape_method', 'http')
+
+    # First of all, lets see how many requests remain to issue after searching the cache.
+    if config.get('do_caching'):
+        if streaming:
+            scrape_jobs = cache_manager.iter_uncached_jobs(scrape_jobs, session, scraper_search, db_lock=db_lock)
+        else:
+            scrape_jobs = cache_manager.parse_all_cached_files(scrape_jobs, session, scraper_search)
+
+    if scrape_jobs:
+
+        # create a lock to cache results
+        cache_lock = threading.Lock()
+
+        # A lock to prevent multiple threads from solving captcha, used in selenium instances.
+        captcha_lock = threading.Lock()
+
+        logger.info('Going to scrape {num_keywords} keywords with {num_proxies} proxies by using {num_threads} threads.'.format(
+            num_keywords='all streamed' if streaming else len(scrape_jobs),
+            num_proxies=len(proxies),
+            num_threads=num_search_engines))
+
+        progress_thread = None
+
+        # Let the games begin
+        if method in ('selenium', 'http'):
+
+            # Show the progress of the scraping
+            q = queue.Queue()
+            progress_thread = ShowProgressQueue(config, q, None if streaming else len(scrape_jobs))
+            progress_thread.start()
+
+            # the deadlines of the jobs are enforced by the shared job queues
+            has_deadlines = not streaming and any('deadline' in job for job in scrape_jobs)
+
+            dispatcher = ScrapeJobDispatcher(
+                shared_queues=streaming or has_deadlines or config.get('work_stealing', True),
+                job_queue_size=int(config.get('job_queue_size', 1000)) if streaming else 0,
+                prefetch=int(config.get('job_prefetch', 5)),
+                expired_jobs=config.get('expired_jobs', 'drop'),
+                negative_cache=cache_manager.negative if cache_manager is not None else None
+            )
+            # adapts the concurrency and the delays per search engine and proxy
+            throttle = None
+            if config.get('adaptive_throttling', False):
+                throttle = AdaptiveThrottle(config, max_concurrency=num_workers)
+
+            # paces the requests of all workers with the same proxy and search engine
+            pacing = PacingScheduler(config, throttle=throttle)
+
+            # parses and stores the fetched pages, such that the workers only fetch
+            pipeline = None
+            if config.get('pipelined_storage', True):
+                pipeline = ScrapePipeline(config, session, scraper_search, db_lock, cache_manager=cache_manager).start()
+
+            num_worker = 0
+            for search_engine in search_engines:
+
+                for proxy in proxies:
+
+                    for worker in range(num_workers):
+                        num_worker += 1
+                        dispatcher.add_worker(
+                            ScrapeWorkerFactory(
+                                config,
+                                cache_manager=cache_manager,
+                                mode=method,
+                                proxy=proxy,
+                                search_engine=search_engine,
+                                session=session,
+                                db_lock=db_lock,
+                                cache_lock=cache_lock,
+                                scraper_search=scraper_search,
+                                captcha_lock=captcha_lock,
+                                progress_queue=q,
+                                browser_num=num_worker,
+                                pacing=pacing,
+                                throttle=throttle,
+                                pipeline=pipeline
+                            )
+                        )
+
+            # assign all jobs created to suitable workers.
+            if not streaming:
+                dispatcher.dispatch_all(scrape_jobs)
+                dispatcher.close()
+
+            threads = []
+
+            for worker in dispatcher.workers():
+                thread = worker.get_worker()
+                if thread:
+                    threads.append(thread)
+
+            for t in threads:
+                t.start()
+
+            if streaming:
+                # feed the jobs to the running workers as they are consumed
+                try:
+                    dispatcher.dispatch_all(scrape_jobs)
+                finally:
+                    dispatcher.close()
+
+            for t in threads:
+                t.join()
+
+            if pipeline is not None:
+                pipeline.close()
+
+            # after threads are done, stop the progress queue.
+            q.put('done')
+            progress_thread.join()
+
+        elif method == 'http-async':
+            scrape_jobs = enforce_deadlines(scrape_jobs, config.get('expired_jobs', 'drop'))
+            scheduler = AsyncScrapeScheduler(config, scrape_jobs, cache_manager=cache_manager, session=session, scraper_search=scraper_search,
+                                             db_lock=db_lock)
+            scheduler.run()
+
+        else:
+            raise Exception('No such scrape_method {}'.format(config.get('scrape_method')))
+
+
+
 def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
     """Runs the GoogleScraper application as determined by the various configuration points.
 
@@ -191,6 +348,28 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
             pass
         return
 
+    if config.get('migrate_cache_layout', False):
+        CacheManager(config).migrate_cache_layout()
+        return
+
+    if config.get('compact_cache', False):
+        CacheManager(config).compact_cache()
+        return
+
+    if config.get('cache_report', False):
+        cache_manager = CacheManager(config)
+        entries = cache_manager.cache_entries()
+        report = {'entries': len(entries), 'bytes': round(sum(entry[1] for entry in entries))}
+        report.update(cache_manager.dedup_report() or {})
+        print(json.dumps(report, indent=2))
+        return
+
+    cache_max_age = 60 * 60 * float(config.get('cache_max_age', 0) or 0) or None
+
+    if config.get('cache_import', ''):
+        import_cache(CacheManager(config), config.get('cache_import'), max_age=cache_max_age)
+        return
+
     search_engine_name = config.get('check_detection', None)
     if search_engine_name:
         from GoogleScraper.selenium_mode import check_detection
@@ -229,6 +408,19 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
     scrape_method = config.get('scrape_method')
     pages = int(config.get('num_pages_for_keyword', 1))
     method = config.get('scrape_method', 'http')
+    streaming = bool(config.get('stream_keyword_file', False) and kwfile and not kwfile.endswith('.py'))
+
+    if config.get('cache_export', ''):
+        if keyword or keywords or (kwfile and not kwfile.endswith('.py')):
+            if kwfile:
+                keywords = KeywordFileReader(kwfile, chunk_size=int(config.get('keyword_chunk_size', 10000)))
+            jobs = default_scrape_jobs_for_keywords([keyword] if keyword else keywords, search_engines, method, pages)
+        elif set(search_engines) != set(config.get('supported_search_engines')):
+            jobs = cached_jobs(get_session(config, scoped=False)(), search_engines)
+        else:
+            jobs = None
+        export_cache(CacheManager(config), config.get('cache_export'), jobs=jobs, max_age=cache_max_age)
+        return
 
     if config.get('shell', False):
         namespace = {}
@@ -247,7 +439,9 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
         start_python_console(namespace)
         return
 
-    if not (keyword or keywords) and not kwfile:
+    distributed_role = config.get('distributed_role', '')
+
+    if not (keyword or keywords) and not kwfile and distributed_role != 'worker':
         # Just print the help.
         get_command_line(True)
         print('No keywords to scrape for. Please provide either an keyword file (Option: --keyword-file) or specify and '
@@ -275,6 +469,10 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
                     scrape_jobs = getattr(__import__(modname, fromlist=['scrape_jobs']), 'scrape_jobs')
                 except ImportError as e:
                     logger.warning(e)
+            elif streaming:
+                # read the keywords in chunks while the scrape jobs are consumed
+                keywords = KeywordFileReader(kwfile, chunk_size=int(config.get('keyword_chunk_size', 10000)),
+                                             dedup_file=config.get('keyword_dedup_file', ''))
             else:
                 # Clean the keywords of duplicates right in the beginning
                 # But make sure to keep the order
@@ -285,7 +483,9 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
     if not scrape_jobs:
         scrape_jobs = default_scrape_jobs_for_keywords(keywords, search_engines, scrape_method, pages)
 
-    scrape_jobs = list(scrape_jobs)
+    if not streaming:
+        # urgent jobs first
+        scrape_jobs = prioritize_scrape_jobs(list(scrape_jobs))
 
     if config.get('clean_cache_files', False):
         cache_manager.clean_cachefiles()
@@ -317,11 +517,18 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
     if config.get('search_type') not in valid_search_types:
         raise WrongConfigurationError('Invalid search type! Select one of {}'.format(repr(valid_search_types)))
 
+    if distributed_role == 'worker':
+        # the scrape jobs come from the coordinator
+        from GoogleScraper.distributed import DistributedWorker
+        DistributedWorker(config, proxies).run()
+        return
+
     if config.get('simulate', False):
         print('*' * 60 + 'SIMULATION' + '*' * 60)
         logger.info('If GoogleScraper would have been run without the --simulate flag, it would have:')
         logger.info('Scraped for {} keywords, with {} results a page, in total {} pages for each keyword'.format(
-            len(keywords), int(config.get('num_results_per_page', 0)),
+            # counting a streamed keyword file would read all of it
+            'the streamed' if streaming else len(keywords), int(config.get('num_results_per_page', 0)),
             int(config.get('num_pages_for_keyword'))))
         if None in proxies:
             logger.info('Also using own ip address to scrape.')
@@ -370,104 +577,69 @@ def main(return_results=False, parse_cmd_line=True, config_from_dict=None):
             keyword_file=kwfile,
             number_search_engines_used=num_search_engines,
             number_proxies_used=len(proxies),
-            number_search_queries=len(keywords),
+            number_search_queries=0 if streaming else len(keywords),
             started_searching=datetime.datetime.utcnow(),
             used_search_engines=','.join(search_engines)
         )
 
-    # First of all, lets see how many requests remain to issue after searching the cache.
+    # skip the jobs that were completed before the last scrape was interrupted
+    if config.get('journal_completed_jobs', True):
+        new_search = scraper_search.id is None
+        if new_search:
+            session.add(scraper_search)
+            session.commit()
+
+        completed = set() if new_search else load_completed_jobs(config, scraper_search)
+        if completed:
+            logger.info('Skipping {} jobs that were completed in the last scrape.'.format(len(completed)))
+            scrape_jobs = skip_completed_jobs(scrape_jobs, completed)
+            if not streaming:
+                scrape_jobs = list(scrape_jobs)
+
+        init_journal(config, scraper_search, new=new_search)
+
+    # Create a lock to synchronize database access in the sqlalchemy session
+    db_lock = threading.Lock()
+
+    num_processes = int(config.get('num_processes', 1))
+    if num_processes > 1 and streaming:
+        logger.warning('Streamed keyword files are scraped in a single process. Ignoring num_processes.')
+        num_processes = 1
+
+    # keeps the cache within its quota while scraping
+    compactor = cache_manager.start_compactor()
+
+    if distributed_role == 'coordinator':
+        from GoogleScraper.distributed import Coordinator
+        if config.get('do_caching'):
+            scrape_jobs = cache_manager.iter_uncached_jobs(scrape_jobs, session, scraper_search, db_lock=db_lock)
+        scrape_jobs = enforce_deadlines(scrape_jobs, config.get('expired_jobs', 'drop'))
+        Coordinator(config, scrape_jobs, session=session, scraper_search=scraper_search, db_lock=db_lock).run()
+    elif num_processes > 1:
+        from GoogleScraper.multiprocess_mode import MultiprocessScrapeScheduler
+        scheduler = MultiprocessScrapeScheduler(config, scrape_jobs, proxies, search_engines, num_processes,
+                                                session=session, scraper_search=scraper_search, db_lock=db_lock)
+        scheduler.run()
+    else:
+        run_scrape(config, scrape_jobs, proxies, search_engines, cache_manager=cache_manager, session=session,
+                   scraper_search=scraper_search, db_lock=db_lock, streaming=streaming)
+
+    if compactor is not None:
+        compactor.stop()
     if config.get('do_caching'):
-        scrape_jobs = cache_manager.parse_all_cached_files(scrape_jobs, session, scraper_search)
-
-    if scrape_jobs:
-
-        # Create a lock to synchronize database access in the sqlalchemy session
-        db_lock = threading.Lock()
-
-        # create a lock to cache results
-        cache_lock = threading.Lock()
-
-        # A lock to prevent multiple threads from solving captcha, used in selenium instances.
-        captcha_lock = threading.Lock()
-
-        logger.info('Going to scrape {num_keywords} keywords with {num_proxies} proxies by using {num_threads} threads.'.format(
-            num_keywords=len(list(scrape_jobs)),
-            num_proxies=len(proxies),
-            num_threads=num_search_engines))
-
-        progress_thread = None
-
-        # Let the games begin
-        if method in ('selenium', 'http'):
-
-            # Show the progress of the scraping
-            q = queue.Queue()
-            progress_thread = ShowProgressQueue(config, q, len(scrape_jobs))
-            progress_thread.start()
-
-            workers = queue.Queue()
-            num_worker = 0
-            for search_engine in search_engines:
-
-                for proxy in proxies:
-
-                    for worker in range(num_workers):
-                        num_worker += 1
-                        workers.put(
-                            ScrapeWorkerFactory(
-                                config,
-                                cache_manager=cache_manager,
-                                mode=method,
-                                proxy=proxy,
-                                search_engine=search_engine,
-                                session=session,
-                                db_lock=db_lock,
-                                cache_lock=cache_lock,
-                                scraper_search=scraper_search,
-                                captcha_lock=captcha_lock,
-                                progress_queue=q,
-                                browser_num=num_worker
-                            )
-                        )
-
-            # here we look for suitable workers
-            # for all jobs created.
-            for job in scrape_jobs:
-                while True:
-                    worker = workers.get()
-                    workers.put(worker)
-                    if worker.is_suitabe(job):
-                        worker.add_job(job)
-                        break
-
-            threads = []
-
-            while not workers.empty():
-                worker = workers.get()
-                thread = worker.get_worker()
-                if thread:
-                    threads.append(thread)
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-
-            # after threads are done, stop the progress queue.
-            q.put('done')
-            progress_thread.join()
-
-        elif method == 'http-async':
-            scheduler = AsyncScrapeScheduler(config, scrape_jobs, cache_manager=cache_manager, session=session, scraper_search=scraper_search,
-                                             db_lock=db_lock)
-            scheduler.run()
-
-        else:
-            raise Exception('No such scrape_method {}'.format(config.get('scrape_method')))
+        logger.info('Cache: {}'.format(cache_manager.stats.as_dict()))
+        if cache_manager.dedup_report() is not None:
+            logger.info('Cache deduplication: {}'.format(cache_manager.dedup_report()))
+        if cache_manager.negative is not None:
+            logger.info('Negative cache: {} failed requests recorded, {} requests avoided.'.format(
+                cache_manager.negative.num_recorded, cache_manager.negative.num_avoided))
 
     from GoogleScraper.output_converter import close_outfile
     close_outfile()
+    close_journal()
+
+    if streaming:
+        scraper_search.number_search_queries = keywords.num_keywords
 
     scraper_search.stopped_searching = datetime.datetime.utcnow()
     session.add(scraper_search)
@@ -157,6 +157,21 @@ class SearchEngineResultsPage(Base):
         self.requested_by = scraper.requested_by
         self.status = scraper.status
 
+    def set_values_from_job(self, job):
+        """Populate itself from the scrape job it answers.
+
+        Used for SERPs that are made from a cached page, which lacks the
+        search engine, scrape method and page number.
+
+        Args:
+            A scrape job dictionary.
+        """
+
+        self.query = job['query']
+        self.search_engine_name = job['search_engine']
+        self.scrape_method = job['scrape_method']
+        self.page_number = job['page_number']
+
     def was_correctly_requested(self):
         return self.status == 'successful'
 
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import socket
+import datetime
+import threading
+import collections
+import socketserver
+import logging
+from GoogleScraper.database import SERP
+from GoogleScraper.multiprocess_mode import scrape_shard, serp_from_dict
+from GoogleScraper.output_converter import store_serp_result
+from GoogleScraper.scrape_jobs import job_deadline
+
+logger = logging.getLogger(__name__)
+
+"""
+Runs one scrape on several machines.
+
+The coordinator creates the scrape jobs like a normal GoogleScraper run
+and hands them out in leases to remote workers. A worker scrapes the jobs
+of its lease with its own proxies and sends the SERPs back. The coordinator
+stores them in its database and writes the output file.
+
+A lease expires when the worker neither completes nor renews it within
+lease_timeout seconds, for example because the worker crashed. Then its
+jobs are handed out again.
+
+The protocol is line based. The worker connects, sends one json object
+terminated by a newline and reads one json object as answer:
+
+    {"op": "lease", "worker": name}
+        => {"status": "lease", "lease": id, "timeout": seconds, "jobs": [job, ...]}
+        => {"status": "wait", "retry_after": seconds}, when all jobs are leased
+        => {"status": "done"}, when all jobs are completed
+    {"op": "renew", "lease": id}
+        => {"status": "ok"} or {"status": "expired"}
+    {"op": "complete", "lease": id, "serps": [serp, ...]}
+        => {"status": "ok", "accepted": number of stored serps}
+
+Every message the coordinator cannot handle is answered with
+{"status": "error", "message": reason}. A worker sends its SERPs again
+when it gets no answer, SERPs that were stored already are dropped.
+"""
+
+# how long a worker tries to reach the coordinator when it starts
+CONNECT_TIMEOUT = 30
+
+# how long a worker waits before asking again when all jobs are leased
+RETRY_AFTER = 1
+
+# how often a worker tries to deliver the SERPs of a lease
+COMPLETE_ATTEMPTS = 5
+
+
+def job_key(job):
+    return job['query'], job['search_engine'], job['scrape_method'], job['page_number']
+
+
+def serp_key(data):
+    return data['query'], data['search_engine_name'], data['scrape_method'], data['page_number']
+
+
+def json_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    elif isinstance(value, bytes):
+        # urlparse() returns bytes for links that are None
+        return value.decode()
+    return value
+
+
+def encode_job(job):
+    """Make a scrape job json serializable. The deadline is sent as unix timestamp."""
+    encoded = dict(job)
+    if encoded.get('deadline'):
+        encoded['deadline'] = job_deadline(job)
+    return encoded
+
+
+def encode_serp(data):
+    """Make a SERP dictionary as returned by serp_to_dict() json serializable."""
+    encoded = {key: json_value(value) for key, value in data.items() if key != 'links'}
+    encoded['links'] = [{key: json_value(value) for key, value in link.items()} for link in data['links']]
+    return encoded
+
+
+def decode_serp(data):
+    """Create a SERP from a dictionary as returned by encode_serp()."""
+    data = dict(data)
+    for column in SERP.__table__.columns:
+        if isinstance(data.get(column.name), str) and column.type.python_type is datetime.datetime:
+            data[column.name] = datetime.datetime.fromisoformat(data[column.name])
+    return serp_from_dict(data)
+
+
+def send_message(address, message, timeout=60):
+    """Send a message to the coordinator and return its answer.
+
+    Args:
+        address: A (host, port) tuple.
+        message: A json serializable dictionary.
+        timeout: The socket timeout in seconds.
+
+    Returns:
+        The answer of the coordinator as dictionary.
+    """
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        with sock.makefile('rb') as fd:
+            line = fd.readline()
+
+    if not line:
+        raise ConnectionAbortedError('The coordinator closed the connection without an answer.')
+    return json.loads(line.decode())
+
+
+def parse_address(address):
+    """Parse a "host:port" string into a (host, port) tuple."""
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+class Coordinator(object):
+    """Hands out leases on the scrape jobs and collects the SERPs."""
+
+    def __init__(self, config, scrape_jobs, session=None, scraper_search=None, db_lock=None, address=None):
+        """Create a new coordinator.
+
+        Args:
+            config: The configuration dictionary.
+            scrape_jobs: An iterable of scrape jobs. Read lazily, when workers ask for jobs.
+            session: The sqlalchemy session to store the SERPs in.
+            scraper_search: The ScraperSearch the SERPs are assigned to.
+            db_lock: A lock to synchronize access to the session.
+            address: The (host, port) tuple to listen on. Defaults to coordinator_address.
+        """
+        self.config = config
+        self.scrape_jobs = iter(scrape_jobs)
+        self.session = session
+        self.scraper_search = scraper_search
+        self.db_lock = db_lock or threading.Lock()
+        self.address = address or parse_address(config.get('coordinator_address', 'localhost:7000'))
+
+        self.lease_timeout = float(config.get('lease_timeout', 300))
+        self.lease_size = int(config.get('lease_size', 10))
+
+        # jobs that were handed back after their lease expired
+        self.requeued = collections.deque()
+        self.exhausted = False
+
+        # lease id => [jobs, deadline, worker]
+        self.leases = {}
+        self.next_lease = 0
+
+        # the keys of all completed jobs
+        self.completed = set()
+
+        self.num_reissued = 0
+        self.num_duplicates = 0
+        self.server = None
+
+    def now(self):
+        return time.monotonic()
+
+    def next_job(self):
+        """Returns the next job that is not completed yet or None."""
+        while self.requeued:
+            job = self.requeued.popleft()
+            if job_key(job) not in self.completed:
+                return job
+
+        while not self.exhausted:
+            job = next(self.scrape_jobs, None)
+            if job is None:
+                self.exhausted = True
+            elif job_key(job) not in self.completed:
+                return job
+
+        return None
+
+    def take_jobs(self):
+        """Take up to lease_size jobs. Consecutive pages of a keyword are kept together."""
+        jobs = []
+        while len(jobs) < self.lease_size:
+            job = self.next_job()
+            if job is None:
+                break
+            jobs.append(job)
+
+        # don't split the pages of the last keyword among two leases
+        while jobs:
+            job = self.next_job()
+            if job is None:
+                break
+            if job['query'] == jobs[-1]['query'] and job['search_engine'] == jobs[-1]['search_engine']:
+                jobs.append(job)
+            else:
+                self.requeued.appendleft(job)
+                break
+
+        return jobs
+
+    def reap_expired_leases(self):
+        """Hand out the jobs of expired leases again."""
+        now = self.now()
+        for lease_id, (jobs, deadline, worker) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[lease_id]
+                self.requeued.extendleft(reversed(jobs))
+                self.num_reissued += 1
+                logger.warning('Lease {} of worker {} expired. Handing out its {} jobs again.'.format(
+                    lease_id, worker, len(jobs)))
+
+    def finished(self):
+        return self.exhausted and not self.requeued and not self.leases
+
+    def lease(self, message):
+        self.reap_expired_leases()
+
+        jobs = self.take_jobs()
+        if not jobs:
+            if self.finished():
+                return {'status': 'done'}
+            return {'status': 'wait', 'retry_after': RETRY_AFTER}
+
+        lease_id = self.next_lease
+        self.next_lease += 1
+        worker = message.get('worker', '')
+        self.leases[lease_id] = [jobs, self.now() + self.lease_timeout, worker]
+
+        logger.info('Lease {} with {} jobs to worker {}.'.format(lease_id, len(jobs), worker))
+        return {'status': 'lease', 'lease': lease_id, 'timeout': self.lease_timeout,
+                'jobs': [encode_job(job) for job in jobs]}
+
+    def renew(self, message):
+        lease = self.leases.get(message.get('lease'))
+        if lease is None:
+            return {'status': 'expired'}
+
+        lease[1] = self.now() + self.lease_timeout
+        return {'status': 'ok'}
+
+    def complete(self, message):
+        """Store the SERPs of a lease.
+
+        SERPs of an expired lease are accepted as well, as long as
+        their jobs were not completed by another worker in the meantime.
+        """
+        # a SERP that cannot be decoded rejects the whole delivery, the lease stays until it expires
+        with self.db_lock:
+            serps = {}
+            for data in message.get('serps', []):
+                key = serp_key(data)
+                if key in self.completed or key in serps:
+                    self.num_duplicates += 1
+                else:
+                    serps[key] = decode_serp(data)
+
+            for key, serp in serps.items():
+                self.completed.add(key)
+                self.scraper_search.serps.append(serp)
+                self.session.add(serp)
+                store_serp_result(serp, self.config)
+
+            self.session.commit()
+
+        lease = self.leases.pop(message.get('lease'), None)
+
+        # jobs without a SERP failed on the worker. They are not retried, like in a local scrape.
+        if lease is not None:
+            self.completed.update(job_key(job) for job in lease[0])
+
+        return {'status': 'ok', 'accepted': len(serps)}
+
+    def handle_message(self, message):
+        """Answer a message of a worker."""
+        handlers = {
+            'lease': self.lease,
+            'renew': self.renew,
+            'complete': self.complete,
+        }
+        handler = handlers.get(message.get('op'))
+        if handler is None:
+            return {'status': 'error', 'message': 'Unknown operation {}'.format(message.get('op'))}
+        return handler(message)
+
+    def start(self):
+        """Bind the listening socket."""
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    message = json.loads(self.rfile.readline().decode())
+                    answer = json.dumps(coordinator.handle_message(message))
+                except Exception as e:
+                    logger.exception('Cannot handle the message of a worker.')
+                    answer = json.dumps({'status': 'error', 'message': '{}: {}'.format(type(e).__name__, e)})
+                self.wfile.write(answer.encode() + b'\n')
+
+        socketserver.TCPServer.allow_reuse_address = True
+        self.server = socketserver.TCPServer(self.address, Handler)
+        self.server.timeout = 1
+        # the actual port, when port 0 was given
+        self.address = self.server.server_address
+
+    def run(self):
+        """Serve the workers until all jobs are completed."""
+        if self.server is None:
+            self.start()
+
+        logger.info('Coordinator listening on {}:{}.'.format(*self.address))
+
+        try:
+            while not self.finished():
+                self.server.handle_request()
+                self.reap_expired_leases()
+        finally:
+            self.server.server_close()
+
+        logger.info('All jobs completed. {} leases were handed out again, {} duplicate SERPs were dropped.'.format(
+            self.num_reissued, self.num_duplicates))
+
+
+class DistributedWorker(object):
+    """Scrapes the jobs that it leases from a coordinator."""
+
+    def __init__(self, config, proxies, address=None, name=None):
+        """Create a new worker.
+
+        Args:
+            config: The configuration dictionary.
+            proxies: The proxies of this worker. None stands for the own ip address.
+            address: The (host, port) tuple of the coordinator. Defaults to coordinator_address.
+            name: The name of the worker in the logs of the coordinator.
+        """
+        self.config = config
+        self.proxies = proxies
+        self.address = address or parse_address(config.get('coordinator_address', 'localhost:7000'))
+        self.name = name or '{}:{}'.format(socket.gethostname(), threading.get_ident())
+        self.num_leases = 0
+
+    def send(self, message):
+        return send_message(self.address, message)
+
+    def connect(self):
+        """Wait until the coordinator is reachable and return the first answer."""
+        started = time.monotonic()
+        while True:
+            try:
+                return self.send({'op': 'lease', 'worker': self.name})
+            except ConnectionRefusedError:
+                if time.monotonic() - started > CONNECT_TIMEOUT:
+                    raise
+                time.sleep(RETRY_AFTER)
+
+    def keep_renewing(self, lease_id, timeout, stopped):
+        """Renew the lease until stopped is set."""
+        while not stopped.wait(timeout / 3):
+            try:
+                if self.send({'op': 'renew', 'lease': lease_id})['status'] != 'ok':
+                    logger.warning('Lease {} expired.'.format(lease_id))
+                    return
+            except OSError as e:
+                logger.warning('Cannot renew lease {}: {}'.format(lease_id, e))
+
+    def complete(self, lease_id, serps):
+        """Deliver the SERPs of a lease. Sent again when the coordinator does not answer.
+
+        When all attempts fail, the lease expires and its jobs are handed out again.
+        """
+        for attempt in range(1, COMPLETE_ATTEMPTS + 1):
+            try:
+                answer = self.send({'op': 'complete', 'lease': lease_id, 'serps': serps})
+            except (ConnectionError, socket.timeout, ValueError) as e:
+                logger.warning('Cannot deliver the SERPs of lease {} (attempt {}/{}): {}'.format(
+                    lease_id, attempt, COMPLETE_ATTEMPTS, e))
+                time.sleep(RETRY_AFTER)
+                continue
+
+            if answer['status'] != 'ok':
+                logger.warning('The coordinator rejected the SERPs of lease {}: {}'.format(
+                    lease_id, answer.get('message')))
+            return answer
+
+        logger.error('Giving up to deliver the SERPs of lease {}, its jobs are handed out again.'.format(lease_id))
+        return None
+
+    def scrape(self, lease_id, jobs):
+        """Scrape the jobs of a lease and return the SERPs."""
+        config = dict(self.config, scrape_method=jobs[0]['scrape_method'])
+        search_engines = sorted({job['search_engine'] for job in jobs})
+        serps = scrape_shard(config, lease_id, jobs, self.proxies, search_engines)[2]
+        return [encode_serp(data) for data in serps]
+
+    def run(self):
+        """Lease and scrape jobs until the coordinator has no more."""
+        answer = self.connect()
+
+        while True:
+            if answer['status'] == 'done':
+                break
+            elif answer['status'] == 'wait':
+                time.sleep(answer.get('retry_after', RETRY_AFTER))
+            elif answer['status'] == 'lease':
+                self.num_leases += 1
+                stopped = threading.Event()
+                renewer = threading.Thread(target=self.keep_renewing,
+                                           args=(answer['lease'], answer['timeout'], stopped), daemon=True)
+                renewer.start()
+                try:
+                    serps = self.scrape(answer['lease'], answer['jobs'])
+                finally:
+                    stopped.set()
+                self.complete(answer['lease'], serps)
+            else:
+                raise ValueError('Unexpected answer from the coordinator: {}'.format(answer))
+
+            try:
+                answer = self.send({'op': 'lease', 'worker': self.name})
+            except ConnectionError:
+                # the coordinator stops listening when all jobs are completed
+                break
+
+        logger.info('Worker {} scraped {} leases.'.format(self.name, self.num_leases))
@@ -132,6 +132,9 @@ class HttpScrape(SearchEngineScrape, threading.Timer):
         results: Returns the found results.
     """
 
+    # the http status codes with which search engines deny too many requests
+    blocking_status_codes = (429, 503)
+
     def __init__(self, config, *args, time_offset=0.0, **kwargs):
         """Initialize an HttScrape object to scrape over blocking http.
 
@@ -255,6 +258,9 @@ class HttpScrape(SearchEngineScrape, threading.Timer):
 
         success = True
 
+        if super().recently_failed():
+            return False
+
         self.build_search()
 
         if rand:
@@ -277,15 +283,25 @@ class HttpScrape(SearchEngineScrape, threading.Timer):
 
         except self.requests.ConnectionError as ce:
             self.status = 'Network problem occurred {}'.format(ce)
+            self.outcome = 'timeout'
             success = False
+            super().report_response(failed=True)
         except self.requests.Timeout as te:
             self.status = 'Connection timeout {}'.format(te)
+            self.outcome = 'timeout'
             success = False
+            super().report_response(failed=True)
         except self.requests.exceptions.RequestException as e:
             # In case of any http networking exception that wasn't caught
             # in the actual request, just end the worker.
             self.status = 'Stopping scraping because {}'.format(e)
+            super().report_response(failed=True)
         else:
+            blocked = request.status_code in self.blocking_status_codes or super().is_block_page(self.html,
+                                                                                                 request.url)
+            super().report_response(blocked=blocked, failed=not request.ok)
+            if blocked or not request.ok:
+                self.outcome = 'blocked'
             if not request.ok:
                 self.handle_request_denied(request.status_code)
                 success = False
@@ -295,12 +311,15 @@ class HttpScrape(SearchEngineScrape, threading.Timer):
         return success
 
     def run(self):
-        super().before_search()
+        try:
+            super().before_search()
 
-        if self.startable:
-            for self.query, self.pages_per_keyword in self.jobs.items():
+            if self.startable:
+                for self.query, self.pages_per_keyword in self.iter_jobs():
 
-                for self.page_number in self.pages_per_keyword:
+                    for self.page_number in self.pages_per_keyword:
 
-                    if not self.search(rand=True):
-                        self.missed_keywords.add(self.query)
+                        if not self.search(rand=True):
+                            self.missed_keywords.add(self.query)
+        finally:
+            super().after_scraping()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import os
+import array
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Journals the completed scrape jobs of a ScraperSearch.
+
+Whenever the SERP of a successful request is stored, the key (query,
+search engine, scrape method, page number) of its job is appended to the
+journal file of the ScraperSearch as an 8 byte hash. Blocked, timed out
+and empty responses are not journaled, they are retried on resume.
+
+The journals are kept in the journal/ subdirectory of the cache
+directory, named by the database and the id of their ScraperSearch.
+When an interrupted scrape is continued, the journal is read into a set
+and all completed jobs are skipped right away, without looking them up
+in the cache or the database.
+
+A journal of 10 million jobs has 80MB and is read in about two seconds.
+A record that was torn by a crash is ignored and overwritten. The records
+are written in the byte order of the machine.
+"""
+
+journal = None
+
+
+class CompletionJournal(object):
+    """An append-only file of the keys of completed scrape jobs."""
+
+    typecode = 'Q'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.num_records = 0
+
+    @staticmethod
+    def key(query, search_engine, scrape_method, page_number):
+        """Returns the 64 bit key of a scrape job."""
+        digest = hashlib.blake2b('\t'.join((query, search_engine, scrape_method, str(page_number))).encode(),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    @classmethod
+    def job_key(cls, job):
+        return cls.key(job['query'], job['search_engine'], job['scrape_method'], job['page_number'])
+
+    def load(self):
+        """Returns the set of the keys of all completed jobs."""
+        if not os.path.exists(self.path):
+            return set()
+
+        records = array.array(self.typecode)
+        with open(self.path, 'rb') as fd:
+            data = fd.read()
+
+        # ignore a record that was torn when the last scrape died
+        data = data[:len(data) - len(data) % records.itemsize]
+        records.frombytes(data)
+
+        return set(records)
+
+    def record(self, query, search_engine, scrape_method, page_number):
+        """Append the key of a completed job."""
+        record = array.array(self.typecode, [self.key(query, search_engine, scrape_method, page_number)])
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+                # drop a torn record, the new records would be misaligned otherwise
+                size = self.file.tell()
+                if size % record.itemsize:
+                    self.file.truncate(size - size % record.itemsize)
+            self.file.write(record.tobytes())
+            # a crash of the interpreter should not lose records
+            self.file.flush()
+            self.num_records += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def journal_directory(config):
+    """Returns the directory of the journals, by default in the cache directory."""
+    return config.get('journal_dir') or os.path.join(config.get('cachedir', '.scrapecache'), 'journal')
+
+
+def journal_path(config, scraper_search):
+    """Returns the path of the journal of a ScraperSearch.
+
+    The ids of the ScraperSearches start at 1 in every database, so the
+    name of a journal has a hash of the path of its database as well.
+    """
+    database = os.path.abspath(config.get('database_name', 'google_scraper') + '.db')
+    digest = hashlib.blake2b(database.encode(), digest_size=4).hexdigest()
+    return os.path.join(journal_directory(config), '{}-{}.journal'.format(digest, scraper_search.id))
+
+
+def load_completed_jobs(config, scraper_search):
+    """Returns the keys of the jobs that were completed for the ScraperSearch."""
+    return CompletionJournal(journal_path(config, scraper_search)).load()
+
+
+def skip_completed_jobs(scrape_jobs, completed):
+    """Yields the scrape jobs whose key is not in completed."""
+    for job in scrape_jobs:
+        if CompletionJournal.job_key(job) not in completed:
+            yield job
+
+
+def init_journal(config, scraper_search=None, new=False):
+    """Journal the completed jobs of the ScraperSearch from now on.
+
+    Without a ScraperSearch or when journal_completed_jobs is disabled, nothing is journaled.
+
+    Args:
+        config: The configuration dictionary.
+        scraper_search: The ScraperSearch whose jobs are journaled.
+        new: Whether the ScraperSearch was just created. The journal of a deleted
+            database whose ScraperSearch had the same id is removed.
+    """
+    global journal
+
+    close_journal()
+
+    if scraper_search is not None and config.get('journal_completed_jobs', True):
+        journal_dir = journal_directory(config)
+        if not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+        path = journal_path(config, scraper_search)
+        if new and os.path.exists(path):
+            os.remove(path)
+        journal = CompletionJournal(path)
+
+
+def record_serp(serp):
+    """Journal the job of a stored SERP.
+
+    SERPs that were parsed from a cache file by another process lack the search engine
+    and page number. They are not journaled and come from the cache again on resume.
+    """
+    if journal is not None and serp.search_engine_name and serp.scrape_method and serp.page_number:
+        journal.record(serp.query, serp.search_engine_name, serp.scrape_method, serp.page_number)
+
+
+def record_job(job):
+    """Journal a completed scrape job."""
+    if journal is not None:
+        journal.record(job['query'], job['search_engine'], job['scrape_method'], job['page_number'])
+
+
+def close_journal():
+    global journal
+
+    if journal is not None:
+        journal.close()
+        journal = None
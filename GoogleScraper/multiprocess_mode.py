@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import types
+import tempfile
+import threading
+import multiprocessing
+import logging
+from GoogleScraper.database import ScraperSearch, SERP, Link, get_session, fixtures
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.proxies import add_proxies_to_db
+from GoogleScraper.output_converter import init_outfile, store_serp_result
+from GoogleScraper.journal import init_journal
+
+logger = logging.getLogger(__name__)
+
+"""
+Scrapes with several processes.
+
+In http and selenium mode all parsing, database work and output writing
+happens in threads of a single interpreter. Because of the GIL, a
+scrape uses at most about one cpu core, no matter how many workers
+are configured.
+
+The MultiprocessScrapeScheduler shards the scrape jobs across several
+processes. Each process scrapes its shard with the configured scrape
+method, its own CacheManager and its own temporary database. The SERPs
+of a shard are sent back to the main process, which stores them in the
+main ScraperSearch and writes them to the output file.
+
+A scrape logs its throughput in jobs per second and how busy its
+processes were. It cannot tell how fast a single process would have
+been. The speedup over one process is measured by the process_scaling
+benchmark in Tests/benchmarks.py, which parses the same cached pages
+with 1, 2, 4 and all cores.
+"""
+
+
+def shard_scrape_jobs(scrape_jobs, num_shards):
+    """Split the scrape jobs into num_shards lists.
+
+    All jobs of a keyword end up in the same shard, because the pages
+    of a keyword are scraped one after another by the same worker.
+
+    Args:
+        scrape_jobs: An iterable of scrape jobs.
+        num_shards: The number of shards.
+
+    Returns:
+        A list of num_shards lists of scrape jobs.
+    """
+    shards = [[] for i in range(num_shards)]
+    shard_of_query = {}
+
+    for job in scrape_jobs:
+        if job['query'] not in shard_of_query:
+            shard_of_query[job['query']] = len(shard_of_query) % num_shards
+        shards[shard_of_query[job['query']]].append(job)
+
+    return shards
+
+
+def serp_to_dict(serp):
+    """Convert a SERP and its links to a picklable dictionary."""
+    data = {column.name: getattr(serp, column.name) for column in SERP.__table__.columns if column.name != 'id'}
+    data['links'] = [
+        {column.name: getattr(link, column.name) for column in Link.__table__.columns if column.name not in ('id', 'serp_id')}
+        for link in serp.links
+    ]
+    return data
+
+
+def serp_from_dict(data):
+    """Create a SERP with its links from a dictionary as returned by serp_to_dict()."""
+    data = dict(data)
+    links = data.pop('links')
+    serp = SERP(**data)
+    for link in links:
+        Link(serp=serp, **link)
+    return serp
+
+
+def scrape_shard(config, shard_id, scrape_jobs, proxies, search_engines):
+    """Scrape a shard of the scrape jobs. Runs in a worker process.
+
+    Args:
+        config: The configuration dictionary.
+        shard_id: The number of the shard.
+        scrape_jobs: The scrape jobs of this shard.
+        proxies: The proxies this process uses.
+        search_engines: The names of the search engines to scrape.
+
+    Returns:
+        A tuple (shard_id, number of jobs, list of SERPs as dictionaries, elapsed seconds).
+    """
+    from GoogleScraper.core import run_scrape
+
+    started = time.perf_counter()
+
+    # only the main process writes the output and the journal
+    config = dict(config, output_filename='', print_results='')
+    init_outfile(config, force_reload=True)
+    init_journal(config)
+
+    fd, db_path = tempfile.mkstemp(prefix='googlescraper_shard{}_'.format(shard_id), suffix='.db')
+    os.close(fd)
+
+    try:
+        session = get_session(config, path=db_path)()
+        fixtures(config, session)
+        add_proxies_to_db(proxies, session)
+
+        scraper_search = ScraperSearch(
+            number_search_engines_used=len(search_engines),
+            number_proxies_used=len(proxies),
+            number_search_queries=len(scrape_jobs),
+            used_search_engines=','.join(search_engines)
+        )
+
+        run_scrape(config, scrape_jobs, proxies, search_engines, cache_manager=CacheManager(config), session=session,
+                   scraper_search=scraper_search, db_lock=threading.Lock())
+
+        serps = [serp_to_dict(serp) for serp in scraper_search.serps]
+        session.close()
+    finally:
+        os.remove(db_path)
+
+    return shard_id, len(scrape_jobs), serps, time.perf_counter() - started
+
+
+def _scrape_shard(args):
+    return scrape_shard(*args)
+
+
+class MultiprocessScrapeScheduler(object):
+    """
+    Scrapes the jobs in several processes and merges the results.
+    """
+
+    def __init__(self, config, scrape_jobs, proxies, search_engines, num_processes, session=None, scraper_search=None,
+                 db_lock=None):
+        self.config = config
+        self.scrape_jobs = scrape_jobs
+        self.proxies = proxies
+        self.search_engines = search_engines
+        self.num_processes = num_processes
+        self.session = session
+        self.scraper_search = scraper_search
+        self.db_lock = db_lock or threading.Lock()
+
+        # shard_id => (number of jobs, number of serps, elapsed seconds)
+        self.shard_stats = {}
+        self.elapsed = 0
+
+    def shard_proxies(self, num_shards):
+        """Distribute the proxies among the processes.
+
+        When there are fewer proxies than processes, all processes use
+        all proxies and thus the request rate per ip address rises.
+        """
+        if len(self.proxies) >= num_shards:
+            return [self.proxies[i::num_shards] for i in range(num_shards)]
+
+        logger.warning('Only {} proxies for {} processes. The processes share the proxies.'.format(
+            len(self.proxies), num_shards))
+        return [self.proxies] * num_shards
+
+    def merge(self, serps):
+        """Store the SERPs of a shard in the main ScraperSearch and write them to the output."""
+        with self.db_lock:
+            for data in serps:
+                serp = serp_from_dict(data)
+                self.scraper_search.serps.append(serp)
+                self.session.add(serp)
+                store_serp_result(serp, self.config)
+
+            self.session.commit()
+
+    def run(self):
+        shards = [shard for shard in shard_scrape_jobs(self.scrape_jobs, self.num_processes) if shard]
+        if not shards:
+            return
+
+        proxies = self.shard_proxies(len(shards))
+
+        # module objects from external config files cannot be sent to other processes
+        config = {k: v for k, v in self.config.items() if not isinstance(v, (types.ModuleType, types.FunctionType))}
+
+        logger.info('Going to scrape {} jobs in {} processes.'.format(sum(map(len, shards)), len(shards)))
+
+        started = time.perf_counter()
+
+        with multiprocessing.Pool(len(shards)) as pool:
+            tasks = [(config, i, shard, proxies[i], self.search_engines) for i, shard in enumerate(shards)]
+            for shard_id, num_jobs, serps, elapsed in pool.imap_unordered(_scrape_shard, tasks):
+                self.merge(serps)
+                self.shard_stats[shard_id] = (num_jobs, len(serps), elapsed)
+                logger.info('Process {} scraped {} of {} jobs in {:.2f}s ({:.1f} jobs/s).'.format(
+                    shard_id, len(serps), num_jobs, elapsed, num_jobs / elapsed if elapsed else 0))
+
+        self.elapsed = time.perf_counter() - started
+        self.report()
+
+    def throughput(self):
+        """Returns the number of jobs per second over all processes."""
+        num_jobs = sum(stats[0] for stats in self.shard_stats.values())
+        return num_jobs / self.elapsed if self.elapsed else 0
+
+    def parallelism(self):
+        """Returns how many processes were busy on average, their summed busy time over the wall time.
+
+        This is the occupancy of the processes, not the speedup over a single process: processes
+        that wait on the network count as busy. Tests/benchmarks.py process_scaling measures the
+        throughput against a run in one process.
+        """
+        busy = sum(stats[2] for stats in self.shard_stats.values())
+        return busy / self.elapsed if self.elapsed else 0
+
+    def report(self):
+        """Logs the throughput and how busy the processes were.
+
+        Not the speedup over a single process, which would need a second run, see parallelism().
+        """
+        num_processes = len(self.shard_stats)
+        parallelism = self.parallelism()
+        logger.info('Scraped with {} processes on {} cores in {:.2f}s: {:.1f} jobs/s, {:.2f} processes busy on '
+                    'average ({:.0%} occupancy).'.format(num_processes, os.cpu_count(), self.elapsed,
+                                                         self.throughput(), parallelism,
+                                                         parallelism / num_processes if num_processes else 0))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import threading
+import logging
+from GoogleScraper.proxies import Proxy
+
+logger = logging.getLogger(__name__)
+
+"""
+Remembers the requests that failed, per scrape job and proxy.
+
+The cache of the SERP pages only holds pages that are worth replaying. A
+request that was blocked (a captcha page like google's /sorry/ or a denied
+http status), timed out or returned a page without results is recorded in
+the NegativeCache instead, keyed by its scrape job and the proxy that made
+it, and expires after the ttl of its reason:
+
+    'blocked':    the search engine detected the scraping.
+    'timeout':    the request timed out or the connection failed.
+    'no_results': the page had no results, often a soft block.
+
+Until then the ScrapeJobDispatcher assigns the job to a worker with another
+proxy and the workers skip the job when it failed with their proxy, so a
+retry doesn't hit the same (keyword, proxy) pair again right away. The
+records are kept in an sqlite database in the negative/ subdirectory of the
+cache directory, so that they survive the scrape and are shared by the
+processes of a scrape.
+"""
+
+REASONS = ('blocked', 'timeout', 'no_results')
+
+DEFAULT_TTLS = {'blocked': 30 * 60, 'timeout': 5 * 60, 'no_results': 60 * 60}
+
+
+def proxy_key(proxy):
+    """Returns how a proxy is identified in the negative cache, like the requested_by of a scraper."""
+    if isinstance(proxy, Proxy):
+        return '{}:{}'.format(proxy.host, proxy.port)
+    return 'localhost'
+
+
+def job_of(page):
+    """Returns the scrape job of a scraper or a FetchedPage."""
+    return {'query': page.query, 'search_engine': page.search_engine_name, 'scrape_method': page.scrape_method,
+            'page_number': page.page_number}
+
+
+class NegativeCache(object):
+    """Maps (scrape job, proxy) pairs to the reason their last request failed, until its ttl ran out."""
+
+    def __init__(self, cachedir, ttls=None):
+        """Create a new negative cache. The database is opened on first use.
+
+        Args:
+            cachedir: The cache directory. The database is stored in its subdirectory negative/.
+            ttls: A dictionary of the reasons to the seconds their records are kept. A reason with a
+                ttl of 0 is not recorded. Missing reasons have the DEFAULT_TTLS.
+        """
+        self.directory = os.path.join(cachedir, 'negative')
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        for reason in self.ttls:
+            assert reason in REASONS, 'Invalid reason for the negative cache: {}'.format(reason)
+
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+
+        # how many failures were recorded and how many requests were avoided
+        self.num_recorded = 0
+        self.num_avoided = 0
+
+    def connection(self):
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                # a forked process must not use the connection of its parent
+                self.pid = os.getpid()
+                os.makedirs(self.directory, exist_ok=True)
+                self.conn = sqlite3.connect(os.path.join(self.directory, 'negative.sqlite'), timeout=60,
+                                            check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode = WAL')
+                self.conn.execute('PRAGMA synchronous = NORMAL')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS failures (search_engine TEXT, scrape_method TEXT, '
+                                  'page_number INTEGER, query TEXT, proxy TEXT, reason TEXT, expires REAL, '
+                                  'PRIMARY KEY (search_engine, scrape_method, page_number, query, proxy)) '
+                                  'WITHOUT ROWID')
+            return self.conn
+
+    def key(self, job):
+        return job['search_engine'], job['scrape_method'], job['page_number'], job['query']
+
+    def record(self, job, proxy, reason):
+        """Remember that the request of a job with a proxy failed.
+
+        Args:
+            job: The scrape job.
+            proxy: The proxy as returned by proxy_key().
+            reason: One of REASONS.
+        """
+        assert reason in REASONS, 'Invalid reason for the negative cache: {}'.format(reason)
+        ttl = self.ttls[reason]
+        if not ttl:
+            return
+        with self.lock:
+            conn = self.connection()
+            conn.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         self.key(job) + (proxy, reason, time.time() + ttl))
+            conn.commit()
+            self.num_recorded += 1
+        logger.debug('Not repeating keyword "{}" with {} for {} seconds: {}'.format(job['query'], proxy, ttl, reason))
+
+    def get(self, job, proxy):
+        """Returns why the request of a job with a proxy failed recently or None."""
+        with self.lock:
+            row = self.connection().execute(
+                'SELECT reason FROM failures WHERE search_engine = ? AND scrape_method = ? AND page_number = ? AND '
+                'query = ? AND proxy = ? AND expires > ?', self.key(job) + (proxy, time.time())).fetchone()
+        return row[0] if row else None
+
+    def failed_proxies(self, job):
+        """Returns a dictionary of the proxies whose request of a job failed recently to the reasons."""
+        with self.lock:
+            rows = self.connection().execute(
+                'SELECT proxy, reason FROM failures WHERE search_engine = ? AND scrape_method = ? AND '
+                'page_number = ? AND query = ? AND expires > ?', self.key(job) + (time.time(),)).fetchall()
+        return dict(rows)
+
+    def avoided(self):
+        """Count a request that was not made because it failed recently."""
+        with self.lock:
+            self.num_avoided += 1
+
+    def purge(self):
+        """Remove the expired records."""
+        with self.lock:
+            conn = self.connection()
+            conn.execute('DELETE FROM failures WHERE expires <= ?', (time.time(),))
+            conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection().execute('SELECT COUNT(*) FROM failures WHERE expires > ?',
+                                             (time.time(),)).fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
@@ -6,6 +6,7 @@ import json
 import pprint
 import logging
 from GoogleScraper.database import Link, SERP
+from GoogleScraper.journal import record_serp, record_job
 
 """Stores SERP results in the appropriate output format.
 
@@ -75,6 +76,8 @@ def init_outfile(config, force_reload=False):
             output_format = 'json'
         elif output_file.endswith('.csv'):
             output_format = 'csv'
+        else:
+            output_format = 'stdout'
 
         # the output files. Either CSV or JSON or STDOUT
         # It's little bit tricky to write the JSON output file, since we need to
@@ -88,7 +91,7 @@ def init_outfile(config, force_reload=False):
             outfile = sys.stdout
 
 
-def store_serp_result(serp, config):
+def store_serp_result(serp, config, job=None, outcome=None):
     """Store the parsed SERP page.
 
     Stores the results from scraping in the appropriate output format.
@@ -102,6 +105,9 @@ def store_serp_result(serp, config):
 
     Args:
         serp: A serp object
+        job: The scrape job of the serp. Journaled instead of the serp when given.
+        outcome: Why the request of the serp failed, see negative_cache.REASONS. None if it succeeded.
+            Only successful requests with results are journaled, the others are retried on resume.
     """
     global outfile, output_format
 
@@ -122,6 +128,12 @@ def store_serp_result(serp, config):
             elif config.get('print_results') == 'all':
                 pprint.pprint(data)
 
+    if outcome is None and serp.num_results:
+        if job:
+            record_job(job)
+        else:
+            record_serp(serp)
+
 
 def row2dict(obj):
     """Convert sql alchemy object to dictionary."""
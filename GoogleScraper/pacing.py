@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+import time
+import heapq
+import random
+import itertools
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Paces the requests to the search engines.
+
+Consecutive requests with the same proxy to the same search engine are
+spaced by a random delay. The delays are drawn from the sleeping ranges
+of the search engine ({engine}_sleeping_ranges or sleeping_ranges) and
+after the n-th request from fixed_sleeping_ranges.
+
+The PacingScheduler keeps one small state per (search engine, proxy):
+the time at which its next request is eligible and the number of requests
+so far. The delay of a request is drawn lazily when the request is
+reserved. All waiting workers are woken by a single timer thread that
+pops the due entries from a heap. Workers that share a proxy share its
+pace, and callers that must not block can register a callback instead.
+
+With an AdaptiveThrottle, the delays are scaled by the delay factor that
+the throttle learned for the (search engine, proxy).
+"""
+
+
+class SleepingDistribution(object):
+    """Draws random delays from a sleeping_ranges dictionary.
+
+    The keys are the probabilities in percent of the (min, max) ranges.
+    """
+
+    def __init__(self, sleeping_ranges):
+        assert sum(sleeping_ranges.keys()) == 100, 'The sum of the keys of sleeping_ranges must be 100!'
+        self.ranges = list(sleeping_ranges.values())
+        self.weights = list(sleeping_ranges.keys())
+
+    def sample(self):
+        """Returns a random delay in seconds."""
+        sleep_range = random.choices(self.ranges, weights=self.weights)[0]
+        return random.randrange(*sleep_range)
+
+
+class PacingState(object):
+    """The pace of one (search engine, proxy)."""
+
+    __slots__ = ('next_eligible', 'num_requests')
+
+    def __init__(self):
+        self.next_eligible = 0
+        self.num_requests = 0
+
+
+class PacingScheduler(object):
+    """Computes when requests are eligible and wakes the waiting workers."""
+
+    def __init__(self, config, throttle=None):
+        self.config = config
+        self.throttle = throttle
+        self.do_sleep = config.get('do_sleep', True)
+        self.fixed_sleeping_ranges = config.get('fixed_sleeping_ranges', None) or {}
+
+        # search engine => SleepingDistribution
+        self.distributions = {}
+
+        # (search engine, proxy) => PacingState
+        self.states = {}
+
+        # (eligible time, sequence number, callback)
+        self.timers = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.timer_thread = None
+
+    def now(self):
+        return time.monotonic()
+
+    def distribution(self, search_engine):
+        if search_engine not in self.distributions:
+            sleeping_ranges = self.config.get('{}_sleeping_ranges'.format(search_engine),
+                                              self.config.get('sleeping_ranges'))
+            self.distributions[search_engine] = SleepingDistribution(sleeping_ranges)
+        return self.distributions[search_engine]
+
+    def next_delay(self, search_engine, proxy, num_requests):
+        """The delay in seconds before the request with the given number."""
+        delay = self.distribution(search_engine).sample()
+        if self.throttle is not None:
+            delay *= self.throttle.delay_factor(search_engine, proxy)
+        if num_requests in self.fixed_sleeping_ranges:
+            delay += random.randrange(*self.fixed_sleeping_ranges[num_requests])
+        return delay
+
+    def reserve(self, search_engine, proxy=None):
+        """Reserve the next request slot of a (search engine, proxy). Does not block.
+
+        Args:
+            search_engine: The name of the search engine.
+            proxy: The proxy of the request. None is the own ip address.
+
+        Returns:
+            The time (as returned by now()) at which the request may be sent.
+        """
+        now = self.now()
+        if not self.do_sleep:
+            return now
+
+        with self.condition:
+            state = self.states.get((search_engine, proxy))
+            if state is None:
+                state = self.states[search_engine, proxy] = PacingState()
+                state.next_eligible = now
+
+            eligible = max(now, state.next_eligible + self.next_delay(search_engine, proxy, state.num_requests))
+            state.next_eligible = eligible
+            state.num_requests += 1
+
+        return eligible
+
+    def call_at(self, eligible, callback):
+        """Call callback from the timer thread when the time eligible has come."""
+        with self.condition:
+            heapq.heappush(self.timers, (eligible, next(self.sequence), callback))
+            if self.timer_thread is None:
+                self.timer_thread = threading.Thread(target=self.run_timers, name='PacingScheduler', daemon=True)
+                self.timer_thread.start()
+            self.condition.notify()
+
+    def call_when_eligible(self, search_engine, proxy, callback):
+        """Reserve a request slot and call callback when it is due. Does not block.
+
+        Returns:
+            The delay in seconds until the callback is called.
+        """
+        eligible = self.reserve(search_engine, proxy)
+        delay = eligible - self.now()
+        if delay <= 0:
+            callback()
+            return 0
+        self.call_at(eligible, callback)
+        return delay
+
+    def wait(self, search_engine, proxy=None):
+        """Block the calling worker until its next request is eligible.
+
+        Returns:
+            The number of seconds the worker waited.
+        """
+        started = self.now()
+        woken = threading.Event()
+        if self.call_when_eligible(search_engine, proxy, woken.set) > 0:
+            woken.wait()
+        return self.now() - started
+
+    def run_timers(self):
+        """Wake the workers whose requests are due. Runs in the timer thread."""
+        while True:
+            with self.condition:
+                while not self.timers or self.timers[0][0] > self.now():
+                    self.condition.wait(self.timers[0][0] - self.now() if self.timers else None)
+                eligible, sequence, callback = heapq.heappop(self.timers)
+
+            try:
+                callback()
+            except Exception as e:
+                logger.error('Pacing callback failed: {}'.format(e))
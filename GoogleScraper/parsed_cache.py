@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import zlib
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Keeps the parsed results of the cached SERP pages next to their html.
+
+Replaying the cache used to parse every cached page again: an lxml DOM
+build and all css selectors of its parser, which makes re-exporting a large
+cache cpu bound. When a page is cached, the results its parser extracted
+are stored too, as compressed json in an sqlite database in the parsed/
+subdirectory of the cache directory, keyed by the name of the cached page.
+
+Each record carries the version of the parser that produced it, a hash of
+the source code of the parser class and its selectors (see
+parsing.parser_version()). A record is only served when the version of the
+current parser matches. Otherwise the page is parsed again and the record
+is replaced, so changing a selector invalidates the records of its search
+engine automatically.
+"""
+
+
+class ParsedResults(object):
+    """The results of a parser, without the parser and its DOM.
+
+    Has the attributes that SearchEngineResultsPage.set_values_from_parser() reads.
+    """
+
+    fields = ('num_results_for_query', 'num_results', 'effective_query', 'no_results', 'search_results')
+
+    def __init__(self, num_results_for_query='', num_results=0, effective_query='', no_results=False,
+                 search_results=None):
+        self.num_results_for_query = num_results_for_query
+        self.num_results = num_results
+        self.effective_query = effective_query
+        self.no_results = no_results
+        self.search_results = search_results or {}
+
+    @classmethod
+    def from_parser(cls, parser):
+        return cls(**{field: getattr(parser, field) for field in cls.fields})
+
+    def encode(self):
+        data = json.dumps({field: getattr(self, field) for field in self.fields}, separators=(',', ':'))
+        return zlib.compress(data.encode())
+
+    @classmethod
+    def decode(cls, data):
+        return cls(**json.loads(zlib.decompress(data).decode()))
+
+
+class ParsedResultStore(object):
+    """Maps the names of cached pages to the parsed results and the version of their parser."""
+
+    def __init__(self, cachedir):
+        """Create a new store. The database is opened on first use.
+
+        Args:
+            cachedir: The cache directory. The database is stored in its subdirectory parsed/.
+        """
+        self.directory = os.path.join(cachedir, 'parsed')
+        self.lock = threading.RLock()
+        self.conn = None
+        self.pid = None
+
+    def connection(self):
+        with self.lock:
+            if self.conn is None or self.pid != os.getpid():
+                # a forked process must not use the connection of its parent
+                self.pid = os.getpid()
+                os.makedirs(self.directory, exist_ok=True)
+                self.conn = sqlite3.connect(os.path.join(self.directory, 'results.sqlite'), timeout=60,
+                                            check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode = WAL')
+                self.conn.execute('PRAGMA synchronous = NORMAL')
+                self.conn.execute('CREATE TABLE IF NOT EXISTS results (name TEXT PRIMARY KEY, version TEXT, '
+                                  'data BLOB) WITHOUT ROWID')
+            return self.conn
+
+    def get(self, name, version):
+        """Returns the ParsedResults of a cached page or None if there are none of this parser version."""
+        with self.lock:
+            row = self.connection().execute('SELECT version, data FROM results WHERE name = ?', (name,)).fetchone()
+        if row is None or row[0] != version:
+            return None
+        try:
+            return ParsedResults.decode(row[1])
+        except (zlib.error, ValueError, TypeError) as e:
+            logger.warning('Cannot decode the parsed results of {}: {}'.format(name, e))
+            return None
+
+    def put(self, name, version, results):
+        """Store the ParsedResults (or parser) of a cached page."""
+        if not isinstance(results, ParsedResults):
+            results = ParsedResults.from_parser(results)
+        data = results.encode()
+        with self.lock:
+            conn = self.connection()
+            conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (name, version, data))
+            conn.commit()
+
+    def remove(self, names):
+        names = list(names)
+        with self.lock:
+            conn = self.connection()
+            for i in range(0, len(names), 500):
+                chunk = names[i:i + 500]
+                conn.execute('DELETE FROM results WHERE name IN ({})'.format(', '.join('?' * len(chunk))), chunk)
+            conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.conn.close()
+            self.conn = None
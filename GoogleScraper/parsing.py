@@ -3,6 +3,10 @@
 import sys
 import os
 import re
+import hashlib
+import inspect
+import functools
+import lxml.etree
 import lxml.html
 from lxml.html.clean import Cleaner
 from urllib.parse import unquote
@@ -26,6 +30,92 @@ class NoParserForSearchEngineException(Exception):
     pass
 
 
+"""
+The css selectors of the parsers are compiled once.
+
+Translating a css selector to xpath with cssselect and compiling the xpath
+costs far more than evaluating it on a result element. The selectors used
+to be translated again for every result on every page, now each distinct
+selector is translated and compiled to an lxml.etree.XPath on first use
+and the pseudo elements ::text and ::attr(name) are resolved at the same
+time. The compiled selectors are kept by their css string, so selectors
+that are changed at runtime are compiled when they are first used, too.
+"""
+
+translator = HTMLTranslator()
+
+
+@functools.lru_cache(maxsize=None)
+def css_to_xpath(css):
+    """Returns the xpath of a css selector, translated once."""
+    return translator.css_to_xpath(css)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_css(css):
+    """Returns an lxml.etree.XPath that selects the elements a css selector matches."""
+    return lxml.etree.XPath(css_to_xpath(css))
+
+
+class CompiledSelector(object):
+    """A css selector with an optional ::text or ::attr(name) pseudo element, compiled to xpath.
+
+    Calling it with an element returns the text content of the first matching element,
+    the value of its attribute with ::attr(name) or None if nothing matches.
+    """
+
+    __slots__ = ('selector', 'xpath', 'attr')
+
+    def __init__(self, selector):
+        self.selector = selector
+        self.attr = None
+
+        css = selector
+        if selector.endswith('::text'):
+            css = selector.split('::')[0]
+        else:
+            match = re.search(r'::attr\((?P<attr>.*)\)$', selector)
+            if match:
+                self.attr = match.group('attr')
+                css = selector.split('::')[0]
+
+        # only the first match is used
+        self.xpath = lxml.etree.XPath('({})[1]'.format(css_to_xpath(css)))
+
+    def __call__(self, element):
+        matches = self.xpath(element)
+        if not matches:
+            return None
+        if self.attr is not None:
+            return matches[0].get(self.attr)
+        return matches[0].text_content()
+
+
+@functools.lru_cache(maxsize=None)
+def compile_selector(selector):
+    """Returns the CompiledSelector of a css selector."""
+    return CompiledSelector(selector)
+
+
+def parse_selection(config):
+    """Returns the result types and fields that are configured to be parsed.
+
+    Args:
+        config: The configuration with the options parse_result_types and parse_result_fields,
+            lists or comma separated strings.
+
+    Returns:
+        A (result types, fields) tuple of sorted tuples. An empty tuple stands for all.
+    """
+    selection = []
+    for option in ('parse_result_types', 'parse_result_fields'):
+        value = config.get(option) or ()
+        if isinstance(value, str):
+            value = value.split(',')
+        selection.append(tuple(sorted({item.strip() for item in value if item.strip()})))
+    return tuple(selection)
+
+
 class Parser():
     """Parses SERP pages.
 
@@ -61,6 +151,9 @@ class Parser():
     # The supported search types. For instance, Google supports Video Search, Image Search, News search
     search_types = []
 
+    # the fields of a result that are always parsed, because after_parsing() needs them
+    required_fields = ('link',)
+
     # Each subclass of Parser may declare an arbitrary amount of attributes that
     # follow a naming convention like this:
     # *_search_selectors
@@ -69,13 +162,18 @@ class Parser():
     # If you didn't specify the search type in the search_types list, this attribute
     # will not be evaluated and no data will be parsed.
 
-    def __init__(self, config={}, html='', query=''):
+    def __init__(self, config={}, html='', query='', result_types=None, result_fields=None):
         """Create new Parser instance and parse all information.
 
         Args:
             html: The raw html from the search engine search. If not provided, you can parse
                     the data later by calling parse(html) directly.
             searchtype: The search type. By default "normal"
+            result_types: Only parse these result types, like 'results' or 'ads_main'. Defaults to
+                    the parse_result_types option, all result types if empty.
+            result_fields: Only parse these fields of the results, like 'link' or 'title'. The rank and the
+                    required_fields are always parsed. Defaults to the parse_result_fields option, all
+                    fields if empty.
 
         Raises:
             Assertion error if the subclassed
@@ -91,6 +189,13 @@ class Parser():
         self.query = query
         self.html = html
         self.dom = None
+
+        # the selectors of the result types and fields that are not requested are not evaluated
+        configured_types, configured_fields = parse_selection(self.config)
+        self.result_types = tuple(sorted(result_types)) if result_types is not None else configured_types
+        self.result_fields = tuple(sorted(result_fields)) if result_fields is not None else configured_fields
+        if self.result_fields:
+            self.result_fields = tuple(sorted(set(self.result_fields) | set(self.required_fields)))
         self.search_results = {}
         self.num_results_for_query = ''
         self.num_results = 0
@@ -102,7 +207,7 @@ class Parser():
         self.search_engine = ''
 
         # short alias because we use it so extensively
-        self.css_to_xpath = HTMLTranslator().css_to_xpath
+        self.css_to_xpath = css_to_xpath
 
         if self.html:
             self.parse()
@@ -178,6 +283,9 @@ class Parser():
 
         for result_type, selector_class in selector_dict.items():
 
+            if self.result_types and result_type not in self.result_types:
+                continue
+
             self.search_results[result_type] = []
 
             for selector_specific, selectors in selector_class.items():
@@ -187,27 +295,20 @@ class Parser():
                 else:
                     css = selectors['container']
 
-                results = self.dom.xpath(
-                    self.css_to_xpath(css)
-                )
+                results = compile_css(css)(self.dom)
 
                 to_extract = set(selectors.keys()) - {'container', 'result_container'}
-                selectors_to_use = {key: selectors[key] for key in to_extract if key in selectors.keys()}
+                if self.result_fields:
+                    to_extract &= set(self.result_fields)
+                # the pseudo selectors ::text and ::attr(attribute) are resolved by compile_selector()
+                selectors_to_use = [(key, compile_selector(selectors[key])) for key in to_extract]
 
                 for index, result in enumerate(results):
-                    # Let's add primitive support for CSS3 pseudo selectors
-                    # We just need two of them
-                    # ::text
-                    # ::attr(attribute)
-
-                    # You say we should use xpath expressions instead?
-                    # Maybe you're right, but they are complicated when it comes to classes,
-                    # have a look here: http://doc.scrapy.org/en/latest/topics/selectors.html
                     serp_result = {}
                     # key are for example 'link', 'snippet', 'visible-url', ...
-                    # selector is the selector to grab these items
-                    for key, selector in selectors_to_use.items():
-                        serp_result[key] = self.advanced_css(selector, result)
+                    # selector is the compiled selector to grab these items
+                    for key, selector in selectors_to_use:
+                        serp_result[key] = selector(result)
 
                     serp_result['rank'] = index + 1
 
@@ -228,29 +329,7 @@ class Parser():
             The targeted element.
 
         """
-        value = None
-
-        if selector.endswith('::text'):
-            try:
-                value = element.xpath(self.css_to_xpath(selector.split('::')[0]))[0].text_content()
-            except IndexError:
-                pass
-        else:
-            match = re.search(r'::attr\((?P<attr>.*)\)$', selector)
-
-            if match:
-                attr = match.group('attr')
-                try:
-                    value = element.xpath(self.css_to_xpath(selector.split('::')[0]))[0].get(attr)
-                except IndexError:
-                    pass
-            else:
-                try:
-                    value = element.xpath(self.css_to_xpath(selector))[0].text_content()
-                except IndexError:
-                    pass
-
-        return value
+        return compile_selector(selector)(element)
 
     def first_match(self, selectors, element):
         """Get the first match.
@@ -681,6 +760,9 @@ class YahooParser(Parser):
 
     search_types = ['normal', 'image']
 
+    # after_parsing() drops the results without a visible link
+    required_fields = ('link', 'visible_link')
+
     no_results_selector = []
 
     effective_query_selector = ['.msg #cquery a::attr(href)']
@@ -748,7 +830,7 @@ class YahooParser(Parser):
             if self.num_results == 0:
                 self.no_results = True
 
-            if len(self.dom.xpath(self.css_to_xpath('#cquery'))) >= 1:
+            if len(compile_css('#cquery')(self.dom)) >= 1:
                 self.no_results = True
 
             for key, i in self.iter_serp_items():
@@ -829,7 +911,7 @@ class BaiduParser(Parser):
         super().after_parsing()
 
         if self.search_engine == 'normal':
-            if len(self.dom.xpath(self.css_to_xpath('.hit_top_new'))) >= 1:
+            if len(compile_css('.hit_top_new')(self.dom)) >= 1:
                 self.no_results = True
 
         if self.searchtype == 'image':
@@ -889,7 +971,7 @@ class DuckduckgoParser(Parser):
         if self.searchtype == 'normal':
 
             try:
-                if 'No more results.' in self.dom.xpath(self.css_to_xpath('.no-results'))[0].text_content():
+                if 'No more results.' in compile_css('.no-results')(self.dom)[0].text_content():
                     self.no_results = True
             except:
                 pass
@@ -1041,6 +1123,46 @@ def get_parser_by_search_engine(search_engine):
         raise NoParserForSearchEngineException('No such parser for "{}"'.format(search_engine))
 
 
+def parser_version(parser_class, search_type='normal', result_types=(), result_fields=()):
+    """Returns a hash of everything that determines the results of a parser.
+
+    That is the source code of the parser class and its base classes, which
+    includes the after_parsing() cleanups, its css selectors and the result
+    types and fields it parses. The parsed results of cached pages are only
+    reused by a parser of the same version.
+
+    Args:
+        parser_class: A subclass of Parser.
+        search_type: The search type the parser is used for.
+        result_types: The result types the parser parses, see parse_selection(). Empty for all.
+        result_fields: The fields the parser parses, see parse_selection(). Empty for all.
+    """
+    # the selectors may have been changed at runtime, so the hash is memoized per selector values
+    selectors = {name: getattr(parser_class, name) for name in dir(parser_class)
+                 if name.endswith('_selectors') or name.endswith('_selector')}
+    return _parser_version(parser_class, search_type, tuple(result_types), tuple(result_fields), repr(selectors))
+
+
+@functools.lru_cache(maxsize=256)
+def _parser_version(parser_class, search_type, result_types, result_fields, selectors):
+    sha = hashlib.sha1(search_type.encode())
+    for cls in parser_class.__mro__:
+        if issubclass(cls, Parser):
+            try:
+                sha.update(cls.__name__.encode() + inspect.getsource(cls).encode())
+            except (OSError, TypeError):
+                # no source code available
+                sha.update(cls.__name__.encode())
+
+    sha.update(selectors.encode())
+
+    if result_types or result_fields:
+        if result_fields:
+            result_fields = tuple(sorted(set(result_fields) | set(parser_class.required_fields)))
+        sha.update(repr((result_types, result_fields)).encode())
+    return sha.hexdigest()
+
+
 def parse_serp(config, html=None, parser=None, scraper=None, search_engine=None, query=''):
     """Store the parsed data in the sqlalchemy session.
 
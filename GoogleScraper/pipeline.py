@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import threading
+import logging
+from GoogleScraper.parsing import get_parser_by_search_engine, parse_serp
+from GoogleScraper.output_converter import store_serp_result
+from GoogleScraper.negative_cache import job_of
+
+logger = logging.getLogger(__name__)
+
+"""
+Decouples fetching, parsing and storing of the SERP pages.
+
+The scrape workers only fetch: after a request they hand a FetchedPage
+to the ScrapePipeline and go on with the next request. Parse threads turn
+the raw html into parsers and a single store thread persists the results
+(database, output file and cache). The store thread commits all pages that
+are waiting in one transaction, so a slow commit is paid once per batch.
+
+fetch --(parse queue)--> parse --(store queue)--> store
+
+Both queues are bounded. When a later stage can't keep up, its queue fills
+and the earlier stage blocks, up to the fetchers. The queue depths of the
+stages show which stage limits the throughput: the stage behind a full
+queue is the bottleneck.
+"""
+
+
+class FetchedPage(object):
+    """A snapshot of the request of a scrape worker.
+
+    Has the attributes that SearchEngineResultsPage.set_values_from_scraper() reads.
+    """
+
+    __slots__ = ('query', 'search_engine_name', 'scrape_method', 'page_number', 'requested_at', 'requested_by',
+                 'status', 'html', 'outcome')
+
+    def __init__(self, query, search_engine_name, scrape_method, page_number, requested_at=None, requested_by='',
+                 status='successful', html='', outcome=None):
+        self.query = query
+        self.search_engine_name = search_engine_name
+        self.scrape_method = scrape_method
+        self.page_number = page_number
+        self.requested_at = requested_at
+        self.requested_by = requested_by
+        self.status = status
+        self.html = html
+        # why the request failed, see negative_cache.REASONS
+        self.outcome = outcome
+
+    @classmethod
+    def from_scraper(cls, scraper):
+        return cls(scraper.query, scraper.search_engine_name, scraper.scrape_method, scraper.page_number,
+                   requested_at=scraper.requested_at, requested_by=scraper.requested_by, status=scraper.status,
+                   html=scraper.html, outcome=scraper.outcome)
+
+
+class StageStats(object):
+    """Queue depth and utilization of a pipeline stage."""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.num_items = 0
+        self.busy = 0.0
+
+        # the depth of the input queue, sampled whenever an item is put into it
+        self.depth = 0
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.num_samples = 0
+
+    def sample(self, depth):
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+        self.depth_sum += depth
+        self.num_samples += 1
+
+    def as_dict(self):
+        return {
+            'items': self.num_items,
+            'workers': self.workers,
+            'busy_seconds': round(self.busy, 3),
+            'queue_depth': self.depth,
+            'max_queue_depth': self.max_depth,
+            'mean_queue_depth': round(self.depth_sum / self.num_samples, 2) if self.num_samples else 0,
+        }
+
+
+class ScrapePipeline(object):
+    """Parses and stores the pages that the scrape workers fetched, in background threads."""
+
+    def __init__(self, config, session, scraper_search, db_lock, cache_manager=None):
+        """Create a new pipeline. The stage threads are started by start().
+
+        Args:
+            config: The configuration dictionary.
+            session: The sqlalchemy session to store the SERPs in.
+            scraper_search: The ScraperSearch the SERPs are assigned to.
+            db_lock: The lock that guards the session.
+            cache_manager: Caches the html of the pages when given.
+        """
+        self.config = config
+        self.session = session
+        self.scraper_search = scraper_search
+        self.db_lock = db_lock
+        self.cache_manager = cache_manager
+
+        queue_size = int(config.get('pipeline_queue_size', 100))
+        self.parse_queue = queue.Queue(queue_size)
+        self.store_queue = queue.Queue(queue_size)
+
+        self.num_parse_workers = max(int(config.get('num_parse_workers', 1)), 1)
+        self.store_batch_size = max(int(config.get('store_batch_size', 50)), 1)
+
+        self.stats = {
+            'parse': StageStats('parse', self.num_parse_workers),
+            'store': StageStats('store', 1),
+        }
+        self.stats_lock = threading.Lock()
+
+        self.threads = []
+
+    def start(self):
+        for i in range(self.num_parse_workers):
+            self.threads.append(threading.Thread(target=self.parse_stage, name='ParseStage-{}'.format(i), daemon=True))
+        self.store_thread = threading.Thread(target=self.store_stage, name='StoreStage', daemon=True)
+
+        for thread in self.threads + [self.store_thread]:
+            thread.start()
+
+        return self
+
+    def put(self, stage, item):
+        """Put an item into the input queue of a stage. Blocks while the queue is full."""
+        stage_queue = self.parse_queue if stage == 'parse' else self.store_queue
+        stage_queue.put(item)
+        with self.stats_lock:
+            self.stats[stage].sample(stage_queue.qsize())
+
+    def submit(self, page):
+        """Hand a FetchedPage over to the parse stage."""
+        self.put('parse', page)
+
+    def record(self, stage, num_items, started):
+        with self.stats_lock:
+            self.stats[stage].num_items += num_items
+            self.stats[stage].busy += time.perf_counter() - started
+
+    def parse_stage(self):
+        while True:
+            page = self.parse_queue.get()
+            if page is None:
+                break
+
+            started = time.perf_counter()
+            parser = None
+            if page.html:
+                try:
+                    parser = get_parser_by_search_engine(page.search_engine_name)(config=self.config, query=page.query)
+                    parser.parse(page.html)
+                except Exception as e:
+                    logger.error('Cannot parse keyword "{}" of {}: {}'.format(page.query, page.search_engine_name, e))
+                    parser = None
+            self.record('parse', 1, started)
+
+            self.put('store', (page, parser))
+
+    def store_stage(self):
+        done = False
+        while not done:
+            batch = [self.store_queue.get()]
+            while len(batch) < self.store_batch_size:
+                try:
+                    batch.append(self.store_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                done = True
+                batch = [item for item in batch if item is not None]
+
+            started = time.perf_counter()
+            try:
+                self.store(batch)
+            except Exception as e:
+                logger.error('Cannot store {} SERPs: {}'.format(len(batch), e))
+            self.record('store', len(batch), started)
+
+    def store(self, batch):
+        """Store the parsed pages in the database and the output, commit once for the whole batch."""
+        with self.db_lock:
+            serps = []
+            outcomes = []
+            for page, parser in batch:
+                serp = parse_serp(self.config, parser=parser, scraper=page, query=page.query)
+                self.scraper_search.serps.append(serp)
+                self.session.add(serp)
+                serps.append(serp)
+                outcomes.append(page.outcome or (None if serp.num_results else 'no_results'))
+
+                if not serp.num_results:
+                    logger.debug('No results to store for keyword: "{}" in search engine: {}'.format(
+                        page.query, page.search_engine_name))
+
+            self.session.commit()
+
+            # only the jobs of successful requests are journaled
+            for serp, outcome in zip(serps, outcomes):
+                store_serp_result(serp, self.config, outcome=outcome)
+
+        if self.cache_manager is not None:
+            for (page, parser), outcome in zip(batch, outcomes):
+                # blocked and empty pages would poison the cache, they are remembered in the negative cache instead
+                if outcome is None:
+                    self.cache_manager.cache_results(parser, page.query, page.search_engine_name, page.scrape_method,
+                                                     page.page_number)
+                elif self.cache_manager.negative is not None:
+                    self.cache_manager.negative.record(job_of(page), page.requested_by, outcome)
+
+    def close(self):
+        """Wait until all submitted pages are stored and stop the stage threads."""
+        for thread in self.threads:
+            self.parse_queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        self.store_queue.put(None)
+        self.store_thread.join()
+
+        logger.info('Pipeline stages: {}'.format(self.report()))
+
+    def report(self):
+        """Returns the metrics of the stages as dictionary."""
+        with self.stats_lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import itertools
+import queue
+import time
+import threading
+import logging
+from GoogleScraper.scrape_jobs import job_priority, job_deadline
+from GoogleScraper.negative_cache import proxy_key
+
+logger = logging.getLogger(__name__)
+
+"""
+Distributes scrape jobs among the scrape workers.
+
+Each worker (a ScrapeWorkerFactory instance) can only process jobs
+for exactly one search engine in one scrape method. Instead of probing
+all workers for every job, the workers are indexed by
+(search_engine, scrape_method). Looking up the right group for a job
+thus takes constant time, regardless of the number of keywords,
+search engines and proxies.
+
+By default, the jobs of a group are not partitioned among its workers up
+front. Instead, all workers of a group pull their jobs from a shared
+JobQueue. Each worker prefetches a few jobs into a local buffer and idle
+workers steal the buffered jobs of slow workers (for example because
+their proxy got slow or blocked). Thus the scrape finishes when the last
+job is done, not when the slowest worker finished its fixed share.
+
+When the scrape jobs are streamed (for example from a huge keyword file),
+the JobQueue is bounded and filled while the workers are already running.
+
+The JobQueue serves the work units by descending priority and then by the
+earliest deadline. A work unit whose deadline passed before a worker takes
+it is dropped, or deferred until no other work unit is left.
+
+With a negative cache, a job is assigned to a worker whose proxy didn't
+fail on it recently, and skipped when the proxies of all workers did.
+"""
+
+
+class JobQueue(object):
+    """A queue of work units shared by the workers of one group.
+
+    A work unit is a (query, pages) tuple. Consecutive pages of the same
+    keyword are grouped to one unit, because a selenium worker obtains the
+    next SERP page by clicking the next page link of the previous one.
+
+    When the queue is bounded and full, put_job() blocks until a worker
+    takes a unit, which throttles the producer of the scrape jobs to the
+    pace of the workers.
+
+    Internally the units are kept as (-priority, deadline, sequence number, unit)
+    entries, such that the shared queue is ordered by priority and deadline
+    and units of the same rank are served first in, first out.
+    """
+
+    def __init__(self, maxsize=0, prefetch=1, expired_jobs='drop'):
+        """Create a new job queue.
+
+        Args:
+            maxsize: The maximum number of work units in the shared queue. 0 means unbounded.
+            prefetch: How many work units a worker takes from the shared queue at once.
+            expired_jobs: 'drop' to skip work units whose deadline passed,
+                'defer' to serve them when no other unit is left.
+        """
+        self.queue = queue.PriorityQueue(maxsize)
+        self.sequence = itertools.count()
+        self.prefetch = max(int(prefetch), 1)
+        self.expired_jobs = expired_jobs
+
+        # the work unit that is still being grouped
+        self.pending = None
+
+        # the number of work units that were put into the queue
+        self.num_units = 0
+
+        # whether close() was called
+        self.closed = False
+
+        # whether a worker took the end marker from the shared queue
+        self.exhausted = False
+
+        # consumer id => deque of prefetched work units
+        self.local = {}
+        self.next_consumer = 0
+
+        # the number of workers that still pull from this queue
+        self.num_consumers = 0
+        self.lock = threading.Lock()
+
+        # the number of work units that were taken from the buffer of another worker
+        self.num_stolen = 0
+
+        # the number of jobs that were dropped because no worker was left
+        self.num_dropped = 0
+
+        # work units whose deadline passed, served when no other unit is left
+        self.deferred = collections.deque()
+
+        # the number of jobs whose deadline passed before a worker took them
+        self.num_expired = 0
+
+    def register_consumer(self):
+        """Register a worker that pulls from this queue.
+
+        Returns:
+            The consumer id to pass to get().
+        """
+        with self.lock:
+            consumer = self.next_consumer
+            self.next_consumer += 1
+            self.local[consumer] = collections.deque()
+            self.num_consumers += 1
+            return consumer
+
+    def unregister_consumer(self, consumer):
+        """Unregister a worker that stopped pulling.
+
+        Work units left in its buffer remain stealable by the other workers.
+        """
+        with self.lock:
+            self.num_consumers -= 1
+            if not self.local.get(consumer, True):
+                del self.local[consumer]
+
+    def put_job(self, job):
+        """Add a scrape job to the queue."""
+        priority, deadline = job_priority(job), job_deadline(job)
+        if self.pending and self.pending[0] == job['query'] and self.pending[2:] == [priority, deadline]:
+            self.pending[1].append(job['page_number'])
+        else:
+            self._flush()
+            self.pending = [job['query'], [job['page_number']], priority, deadline]
+
+    def _put(self, item):
+        """Block until the item is in the queue or no worker is left to consume it."""
+        while True:
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except queue.Full:
+                if self.num_consumers <= 0:
+                    return False
+
+    def _flush(self):
+        if self.pending:
+            (query, pages, priority, deadline), self.pending = self.pending, None
+            entry = (-priority, deadline or float('inf'), next(self.sequence), (query, pages))
+            if self._put(entry):
+                self.num_units += 1
+            else:
+                self.num_dropped += len(pages)
+                logger.warning('No worker left to scrape keyword "{}".'.format(query))
+
+    def _end_marker(self):
+        return (float('inf'), float('inf'), next(self.sequence), None)
+
+    def _take(self, block):
+        """Take the next entry from the shared queue.
+
+        Returns:
+            An entry or None if the shared queue is empty or exhausted.
+        """
+        if self.exhausted:
+            return None
+
+        try:
+            entry = self.queue.get(timeout=0.1) if block else self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+        if entry[-1] is None:
+            self.exhausted = True
+            # let the other workers of the group know as well
+            self.queue.put(self._end_marker())
+            return None
+
+        return entry
+
+    def _steal(self, consumer):
+        """Take an entry from the end of the fullest buffer of another worker."""
+        with self.lock:
+            victim = max((c for c in self.local if c != consumer), key=lambda c: len(self.local[c]), default=None)
+            if victim is not None and self.local[victim]:
+                self.num_stolen += 1
+                return self.local[victim].pop()
+        return None
+
+    def _admit(self, entry):
+        """Returns the work unit of an entry or None if its deadline passed."""
+        deadline, unit = entry[1], entry[-1]
+        if deadline < time.time():
+            with self.lock:
+                self.num_expired += len(unit[1])
+                if self.expired_jobs == 'defer':
+                    self.deferred.append(unit)
+            logger.warning('Keyword "{}" missed its deadline and is {}.'.format(
+                unit[0], 'deferred' if self.expired_jobs == 'defer' else 'dropped'))
+            return None
+        return unit
+
+    def get(self, consumer):
+        """Get the next work unit for a worker.
+
+        First from the own buffer, then from the shared queue (prefetching
+        into the own buffer), then from the buffers of the other workers and
+        finally the deferred units whose deadline passed.
+
+        Args:
+            consumer: The consumer id as returned by register_consumer()
+
+        Returns:
+            A (query, pages) tuple or None when the queue was closed
+            and all work units are consumed.
+        """
+        local = self.local[consumer]
+
+        while True:
+            with self.lock:
+                entry = local.popleft() if local else None
+
+            if entry is None:
+                entry = self._take(block=False)
+                if entry:
+                    for i in range(self.prefetch - 1):
+                        extra = self._take(block=False)
+                        if not extra:
+                            break
+                        with self.lock:
+                            local.append(extra)
+
+            if entry is None:
+                entry = self._steal(consumer)
+
+            if entry is None:
+                with self.lock:
+                    if self.deferred:
+                        return self.deferred.popleft()
+
+                if self.exhausted:
+                    return None
+
+                # wait for the producer
+                entry = self._take(block=True)
+
+            if entry:
+                unit = self._admit(entry)
+                if unit:
+                    return unit
+
+    def close(self):
+        """Signal that no more jobs will be added."""
+        self._flush()
+        self.closed = True
+        self._put(self._end_marker())
+
+
+class ScrapeJobDispatcher(object):
+    """Assigns scrape jobs to suitable workers in constant time.
+
+    Either puts the jobs into the shared JobQueue of the group, or, when
+    shared queues are disabled, assigns them round robin to the workers of
+    the group. In the latter case all consecutive pages of a keyword are
+    assigned to the same worker.
+    """
+
+    def __init__(self, workers=None, shared_queues=False, job_queue_size=0, prefetch=1, expired_jobs='drop',
+                 negative_cache=None):
+        """Create a new dispatcher.
+
+        Args:
+            workers: An optional iterable of ScrapeWorkerFactory instances.
+            shared_queues: If True, jobs are put into a JobQueue per group from
+                which the workers pull, instead of being assigned to the workers
+                before they are started.
+            job_queue_size: The maximum number of work units in a JobQueue.
+            prefetch: How many work units a worker takes from its JobQueue at once.
+            expired_jobs: What a JobQueue does with work units whose deadline passed, 'drop' or 'defer'.
+            negative_cache: The NegativeCache with the requests that failed recently, optional.
+        """
+        self.shared_queues = shared_queues
+        self.job_queue_size = job_queue_size
+        self.prefetch = prefetch
+        self.expired_jobs = expired_jobs
+        self.negative_cache = negative_cache
+
+        # (search_engine, scrape_method) => JobQueue, only with shared queues
+        self.job_queues = {}
+
+        # (search_engine, scrape_method) => list of workers
+        self.groups = {}
+
+        # (search_engine, scrape_method) => index of the next worker in the group
+        self.positions = {}
+
+        # (search_engine, scrape_method) => (query, worker) of the last assignment
+        self.last_assignment = {}
+
+        self.num_dispatched = 0
+        self.num_undispatched = 0
+        # jobs that failed recently with the proxies of all suitable workers
+        self.num_failed_recently = 0
+
+        for worker in workers or []:
+            self.add_worker(worker)
+
+    def add_worker(self, worker):
+        """Register a worker in the index."""
+        key = (worker.search_engine, worker.mode)
+        self.groups.setdefault(key, []).append(worker)
+        self.positions.setdefault(key, 0)
+
+        if self.shared_queues:
+            if key not in self.job_queues:
+                self.job_queues[key] = JobQueue(self.job_queue_size, prefetch=self.prefetch,
+                                                expired_jobs=self.expired_jobs)
+            worker.job_queue = self.job_queues[key]
+
+    def workers(self):
+        """Yields all registered workers.
+
+        When the JobQueue of a group was closed before the workers are
+        started, all its jobs are known and no more workers than work units
+        are yielded for the group.
+        """
+        for key, group in self.groups.items():
+            job_queue = self.job_queues.get(key)
+            if job_queue is not None and job_queue.closed:
+                yield from group[:job_queue.num_units]
+            else:
+                yield from group
+
+    def dispatch(self, job):
+        """Assign a single job to a suitable worker.
+
+        Args:
+            job: A scrape job as yielded by default_scrape_jobs_for_keywords()
+
+        Returns:
+            The worker (or the JobQueue with shared queues) the job was assigned
+            to or None if no registered worker can process the job.
+        """
+        key = (job['search_engine'], job['scrape_method'])
+        group = self.groups.get(key)
+
+        if not group:
+            self.num_undispatched += 1
+            logger.warning('No worker for search engine "{}" in mode "{}". Skipping keyword "{}".'.format(
+                job['search_engine'], job['scrape_method'], job['query']))
+            return None
+
+        failed = self.negative_cache.failed_proxies(job) if self.negative_cache is not None else {}
+        if failed and all(proxy_key(worker.proxy) in failed for worker in group):
+            self.num_failed_recently += 1
+            self.negative_cache.avoided()
+            logger.info('Skipping keyword "{}" page {}, it failed recently with all proxies: {}'.format(
+                job['query'], job['page_number'], ', '.join(sorted(set(failed.values())))))
+            return None
+
+        self.num_dispatched += 1
+
+        if self.shared_queues:
+            self.job_queues[key].put_job(job)
+            return self.job_queues[key]
+
+        last = self.last_assignment.get(key)
+        if last and last[0] == job['query']:
+            worker = last[1]
+        else:
+            position = self.positions[key]
+            # the next worker in turn whose proxy didn't fail on the job
+            for offset in range(len(group)):
+                worker = group[(position + offset) % len(group)]
+                if not failed or proxy_key(worker.proxy) not in failed:
+                    break
+            self.positions[key] = position + 1
+            self.last_assignment[key] = (job['query'], worker)
+
+        worker.add_job(job)
+
+        return worker
+
+    def dispatch_all(self, jobs):
+        """Assign all jobs to suitable workers.
+
+        Returns:
+            The number of jobs that could be assigned.
+        """
+        for job in jobs:
+            self.dispatch(job)
+
+        return self.num_dispatched
+
+    def close(self):
+        """Signal the workers that all jobs are dispatched. Only needed with shared queues."""
+        for job_queue in self.job_queues.values():
+            job_queue.close()
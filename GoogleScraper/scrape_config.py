@@ -67,6 +67,54 @@ keywords = []
 # the ones from the file will be taken. Each keyword must be on a separate line.
 keyword_file = ''
 
+# Stream the keyword file instead of loading it into memory at once.
+# The keywords are read in chunks of keyword_chunk_size lines and duplicates are
+# removed with a set on disk. The scrape jobs are fed to the workers while they
+# are consumed, so huge keyword files don't need to fit in memory.
+# Has no effect for keyword files that are python modules.
+stream_keyword_file = False
+
+# How many lines of the keyword file are read at once when streaming.
+keyword_chunk_size = 10000
+
+# Where to store the keywords seen so far when streaming. If empty,
+# a temporary file is used.
+keyword_dedup_file = ''
+
+# How many keywords may wait in the job queue of each search engine when streaming.
+job_queue_size = 1000
+
+# Let the workers of a search engine pull their keywords from a shared queue
+# instead of splitting the keywords evenly among them before the scrape starts.
+# Idle workers steal keywords from slow ones, so a worker with a slow or blocked
+# proxy doesn't delay the end of the scrape. Always enabled when streaming.
+work_stealing = True
+
+# How many keywords a worker takes from the shared queue at once. The keywords
+# a worker took but didn't start yet can be stolen by idle workers.
+job_prefetch = 5
+
+# Scrape jobs from a python keyword file may have a 'priority' (higher is scraped
+# first) and a 'deadline' (a datetime or unix timestamp). What to do with jobs
+# that are still waiting when their deadline passed:
+# 'drop' skips them, 'defer' scrapes them after all jobs that are in time.
+expired_jobs = 'drop'
+
+# Whether the workers only fetch the pages and hand them to background threads
+# that parse and store them. Otherwise each worker parses and stores the page
+# before its next request.
+pipelined_storage = True
+
+# How many fetched pages may wait for the parse stage and how many parsed pages
+# for the store stage. When a queue is full, the stage before it waits.
+pipeline_queue_size = 100
+
+# The number of threads that parse the fetched pages.
+num_parse_workers = 1
+
+# How many parsed pages the store stage commits to the database at once at most.
+store_batch_size = 50
+
 # How many results per SERP page
 num_results_per_page = 10
 
@@ -76,6 +124,34 @@ num_pages_for_keyword = 1
 # This arguments sets the number of browser instances for selenium mode or the number of worker threads in http mode.
 num_workers = 1
 
+# Shard the keywords across this many processes. Each process scrapes its shard with
+# the configured scrape method and num_workers workers, its own cache handle and its
+# own temporary database. The results are merged into the main database.
+# Because of the GIL, parsing and storing the results in a single process uses about one
+# cpu core at most. The proxies are distributed among the processes.
+# The scrape logs its throughput in jobs per second, but not the speedup over a single
+# process. Compare the throughput of runs with different num_processes for that.
+# Has no effect when the keyword file is streamed.
+num_processes = 1
+
+# Run one scrape on several machines. Leave empty for a normal scrape.
+# 'coordinator': Create the scrape jobs from the keywords as usual, but instead of scraping
+#   them, hand them out to the workers that connect to coordinator_address. The SERPs of the
+#   workers are stored in the database and output file of the coordinator.
+# 'worker': Scrape the jobs of the coordinator at coordinator_address with the proxies,
+#   scrape settings and cache of this machine. No keywords needed.
+distributed_role = ''
+
+# The host:port the coordinator listens on and the workers connect to.
+coordinator_address = 'localhost:7000'
+
+# How many jobs a worker leases from the coordinator at once.
+lease_size = 10
+
+# After how many seconds without renewal the jobs of a lease are handed out again.
+# Workers renew their leases while they are alive.
+lease_timeout = 300
+
 # Maximum of workers
 # When scraping with multiple search engines and more than one worker, the number of total workers
 # becomes quite high very fast, so we set a upper limit here. Leaving this out, is quite dangerous in selenium mode.
@@ -156,6 +232,17 @@ ask_search_url = 'http://de.ask.com/web?'
 # "normal" search type is supported in all search engines.
 search_type = 'normal'
 
+# Only parse these result types of a SERP: 'results', 'ads_main', 'ads_aside' or 'maps_local'.
+# The selectors of the other result types are not evaluated at all.
+# Either a list or a comma separated string. Empty parses all result types.
+parse_result_types = []
+
+# Only parse these fields of the results, like 'link', 'title', 'snippet' or 'visible_link'.
+# The rank and the link are always parsed. Rank tracking that only needs the link
+# and rank of the organic results sets parse_result_types = 'results' and
+# parse_result_fields = 'link'. Empty parses all fields.
+parse_result_fields = []
+
 # The scrape method. Can be 'http' or 'selenium' or 'http-async'
 # http mode uses http packets directly, whereas selenium mode uses a real browser.
 # http_async uses asyncio.
@@ -195,6 +282,14 @@ proxy_file = ''
 # Whether to continue the last scrape when ended early.
 continue_last_scrape = True
 
+# Whether to journal the completed jobs of a scrape. When the last scrape is
+# continued, the jobs in its journal are skipped without touching the cache.
+journal_completed_jobs = True
+
+# The directory of the journals, one file per scrape. Empty keeps them in
+# the journal/ subdirectory of the cachedir.
+journal_dir = ''
+
 # Proxies stored in a MySQL database. If you set a parameter here, GoogleScraper will look for proxies
 # in a table named 'proxies' for proxies with the following format=
 # CREATE TABLE proxies (
@@ -233,22 +328,152 @@ minimize_caching_files = True
 # If set, then compress/decompress cached files
 compress_cached_files = True
 
-# Use either bz2 or gz to compress cached files
+# The algorithm to compress cached files with:
+# 'gz': the default.
+# 'bz2': a better ratio than gz, but very slow to write.
+# 'zst': zstandard, needs the zstandard package. Faster and smaller than gz,
+#        especially with the trained dictionaries (see zstd_dictionary_samples).
+# 'lz4': needs the lz4 package. The fastest, at about the ratio of gz.
+# Run python Tests/benchmarks.py compression to compare them on your machine.
 compressing_algorithm = 'gz'
 
+# The compression level of zst, from 1 (fastest) to 22 (smallest).
+zstd_level = 3
+
+# With zst, a compression dictionary is trained for every search engine on its first
+# zstd_dictionary_samples cached pages, which raises the ratio of the following pages.
+# The dictionaries are stored in the dictionaries/ subdirectory of the cache directory
+# and are needed to read the pages. 0 disables the dictionaries.
+zstd_dictionary_samples = 100
+
+# The maximal size of a zstd dictionary in bytes.
+zstd_dictionary_size = 112640
+
 # The relative path to the cache directory
 cachedir = '.scrapecache/'
 
+# How the cache files are laid out in the cache directory.
+# 'sharded': in two levels of subdirectories named by the first characters of the
+#            hash of the file name, like ab/cd/abcd[...].cache.gz. Keeps the directories
+#            small with millions of cache files.
+# 'flat': all cache files directly in the cache directory.
+# Files of both layouts are found when reading the cache.
+cache_layout = 'sharded'
+
+# Move the files of the cache directory to the configured cache_layout and exit.
+# Safe to run while other scrapes use the cache. With the pack, kv or dedup cache_backend,
+# the files are moved into the backend.
+migrate_cache_layout = False
+
+# Where the cached pages are stored.
+# 'files': one file per page, laid out as configured by cache_layout.
+# 'pack': appended to a few large pack files in the packs/ subdirectory of the
+#         cache directory, with an sqlite index of the pages. Saves an inode and
+#         a partly used disk block per page. Cache files are still read.
+# 'kv': on the key-value server at cache_server_address, shared by all hosts that
+#       scrape with it, so a keyword that one host scraped is not fetched again by
+#       another. The server speaks the redis protocol: a redis server or the stand-in
+#       `python -m GoogleScraper.cache_server host:port`. Pages expire on the server
+#       after clean_cache_after hours. Local cache files are still read. zstd dictionaries
+#       are not used, since the other hosts would lack them.
+# 'dedup': content addressed in the blobs/ subdirectory of the cache directory: pages
+#          with the same html, like pages without results, captcha pages or a SERP
+#          scraped with several scrape methods, are stored once. Cache files are still
+#          read. --cache-report shows how many bytes are saved.
+cache_backend = 'files'
+
+# The host:port of the key-value server of the kv cache_backend.
+cache_server_address = 'localhost:6379'
+
+# Prepended to the names of the cached pages on the key-value server, such that
+# several caches can share one server.
+cache_key_prefix = 'googlescraper:'
+
+# The maximal size of a pack file in bytes.
+max_pack_size = 1024 * 1024 * 1024
+
+# Rewrite the cache packs without the pages that were cached again or expired and exit.
+# Writers wait while the packs are compacted.
+compact_cache = False
+
+# Print the number and size of the cached pages and exit. With the dedup cache_backend,
+# also the number of distinct pages and the bytes that the deduplication saves.
+cache_report = False
+
+# Write the cached pages to an archive and exit, for example to warm up the cache of a new
+# host. The suffix of the path selects the compression: .tar.gz, .tgz, .tar.bz2, .tar.xz
+# or .tar, '-' writes to stdout. With keywords, only the pages of the keywords in the
+# search_engines are exported. Otherwise the pages of the keywords in the results database
+# that were scraped with the search_engines, or all pages with search_engines = '*'.
+cache_export = ''
+
+# Load the cached pages of an archive written by cache_export into the cache and exit.
+# The hash of every page is verified. Cached pages that are newer are kept.
+cache_import = ''
+
+# Only export or import cached pages younger than this many hours. 0 means clean_cache_after.
+cache_max_age = 0
+
+# Whether to store the parsed results of the cached pages in the parsed/ subdirectory
+# of the cache directory. Pages that are read from the cache are then not parsed again,
+# unless the parser of their search engine changed since.
+cache_parsed_results = True
+
+# The cached scrape jobs are replayed in batches of this many jobs: their SERPs are looked
+# up in the database with a few queries and the missing ones are parsed.
+cache_replay_batch_size = 1000
+
+# In how many processes to parse the cached pages when replaying the cache. 0 means one
+# process per cpu core. Only used when there are more cached jobs than one batch.
+cache_replay_processes = 0
+
 # After how many hours should the cache be cleaned
 clean_cache_after = 48
 
+# A quota for the cache. While scraping, a background thread evicts cached pages
+# when the cache holds more than cache_max_bytes bytes or cache_max_entries pages,
+# until it is 10% below the quota. It also removes pages older than clean_cache_after.
+# 0 means no limit.
+cache_max_bytes = 0
+cache_max_entries = 0
+
+# Which cached pages to evict first: 'lru' evicts the least recently read pages,
+# 'lfu' the least often read ones.
+cache_eviction_policy = 'lru'
+
+# How many seconds the cache compactor waits between two checks of the quota.
+cache_compaction_interval = 60
+
+# Whether to remember the requests that failed, per keyword, page and proxy, in the
+# negative/ subdirectory of the cache directory. Blocked pages (like captchas), timeouts
+# and pages without results are not cached then, and the same request with the same
+# proxy is not repeated until its record expires: jobs are assigned to workers with
+# other proxies or skipped when they failed with all proxies.
+negative_caching = True
+
+# How many seconds the failed requests are remembered, per reason. 0 disables a reason.
+negative_cache_ttls = {
+    'blocked': 30 * 60,
+    'timeout': 5 * 60,
+    'no_results': 60 * 60,
+}
+
+# Whether to keep an index of the cache files in the cache directory, such that
+# looking up a cached page doesn't need to list the cache directory.
+cache_index = True
+
+# Rebuild the cache index by scanning the cache directory. Needed after adding
+# cache files to subdirectories of the cache directory with other programs.
+rebuild_cache_index = False
+
 # turn off sleeping pauses alltogether.
 # Dont set this to False if you don't know what you are doing.
 do_sleep = True
 
 # Sleeping distribution.
 # Sleep a given amount of time as a function of the number of searches done.
-# The scraper in selenium mode makes random pauses at certain times.
+# Two consecutive requests with the same proxy to the same search engine are spaced by
+# a random delay from these ranges. Workers that share a proxy also share its pace.
 # Please add integer keys to sleeping_ranges such that the sum of
 # the keys amounts to 100. Then the key defines the probability of how many times
 # this sleeping range occurs in a total of 100 searches.
@@ -294,6 +519,18 @@ fixed_sleeping_ranges = {
     10000:  (180, 420),
 }
 
+# Adapt the number of concurrent requests and the sleeping delays per search engine and proxy
+# to the responses (AIMD, like TCP congestion control). While the responses are clean and
+# fast, up to num_workers workers per proxy request concurrently and the delays of the
+# sleeping ranges shrink down to throttle_min_delay_factor times. On captcha pages, http
+# status 429 or 503 the concurrency is halved and the delays are doubled, up to
+# throttle_max_delay_factor times. When the response time rises above
+# throttle_latency_tolerance times the fastest response time, the proxy backs off as well.
+adaptive_throttling = False
+throttle_min_delay_factor = 0.25
+throttle_max_delay_factor = 16
+throttle_latency_tolerance = 2.0
+
 # If the search should be simulated instead of being done.
 # Useful to learn about the quantity of keywords to scrape and such.
 # Won't fire any requests.
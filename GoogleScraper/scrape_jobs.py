@@ -1,5 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import os
+import time
+import datetime
+import itertools
+import sqlite3
+import tempfile
 import logging
 
 logger = logging.getLogger(__name__)
@@ -50,6 +56,11 @@ The best format for such a keyword file is just a python module with a dictionar
 mandatory key: The 'query'. The dictionary must be called 'scrape_jobs'.
 
 You can see such a example file in the examples/ directory.
+
+A scrape job may carry a 'priority' (an integer, higher is scraped first,
+0 by default) and a 'deadline' (a datetime or unix timestamp). Jobs that
+are still waiting when their deadline has passed are dropped, or with
+expired_jobs = 'defer' scraped after all jobs that are in time.
 """
 
 
@@ -76,4 +87,153 @@ def default_scrape_jobs_for_keywords(keywords, search_engines, scrape_method, nu
                     'search_engine': search_engine,
                     'scrape_method': scrape_method,
                     'page_number': page
-                }
\ No newline at end of file
+                }
+
+
+def job_priority(job):
+    """Returns the priority of a scrape job. Higher is scraped first."""
+    return int(job.get('priority', 0) or 0)
+
+
+def job_deadline(job):
+    """Returns the deadline of a scrape job as unix timestamp or None.
+
+    Naive datetimes are in local time.
+    """
+    deadline = job.get('deadline')
+    if isinstance(deadline, datetime.datetime):
+        return deadline.timestamp()
+    return float(deadline) if deadline else None
+
+
+def prioritize_scrape_jobs(scrape_jobs):
+    """Order scrape jobs by descending priority and then by the earliest deadline.
+
+    The order of jobs with the same priority and deadline is kept, so the
+    pages of a keyword stay together.
+
+    Args:
+        scrape_jobs: A list of scrape jobs.
+
+    Returns:
+        The ordered list.
+    """
+    if not any('priority' in job or 'deadline' in job for job in scrape_jobs):
+        return scrape_jobs
+
+    return sorted(scrape_jobs, key=lambda job: (-job_priority(job), job_deadline(job) or float('inf')))
+
+
+def enforce_deadlines(scrape_jobs, expired_jobs='drop'):
+    """Yields the scrape jobs whose deadline has not passed when they are requested.
+
+    Args:
+        scrape_jobs: An iterable of scrape jobs.
+        expired_jobs: 'drop' to skip expired jobs, 'defer' to yield them
+            after all the other jobs.
+    """
+    deferred = []
+    num_expired = 0
+
+    for job in scrape_jobs:
+        deadline = job_deadline(job)
+        if deadline is not None and deadline < time.time():
+            num_expired += 1
+            if expired_jobs == 'defer':
+                deferred.append(job)
+            continue
+        yield job
+
+    if num_expired:
+        logger.warning('{} scrape jobs missed their deadline and were {}.'.format(
+            num_expired, 'deferred' if expired_jobs == 'defer' else 'dropped'))
+
+    yield from deferred
+
+
+class OnDiskKeywordSet(object):
+    """A set of keywords that is stored in a sqlite database on disk.
+
+    The memory usage is bounded by the page cache of sqlite, regardless
+    of how many keywords are added. Used to remove duplicates from huge
+    keyword files.
+    """
+
+    def __init__(self, path=''):
+        """Create a new keyword set.
+
+        Args:
+            path: Where to store the set. When empty, a temporary file
+                is used and removed on close(). A set that is stored at
+                path already is emptied, every set starts empty.
+        """
+        self.is_temporary = not path
+
+        if self.is_temporary:
+            fd, path = tempfile.mkstemp(suffix='.keywords.db')
+            os.close(fd)
+
+        self.path = path
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode = OFF')
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS keywords (keyword TEXT PRIMARY KEY) WITHOUT ROWID')
+        self.conn.execute('DELETE FROM keywords')
+        self.conn.commit()
+
+    def add_many(self, keywords):
+        """Add keywords to the set.
+
+        Args:
+            keywords: The keywords to add.
+
+        Returns:
+            The keywords that were not yet in the set, in the order given.
+        """
+        new = []
+        cursor = self.conn.cursor()
+        for keyword in keywords:
+            cursor.execute('INSERT OR IGNORE INTO keywords VALUES (?)', (keyword,))
+            if cursor.rowcount == 1:
+                new.append(keyword)
+        self.conn.commit()
+        return new
+
+    def close(self):
+        self.conn.close()
+        if self.is_temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class KeywordFileReader(object):
+    """Streams the unique keywords of a keyword file.
+
+    The file is read in chunks of chunk_size lines and duplicates are
+    removed with an OnDiskKeywordSet, so neither the file nor the set of
+    keywords needs to fit in memory. The order of the keywords is kept.
+    """
+
+    def __init__(self, path, chunk_size=10000, dedup_file=''):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.dedup_file = dedup_file
+
+        # the number of unique keywords yielded so far
+        self.num_keywords = 0
+
+    def __iter__(self):
+        self.num_keywords = 0
+        seen = OnDiskKeywordSet(self.dedup_file)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as fd:
+                while True:
+                    lines = list(itertools.islice(fd, self.chunk_size))
+                    if not lines:
+                        break
+
+                    chunk = dict.fromkeys(line.strip() for line in lines if line.strip())
+                    for keyword in seen.add_many(chunk):
+                        self.num_keywords += 1
+                        yield keyword
+        finally:
+            seen.close()
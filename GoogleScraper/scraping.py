@@ -2,15 +2,17 @@
 
 import datetime
 import random
-import time
 import os
 import abc
-import math
+import time
 
 from GoogleScraper.proxies import Proxy
 from GoogleScraper.database import db_Proxy
 from GoogleScraper.output_converter import store_serp_result
 from GoogleScraper.parsing import get_parser_by_search_engine, parse_serp
+from GoogleScraper.pacing import PacingScheduler
+from GoogleScraper.pipeline import FetchedPage
+from GoogleScraper.negative_cache import proxy_key, job_of
 import logging
 
 logger = logging.getLogger(__name__)
@@ -143,7 +145,8 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
     }
 
     def __init__(self, config, cache_manager=None, jobs=None, scraper_search=None, session=None, db_lock=None, cache_lock=None,
-                 start_page_pos=1, search_engine=None, search_type=None, proxy=None, progress_queue=None):
+                 start_page_pos=1, search_engine=None, search_type=None, proxy=None, progress_queue=None, job_queue=None,
+                 pacing=None, throttle=None, pipeline=None):
         """Instantiate an SearchEngineScrape object.
 
         Args:
@@ -168,6 +171,11 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
 
         self.jobs = jobs
 
+        # the JobQueue of the worker group to pull the jobs from instead of self.jobs
+        self.job_queue = job_queue
+        if self.job_queue is not None:
+            self.job_queue_consumer = self.job_queue.register_consumer()
+
         # the keywords that couldn't be scraped by this worker
         self.missed_keywords = set()
 
@@ -235,17 +243,21 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
         # The name of the scraper
         self.scraper_name = '{}-{}'.format(self.__class__.__name__, self.search_engine_name)
 
-        # How long to sleep (in seconds) after every n-th request
-        self.sleeping_ranges = dict()
-        self.sleeping_ranges = self.config.get(
-            '{search_engine}_sleeping_ranges'.format(search_engine=self.search_engine_name),
-            self.config.get('sleeping_ranges'))
+        # Spaces the requests of all workers with the same proxy and search engine
+        self.pacing = pacing or PacingScheduler(self.config, throttle=throttle)
+
+        # How long the worker waited before the current request
+        self.current_delay = 0
 
-        assert sum(self.sleeping_ranges.keys()) == 100, 'The sum of the keys of sleeping_ranges must be 100!'
+        # Adapts the concurrency and the delays to the responses of the search engine, optional
+        self.throttle = throttle
 
-        # compute sleeping ranges
-        self.sleeping_times = self._create_random_sleeping_intervals(self.num_keywords)
-        logger.debug('Sleeping ranges: {}'.format(self.sleeping_times))
+        # Whether this worker holds a request slot of the throttle and since when
+        self.throttle_slot = False
+        self.request_started = None
+
+        # Parses and stores the fetched pages in the background, optional
+        self.pipeline = pipeline
 
         # the default timeout
         self.timeout = 5
@@ -253,6 +265,9 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
         # the status of the thread after finishing or failing
         self.status = 'successful'
 
+        # why the current request failed, one of negative_cache.REASONS, or None
+        self.outcome = None
+
         self.html = ''
 
     @abc.abstractmethod
@@ -281,7 +296,11 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
         self.status = 'Malicious request detected: {}'.format(status_code)
 
     def store(self):
-        """Store the parsed data in the sqlalchemy scoped session."""
+        """Store the parsed data in the sqlalchemy scoped session.
+
+        A page without results is a failed request, its outcome is decided before the
+        SERP is written to the output, so that the job is not journaled as completed.
+        """
         assert self.session, 'No database session.'
 
         if self.html:
@@ -297,13 +316,32 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
             self.session.add(serp)
             self.session.commit()
 
-            store_serp_result(serp, self.config)
+            if not serp.num_results:
+                self.outcome = self.outcome or 'no_results'
+
+            store_serp_result(serp, self.config, outcome=self.outcome)
 
             if serp.num_results:
                 return True
             else:
                 return False
 
+    def iter_jobs(self):
+        """Yields the (query, pages) work units of this worker.
+
+        Either from the jobs that were assigned before the worker was started or
+        from the JobQueue that is shared by the workers of the group.
+        """
+        if self.job_queue is None:
+            yield from self.jobs.items()
+        else:
+            while True:
+                unit = self.job_queue.get(self.job_queue_consumer)
+                if unit is None:
+                    break
+                self.num_keywords += 1
+                yield unit
+
     def next_page(self):
         """Increment the page. The next search request will request the next page."""
         self.start_page_pos += 1
@@ -331,69 +369,85 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
 
     def cache_results(self):
         """Caches the html for the current request."""
-        self.cache_manager.cache_results(self.parser, self.query, self.search_engine_name, self.scrape_method, self.page_number,
-                      db_lock=self.db_lock)
-
-    def _create_random_sleeping_intervals(self, number_of_searches):
-        """Sleep a given amount of time as a function of the number of searches done.
+        self.cache_manager.cache_results(self.parser, self.query, self.search_engine_name, self.scrape_method,
+                                         self.page_number)
 
-        Args:
-            number_of_searches: How many searches the worker has to process.
+    def detection_prevention_sleep(self):
+        """Wait until the next request of this proxy to the search engine is eligible.
 
-        Returns:
-            A list of tuples (intervals) of sleep ranges for everey search number.
+        See pacing.PacingScheduler for how the delays are determined.
         """
-        n = sum(self.sleeping_ranges.keys())
-        assert n == 100
-        assert number_of_searches >= 0
-
-        # if there are more searches than 100, multiply with the factor
-        x = math.ceil(number_of_searches/n)
-
-        sleeping_times = []
+        self.current_delay = 0
 
-        for key, value in self.sleeping_ranges.items():
-            for i in range(key):
-                sleeping_times.append(random.randrange(*value))
+        if self.throttle is not None and not self.throttle_slot:
+            self.throttle.acquire(self.search_engine_name, self.proxy)
+            self.throttle_slot = True
 
-        sleeping_times = sleeping_times*x
+        if self.config.get('do_sleep', True):
+            self.current_delay = self.pacing.wait(self.search_engine_name, self.proxy)
 
-        # randomly shuffle the whole thing
-        random.shuffle(sleeping_times)
+        self.request_started = time.monotonic()
 
-        return sleeping_times
+    def is_block_page(self, html, url=''):
+        """Whether the html (or the url) is the page that the search engine shows when it detected the scraping."""
+        needles = self.malicious_request_needles.get(self.search_engine_name)
+        return bool(needles) and (needles['inhtml'] in html or needles['inurl'] in url)
 
+    def recently_failed(self):
+        """Whether the request of the current page failed recently with the proxy of this worker.
 
-    def detection_prevention_sleep(self):
-        self.current_delay = 0
-        if self.config.get('do_sleep', True):
-            self.current_delay = self.sleeping_times[self.search_number]
-            time.sleep(self.current_delay)
-
-        if self.config.get('do_sleep', True):
-            try:
-                sleep_range = self.config.get('fixed_sleeping_ranges', {})[self.search_number]
-                self.current_delay = random.randrange(*sleep_range)
-                time.sleep(self.current_delay)
-            except KeyError as ke:
-                # normal case
-                pass
+        Then it is not made again before its record in the negative cache expires.
+        """
+        negative = getattr(self.cache_manager, 'negative', None)
+        if negative is None:
+            return False
+        reason = negative.get(job_of(self), proxy_key(self.proxy))
+        if reason:
+            negative.avoided()
+            logger.info('[{}] Skipping keyword "{}" page {}, it failed recently with this proxy: {}'.format(
+                self.requested_by, self.query, self.page_number, reason))
+        return bool(reason)
+
+    def report_response(self, blocked=False, failed=False):
+        """Let the throttle adapt to the outcome of the request since detection_prevention_sleep().
 
+        Args:
+            blocked: Whether the search engine blocked the request.
+            failed: Whether the request failed for another reason.
+        """
+        if self.throttle is not None and self.throttle_slot:
+            self.throttle_slot = False
+            self.throttle.release(self.search_engine_name, self.proxy, latency=time.monotonic() - self.request_started,
+                                  blocked=blocked, failed=failed)
 
     def after_search(self):
         """Store the results and parse em.
 
+        With a pipeline, the page is only handed over to it and parsed and stored in the background.
         Notify the progress queue if necessary.
         """
         self.search_number += 1
 
+        if self.pipeline is not None:
+            self.pipeline.submit(FetchedPage.from_scraper(self))
+            self.outcome = None
+            if self.progress_queue:
+                self.progress_queue.put(1)
+            return
+
         if not self.store():
             logger.debug('No results to store for keyword: "{}" in search engine: {}'.format(self.query,
                                                                                     self.search_engine_name))
 
         if self.progress_queue:
             self.progress_queue.put(1)
-        self.cache_results()
+
+        # blocked and empty pages would poison the cache, they are remembered in the negative cache instead
+        if self.outcome is None:
+            self.cache_results()
+        elif getattr(self.cache_manager, 'negative', None) is not None:
+            self.cache_manager.negative.record(job_of(self), proxy_key(self.proxy), self.outcome)
+        self.outcome = None
 
     def before_search(self):
         """Things that need to happen before entering the search loop."""
@@ -402,6 +456,14 @@ class SearchEngineScrape(metaclass=abc.ABCMeta):
             if not self.proxy_check():
                 self.startable = False
 
+    def after_scraping(self):
+        """Things that need to happen after the worker left the search loop."""
+        # the search loop was left in the middle of a request
+        self.report_response(failed=True)
+
+        if self.job_queue is not None:
+            self.job_queue.unregister_consumer(self.job_queue_consumer)
+
     def update_proxy_status(self, status, ipinfo=None, online=True):
         """Sets the proxy status with the results of ipinfo.io
 
@@ -433,7 +495,8 @@ from GoogleScraper.selenium_mode import get_selenium_scraper_by_search_engine_na
 
 class ScrapeWorkerFactory():
     def __init__(self, config, cache_manager=None, mode=None, proxy=None, search_engine=None, session=None, db_lock=None,
-                 cache_lock=None, scraper_search=None, captcha_lock=None, progress_queue=None, browser_num=1):
+                 cache_lock=None, scraper_search=None, captcha_lock=None, progress_queue=None, browser_num=1, pacing=None,
+                 throttle=None, pipeline=None):
 
         self.config = config
         self.cache_manager = cache_manager
@@ -447,9 +510,15 @@ class ScrapeWorkerFactory():
         self.captcha_lock = captcha_lock
         self.progress_queue = progress_queue
         self.browser_num = browser_num
+        self.pacing = pacing
+        self.throttle = throttle
+        self.pipeline = pipeline
 
         self.jobs = dict()
 
+        # set by the ScrapeJobDispatcher when the jobs are streamed
+        self.job_queue = None
+
     def is_suitabe(self, job):
 
         return job['scrape_method'] == self.mode and job['search_engine'] == self.search_engine
@@ -466,7 +535,7 @@ class ScrapeWorkerFactory():
 
     def get_worker(self):
 
-        if self.jobs:
+        if self.jobs or self.job_queue is not None:
 
             if self.mode == 'selenium':
 
@@ -482,6 +551,10 @@ class ScrapeWorkerFactory():
                     db_lock=self.db_lock,
                     proxy=self.proxy,
                     progress_queue=self.progress_queue,
+                    job_queue=self.job_queue,
+                    pacing=self.pacing,
+                    throttle=self.throttle,
+                    pipeline=self.pipeline,
                     captcha_lock=self.captcha_lock,
                     browser_num=self.browser_num,
                 )
@@ -499,6 +572,10 @@ class ScrapeWorkerFactory():
                     db_lock=self.db_lock,
                     proxy=self.proxy,
                     progress_queue=self.progress_queue,
+                    job_queue=self.job_queue,
+                    pacing=self.pacing,
+                    throttle=self.throttle,
+                    pipeline=self.pipeline,
                 )
 
         return None
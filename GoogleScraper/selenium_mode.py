@@ -668,7 +668,12 @@ class SelScrape(SearchEngineScrape, threading.Thread):
         Fills out the search form of the search engine for each keyword.
         Clicks the next link while pages_per_keyword is not reached.
         """
-        for self.query, self.pages_per_keyword in self.jobs.items():
+        for self.query, self.pages_per_keyword in self.iter_jobs():
+
+            # the later pages are reached through the first one
+            self.page_number = self.pages_per_keyword[0]
+            if super().recently_failed():
+                continue
 
             self.search_input = self._wait_until_search_input_field_appears()
 
@@ -728,6 +733,10 @@ class SelScrape(SearchEngineScrape, threading.Thread):
                 except WebDriverException as e:
                     self.html = self.webdriver.page_source
 
+                blocked = super().is_block_page(self.html, self.webdriver.current_url)
+                if blocked:
+                    self.outcome = 'blocked'
+                super().report_response(blocked=blocked)
                 super().after_search()
 
                 # Click the next page link not when leaving the loop
@@ -761,25 +770,28 @@ class SelScrape(SearchEngineScrape, threading.Thread):
     def run(self):
         """Run the SelScraper."""
 
-        self._set_xvfb_display()
+        try:
+            self._set_xvfb_display()
 
-        if not self._get_webdriver():
-            raise Exception('{}: Aborting: No available selenium webdriver.'.format(self.name))
+            if not self._get_webdriver():
+                raise Exception('{}: Aborting: No available selenium webdriver.'.format(self.name))
 
-        try:
-            self.webdriver.set_window_size(400, 400)
-            self.webdriver.set_window_position(400 * (self.browser_num % 4), 400 * (math.floor(self.browser_num // 4)))
-        except WebDriverException as e:
-            logger.debug('Cannot set window size: {}'.format(e))
+            try:
+                self.webdriver.set_window_size(400, 400)
+                self.webdriver.set_window_position(400 * (self.browser_num % 4), 400 * (math.floor(self.browser_num // 4)))
+            except WebDriverException as e:
+                logger.debug('Cannot set window size: {}'.format(e))
 
-        super().before_search()
+            super().before_search()
 
-        if self.startable:
-            self.build_search()
-            self.search()
+            if self.startable:
+                self.build_search()
+                self.search()
 
-        if self.webdriver:
-            self.webdriver.quit()
+            if self.webdriver:
+                self.webdriver.quit()
+        finally:
+            super().after_scraping()
 
 
 """
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+Adapts how hard we push a search engine with a proxy to its responses.
+
+For every (search engine, proxy) the AdaptiveThrottle keeps a concurrency
+limit (how many workers may request at the same time) and a delay factor
+(that scales the delays of the PacingScheduler). Both follow the AIMD
+scheme known from TCP congestion control:
+
+- While the responses are clean and fast, the limit grows additively by
+  about one worker per round of requests and the delay factor shrinks
+  additively.
+- When the search engine blocks (captcha page, http status 429 or 503),
+  the limit is halved and the delay factor doubled.
+- When the latency rises above latency_tolerance times the fastest
+  latency seen so far, or a request fails, the limit is halved and the
+  delay factor is raised by half.
+
+This way a proxy is used with the highest rate that it can sustain
+without hand-tuning num_workers and the sleeping ranges.
+"""
+
+
+class ThrottleState(object):
+    """The adaptive limits of one (search engine, proxy)."""
+
+    __slots__ = ('limit', 'in_flight', 'delay_factor', 'latency', 'min_latency', 'num_blocks')
+
+    def __init__(self):
+        self.limit = 1.0
+        self.in_flight = 0
+        self.delay_factor = 1.0
+
+        # moving average and minimum of the response times
+        self.latency = None
+        self.min_latency = None
+
+        self.num_blocks = 0
+
+
+class AdaptiveThrottle(object):
+    """AIMD controller of the concurrency and the delays per (search engine, proxy)."""
+
+    # weight of the newest response time in the moving average
+    latency_smoothing = 0.2
+
+    # how much the delay factor shrinks after a clean response
+    delay_decrease = 0.05
+
+    def __init__(self, config, max_concurrency=1):
+        """Create a new throttle.
+
+        Args:
+            config: The configuration dictionary.
+            max_concurrency: The maximum number of concurrent requests per
+                (search engine, proxy). Usually the number of workers per proxy.
+        """
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.min_delay_factor = float(config.get('throttle_min_delay_factor', 0.25))
+        self.max_delay_factor = float(config.get('throttle_max_delay_factor', 16))
+        self.latency_tolerance = float(config.get('throttle_latency_tolerance', 2.0))
+
+        # (search engine, proxy) => ThrottleState
+        self.states = {}
+        self.condition = threading.Condition()
+
+    def state(self, search_engine, proxy):
+        key = (search_engine, proxy)
+        if key not in self.states:
+            self.states[key] = ThrottleState()
+        return self.states[key]
+
+    def delay_factor(self, search_engine, proxy=None):
+        """The factor for the pacing delays of a (search engine, proxy)."""
+        with self.condition:
+            return self.state(search_engine, proxy).delay_factor
+
+    def acquire(self, search_engine, proxy=None):
+        """Block until the (search engine, proxy) may take one more concurrent request."""
+        with self.condition:
+            state = self.state(search_engine, proxy)
+            while state.in_flight >= int(state.limit):
+                self.condition.wait()
+            state.in_flight += 1
+
+    def release(self, search_engine, proxy=None, latency=None, blocked=False, failed=False):
+        """Finish a request that was started with acquire() and adapt the limits to its outcome.
+
+        Args:
+            search_engine: The name of the search engine.
+            proxy: The proxy of the request.
+            latency: The response time in seconds.
+            blocked: Whether the search engine blocked the request (captcha, 429, 503).
+            failed: Whether the request failed for another reason, for example a timeout.
+        """
+        with self.condition:
+            state = self.state(search_engine, proxy)
+            state.in_flight -= 1
+
+            slow = False
+            if latency is not None and not blocked and not failed:
+                if state.latency is None:
+                    state.latency = latency
+                else:
+                    state.latency += self.latency_smoothing * (latency - state.latency)
+                state.min_latency = min(state.min_latency or state.latency, state.latency)
+                slow = state.latency > state.min_latency * self.latency_tolerance
+
+            if blocked:
+                state.num_blocks += 1
+                self.decrease(state, 2.0)
+                logger.warning('{} blocked proxy {}. Reducing to {} concurrent requests and {:.2f}x the delays.'.format(
+                    search_engine, proxy, int(state.limit), state.delay_factor))
+            elif failed or slow:
+                self.decrease(state, 1.5)
+                if slow:
+                    # the slow responses should not trigger another decrease right away
+                    state.min_latency = state.latency / self.latency_tolerance
+            else:
+                state.limit = min(self.max_concurrency, state.limit + 1 / state.limit)
+                state.delay_factor = max(self.min_delay_factor, state.delay_factor - self.delay_decrease)
+
+            self.condition.notify_all()
+
+    def decrease(self, state, delay_increase):
+        state.limit = max(1.0, state.limit / 2)
+        state.delay_factor = min(self.max_delay_factor, state.delay_factor * delay_increase)
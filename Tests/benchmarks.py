@@ -0,0 +1,353 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for the performance critical parts of GoogleScraper.
+
+Run all benchmarks:
+
+python Tests/benchmarks.py
+
+Or only some of them:
+
+python Tests/benchmarks.py job_dispatch
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import lxml.etree
+from cssselect import HTMLTranslator
+from GoogleScraper import parsing, scrape_with_config
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.compression import available_algorithms, compress, decompress, zstandard
+from GoogleScraper.config import get_config
+from GoogleScraper.database import ScraperSearch, get_session
+from GoogleScraper.output_converter import init_outfile
+from GoogleScraper.parsing import get_parser_by_search_engine
+from GoogleScraper.journal import CompletionJournal, skip_completed_jobs
+from GoogleScraper.scheduling import ScrapeJobDispatcher
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords
+from GoogleScraper.scraping import ScrapeWorkerFactory
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+all_search_engines = ['google', 'yandex', 'bing', 'yahoo', 'baidu', 'duckduckgo', 'ask']
+
+
+def benchmark_job_dispatch():
+    """Time the assignment of scrape jobs to the workers at startup.
+
+    The cost per job must stay flat when the number of keywords
+    and proxies grows.
+    """
+    print('{:>10} {:>8} {:>10} {:>12} {:>10}'.format('keywords', 'proxies', 'jobs', 'total [s]', 'us/job'))
+
+    for num_keywords in (1000, 10000, 100000):
+        for num_proxies in (1, 10, 50):
+            dispatcher = ScrapeJobDispatcher()
+            for search_engine in all_search_engines:
+                for proxy in range(num_proxies):
+                    dispatcher.add_worker(ScrapeWorkerFactory({}, mode='http', proxy=proxy,
+                                                              search_engine=search_engine))
+
+            keywords = ['keyword {}'.format(i) for i in range(num_keywords)]
+            jobs = default_scrape_jobs_for_keywords(keywords, all_search_engines, 'http', 1)
+
+            started = time.perf_counter()
+            num_jobs = dispatcher.dispatch_all(jobs)
+            elapsed = time.perf_counter() - started
+
+            print('{:>10} {:>8} {:>10} {:>12.3f} {:>10.2f}'.format(
+                num_keywords, num_proxies, num_jobs, elapsed, elapsed / num_jobs * 1e6))
+
+
+def make_cache(cachedir, keywords):
+    """Store the SERP fixture page of every search engine as cached file for all keywords.
+
+    Returns:
+        The names of the search engines that have a fixture page.
+    """
+    cache_manager = CacheManager({'do_caching': True, 'cachedir': cachedir})
+    pages_dir = os.path.join(base, 'data/uncompressed_serp_pages/')
+
+    search_engines = []
+    for fname in os.listdir(pages_dir):
+        search_engine = fname.split('_')[1]
+        search_engines.append(search_engine)
+        with open(os.path.join(pages_dir, fname)) as fd:
+            html = fd.read()
+        for keyword in keywords:
+            with open(os.path.join(cachedir, cache_manager.cached_file_name(keyword, search_engine, 'http', 1)), 'w') as fd:
+                fd.write(html)
+
+    return search_engines
+
+
+def benchmark_process_scaling():
+    """Time a scrape that is answered from the cache with an increasing number of processes.
+
+    Every page needs to be parsed and stored, which is cpu bound. The
+    throughput should grow with the number of processes up to the number of cores.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        keywords = ['keyword {}'.format(i) for i in range(100)]
+        search_engines = make_cache(tmpdir, keywords)
+
+        print('{} cores'.format(os.cpu_count()))
+        print('{:>10} {:>10} {:>12} {:>10} {:>10}'.format('processes', 'pages', 'total [s]', 'pages/s', 'speedup'))
+
+        single = None
+        for num_processes in sorted({1, 2, 4, os.cpu_count()}):
+            started = time.perf_counter()
+            search = scrape_with_config({
+                'keyword': '',
+                'keyword_file': '',
+                'keywords': keywords,
+                'search_engines': search_engines,
+                'scrape_method': 'http',
+                'do_caching': True,
+                'cachedir': tmpdir,
+                # every run parses the pages, instead of reading the results the first run stored
+                'cache_parsed_results': False,
+                'num_processes': num_processes,
+                'database_name': os.path.join(tmpdir, 'processes_{}'.format(num_processes)),
+                'output_filename': '',
+                'print_results': '',
+                'use_own_ip': True,
+                'log_level': 'WARNING',
+            })
+            elapsed = time.perf_counter() - started
+
+            pages_per_second = len(search.serps) / elapsed
+            single = single or pages_per_second
+            print('{:>10} {:>10} {:>12.3f} {:>10.1f} {:>10.2f}'.format(
+                num_processes, len(search.serps), elapsed, pages_per_second, pages_per_second / single))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def benchmark_journal_resume():
+    """Time the resume of a scrape that died after 80% of its jobs.
+
+    Reading the journal and skipping the completed jobs must take seconds
+    for 10 million jobs.
+    """
+    print('{:>10} {:>12} {:>12} {:>10}'.format('jobs', 'load [s]', 'skip [s]', 'remaining'))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for num_keywords in (100000, 1000000, 10000000):
+            keywords = ['keyword {}'.format(i) for i in range(num_keywords)]
+            path = os.path.join(tmpdir, '{}.journal'.format(num_keywords))
+
+            journal = CompletionJournal(path)
+            for keyword in keywords[:num_keywords * 8 // 10]:
+                journal.record(keyword, 'google', 'http', 1)
+            journal.close()
+
+            started = time.perf_counter()
+            completed = CompletionJournal(path).load()
+            loaded = time.perf_counter()
+            remaining = sum(1 for _ in skip_completed_jobs(
+                default_scrape_jobs_for_keywords(keywords, ['google'], 'http', 1), completed))
+            skipped = time.perf_counter()
+
+            print('{:>10} {:>12.3f} {:>12.3f} {:>10}'.format(
+                num_keywords, loaded - started, skipped - loaded, remaining))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def benchmark_cache_lookup():
+    """Time CacheManager.get_cached() misses and hits in cache directories of growing size.
+
+    The time per lookup must not grow with the number of cache files.
+    """
+    print('{:>10} {:>12} {:>12} {:>12}'.format('files', 'index [s]', 'miss [us]', 'hit [us]'))
+
+    for num_files in (1000, 10000, 100000):
+        cachedir = tempfile.mkdtemp()
+        try:
+            cache_manager = CacheManager({'do_caching': True, 'cachedir': cachedir})
+            for i in range(num_files):
+                with open(os.path.join(cachedir, cache_manager.cached_file_name(str(i), 'google', 'http', 1)), 'w') as fd:
+                    fd.write('<html></html>')
+
+            started = time.perf_counter()
+            cache_manager.index.connection()
+            indexed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for i in range(1000):
+                cache_manager.get_cached('missing {}'.format(i), 'google', 'http', 1)
+            miss = (time.perf_counter() - started) / 1000
+
+            started = time.perf_counter()
+            for i in range(1000):
+                cache_manager.get_cached(str(i), 'google', 'http', 1)
+            hit = (time.perf_counter() - started) / 1000
+
+            print('{:>10} {:>12.3f} {:>12.1f} {:>12.1f}'.format(num_files, indexed, miss * 1e6, hit * 1e6))
+        finally:
+            shutil.rmtree(cachedir)
+
+
+def benchmark_cache_replay():
+    """Time the replay of a cache of the SERP fixture pages with parse_all_cached_files().
+
+    The first replay parses every page, the second one reads the parsed
+    results that the first one stored. Both must scale linearly.
+    """
+    print('{} cores'.format(os.cpu_count()))
+    print('{:>10} {:>10} {:>14} {:>10} {:>14} {:>10}'.format(
+        'jobs', 'processes', 'parse [s]', 'jobs/s', 'stored [s]', 'jobs/s'))
+
+    for num_keywords in (100, 1000):
+        for num_processes in sorted({1, os.cpu_count()}):
+            tmpdir = tempfile.mkdtemp()
+            try:
+                keywords = ['keyword {}'.format(i) for i in range(num_keywords)]
+                search_engines = make_cache(tmpdir, keywords)
+                config = dict(get_config(), do_caching=True, cachedir=tmpdir, cache_replay_processes=num_processes,
+                              output_filename='', print_results='', log_level='WARNING')
+                init_outfile(config, force_reload=True)
+                session = get_session(config, path=os.path.join(tmpdir, 'replay.db'))()
+                jobs = list(default_scrape_jobs_for_keywords(keywords, search_engines, 'http', 1))
+
+                elapsed = []
+                for replay in range(2):
+                    started = time.perf_counter()
+                    remaining = CacheManager(config).parse_all_cached_files(jobs, session, ScraperSearch())
+                    elapsed.append(time.perf_counter() - started)
+                    assert not remaining
+
+                print('{:>10} {:>10} {:>14.3f} {:>10.1f} {:>14.3f} {:>10.1f}'.format(
+                    len(jobs), num_processes, elapsed[0], len(jobs) / elapsed[0], elapsed[1], len(jobs) / elapsed[1]))
+            finally:
+                shutil.rmtree(tmpdir)
+
+
+def load_test_pages():
+    """Returns the html of all distinct SERP pages and cache files in Tests/data as bytes."""
+    pages = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(base, 'data')):
+        for fname in sorted(filenames):
+            with open(os.path.join(dirpath, fname), 'rb') as fd:
+                data = fd.read()
+            if fname.endswith('.cache.gz'):
+                pages.append(decompress(data, 'gz'))
+            elif fname.endswith('.cache') or fname.endswith('.html'):
+                pages.append(data)
+    return sorted(set(pages), key=pages.index)
+
+
+def benchmark_compression():
+    """Compare the ratio and the throughput of the compression algorithms on the pages in Tests/data.
+
+    The zst dictionary is trained on every other page and measured on the
+    others, as a dictionary trained on the first pages of a scrape is.
+    """
+    pages = load_test_pages()
+
+    candidates = [(algorithm, None) for algorithm in available_algorithms()]
+    if zstandard:
+        candidates.append(('zst+dict', zstandard.train_dictionary(112640, pages[::2])))
+        pages = pages[1::2]
+
+    size = sum(map(len, pages))
+    print('{} pages, {:.1f} MB'.format(len(pages), size / 1e6))
+    print('{:>14} {:>8} {:>18} {:>20}'.format('algorithm', 'ratio', 'compress [MB/s]', 'decompress [MB/s]'))
+
+    for name, dictionary in candidates:
+        algorithm = name.split('+')[0]
+        repeat = 20 if algorithm != 'bz2' else 2
+        dictionaries = {dictionary.dict_id(): dictionary} if dictionary else None
+
+        started = time.perf_counter()
+        for i in range(repeat):
+            compressed = [compress(page, algorithm, dictionary=dictionary) for page in pages]
+        compress_time = (time.perf_counter() - started) / repeat
+
+        started = time.perf_counter()
+        for i in range(repeat):
+            for data in compressed:
+                decompress(data, algorithm, dictionaries=dictionaries)
+        decompress_time = (time.perf_counter() - started) / repeat
+
+        print('{:>14} {:>8.2f} {:>18.1f} {:>20.1f}'.format(
+            name, size / sum(map(len, compressed)), size / compress_time / 1e6, size / decompress_time / 1e6))
+
+
+@contextlib.contextmanager
+def translated_selectors():
+    """Let the parsers translate and compile every selector on every use, as they did before."""
+    def compile_css(css):
+        return lxml.etree.XPath(HTMLTranslator().css_to_xpath(css))
+
+    cached = parsing.compile_css, parsing.compile_selector, parsing.css_to_xpath
+    parsing.compile_css, parsing.compile_selector = compile_css, parsing.CompiledSelector
+    parsing.css_to_xpath = HTMLTranslator().css_to_xpath
+    try:
+        yield
+    finally:
+        parsing.compile_css, parsing.compile_selector, parsing.css_to_xpath = cached
+
+
+def benchmark_parse():
+    """Compare the parsers with compiled selectors to parsers that translate the selectors on every use.
+
+    Every SERP page in Tests/data/uncompressed_serp_pages is parsed by the parser
+    of its search engine, both ways must find the same results. The gain is small
+    where building the DOM and evaluating the selectors on the whole page dominate,
+    like for yandex.
+    """
+    pages_dir = os.path.join(base, 'data/uncompressed_serp_pages/')
+    repeat = 20
+
+    print('{:>12} {:>8} {:>16} {:>16} {:>8}'.format('engine', 'results', 'translated [ms]', 'compiled [ms]',
+                                                    'speedup'))
+    for fname in sorted(os.listdir(pages_dir)):
+        search_engine = fname.split('_')[1]
+        with open(os.path.join(pages_dir, fname)) as fd:
+            html = fd.read()
+        parser_class = get_parser_by_search_engine(search_engine)
+
+        timings, results = [], []
+        for mode in (translated_selectors, contextlib.nullcontext):
+            with mode():
+                parser_class({}, html=html)
+                started = time.perf_counter()
+                for i in range(repeat):
+                    parser = parser_class({}, html=html)
+                timings.append((time.perf_counter() - started) / repeat)
+                results.append(parser.search_results)
+        assert results[0] == results[1], 'The parsers differ for {}'.format(search_engine)
+
+        print('{:>12} {:>8} {:>16.2f} {:>16.2f} {:>7.1f}x'.format(
+            search_engine, sum(map(len, results[1].values())), timings[0] * 1e3, timings[1] * 1e3,
+            timings[0] / timings[1]))
+
+
+benchmarks = {
+    'job_dispatch': benchmark_job_dispatch,
+    'process_scaling': benchmark_process_scaling,
+    'journal_resume': benchmark_journal_resume,
+    'cache_lookup': benchmark_cache_lookup,
+    'compression': benchmark_compression,
+    'cache_replay': benchmark_cache_replay,
+    'parse': benchmark_parse,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks.keys():
+        print('=== {} ==='.format(name))
+        benchmarks[name]()
@@ -0,0 +1,896 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the cache of the scraped SERP pages.
+
+python -m pytest Tests/caching_tests.py
+"""
+
+import io
+import os
+import time
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from GoogleScraper.cache_index import CacheIndex
+from GoogleScraper.cache_pack import PackStore
+from GoogleScraper.cache_compactor import CacheCompactor
+from GoogleScraper.cache_archive import export_cache, import_cache
+from GoogleScraper.cache_backends import CacheBackend, KeyValueBackend, iter_rows
+from GoogleScraper.cache_server import run_server
+from GoogleScraper.negative_cache import NegativeCache
+from GoogleScraper.compression import available_algorithms, zstandard, DictionaryStore
+from GoogleScraper.parsed_cache import ParsedResults
+from GoogleScraper.parsing import GoogleParser, parser_version, parse_serp
+from GoogleScraper.pipeline import FetchedPage
+from GoogleScraper.config import get_config
+from GoogleScraper.database import ScraperSearch, get_session
+from GoogleScraper.output_converter import init_outfile
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords
+from GoogleScraper.caching import CacheManager
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+
+class FakeParser(object):
+
+    def __init__(self, html):
+        self.html = self.cleaned_html = html
+
+
+class CacheIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': True,
+                       'compressing_algorithm': 'gz'}
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_index_is_built_from_existing_files(self):
+        cache_manager = CacheManager(dict(self.config, cache_index=False))
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        fname = cache_manager.cached_file_name('one', 'google', 'http', 1)
+
+        index = CacheIndex(self.cachedir)
+        entry = index.get(fname)
+        assert entry.path == cache_manager.cache_file_path(fname) + '.gz'
+        assert entry.compression == 'gz'
+        assert entry.size == os.path.getsize(os.path.join(self.cachedir, entry.path))
+        assert len(index) == 1
+
+    def test_cached_pages_are_found_through_the_index(self):
+        cache_manager = CacheManager(self.config)
+        assert cache_manager.get_cached('one', 'google', 'http', 1) is False
+
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        assert cache_manager.get_cached('one', 'google', 'http', 1) == '<html>one</html>'
+        assert cache_manager.get_cached('one', 'google', 'http', 2) is False
+
+        # a new CacheManager reads the persisted index
+        assert cache_manager.cached_file_name('one', 'google', 'http', 1) in CacheManager(self.config).index
+
+    def test_files_copied_into_the_cachedir_are_indexed(self):
+        cache_manager = CacheManager(self.config)
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        cache_manager.index.close()
+
+        fname = cache_manager.cached_file_name('two', 'google', 'http', 1)
+        with open(os.path.join(self.cachedir, fname), 'w') as fd:
+            fd.write('<html>two</html>')
+
+        assert CacheManager(self.config).get_cached('two', 'google', 'http', 1) == '<html>two</html>'
+
+    def test_removed_files_are_misses(self):
+        cache_manager = CacheManager(self.config)
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        fname = cache_manager.cached_file_name('one', 'google', 'http', 1)
+        os.remove(os.path.join(self.cachedir, cache_manager.cache_file_path(fname) + '.gz'))
+
+        assert cache_manager.get_cached('one', 'google', 'http', 1) is False
+        assert fname not in cache_manager.index
+
+    def test_expired_files_are_removed_from_the_index(self):
+        cache_manager = CacheManager(self.config)
+        for keyword in ('old', 'gone', 'new'):
+            cache_manager.cache_results(FakeParser('<html>{}</html>'.format(keyword)), keyword, 'google', 'http', 1)
+        names = {keyword: cache_manager.cached_file_name(keyword, 'google', 'http', 1) for keyword in ('old', 'gone')}
+        for name in names.values():
+            cache_manager.index.conn.execute('UPDATE entries SET mtime = 0 WHERE name = ?', (name,))
+        # another process expired this file already
+        os.remove(os.path.join(self.cachedir, cache_manager.index.get(names['gone']).path))
+
+        cache_manager.files.expire(time.time() - 60)
+
+        assert [entry.name for entry in cache_manager.index.entries()] == [
+            cache_manager.cached_file_name('new', 'google', 'http', 1)]
+        assert cache_manager.get_cached('old', 'google', 'http', 1) is False
+        assert cache_manager.get_cached('new', 'google', 'http', 1) == '<html>new</html>'
+
+    def test_only_a_corrupt_index_counts_as_corrupt(self):
+        cache_manager = CacheManager(self.config)
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        index = cache_manager.index
+
+        assert not index.is_corrupt(sqlite3.OperationalError('database is locked'))
+        assert not index.is_corrupt(sqlite3.DatabaseError('spurious'))
+        index.close()
+        with open(index.path, 'wb') as fd:
+            fd.write(b'garbage' * 1000)
+        assert index.is_corrupt(sqlite3.DatabaseError('file is not a database'))
+
+    def test_corrupt_index_is_rebuilt(self):
+        cache_manager = CacheManager(self.config)
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        cache_manager.index.close()
+
+        with open(cache_manager.index.path, 'wb') as fd:
+            fd.write(b'garbage' * 1000)
+
+        assert CacheManager(self.config).get_cached('one', 'google', 'http', 1) == '<html>one</html>'
+
+
+class CacheLayoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': True,
+                       'compressing_algorithm': 'gz'}
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def fill(self, cache_manager, keywords):
+        for keyword in keywords:
+            cache_manager.cache_results(FakeParser('<html>{}</html>'.format(keyword)), keyword, 'google', 'http', 1)
+
+    def test_sharded_files_are_written_to_subdirectories(self):
+        cache_manager = CacheManager(dict(self.config, cache_layout='sharded'))
+        self.fill(cache_manager, ['one'])
+
+        fname = cache_manager.cached_file_name('one', 'google', 'http', 1)
+        assert os.path.exists(os.path.join(self.cachedir, fname[:2], fname[2:4], fname + '.gz'))
+        assert cache_manager.get_cached('one', 'google', 'http', 1) == '<html>one</html>'
+        assert CacheManager(dict(self.config, cache_index=False)).get_cached('one', 'google', 'http', 1) == \
+            '<html>one</html>'
+
+    def test_flat_cache_is_migrated(self):
+        keywords = ['kw{}'.format(i) for i in range(20)]
+        flat = CacheManager(dict(self.config, cache_layout='flat'))
+        self.fill(flat, keywords)
+        stale = flat.index.get(flat.cached_file_name('kw0', 'google', 'http', 1))
+
+        sharded = CacheManager(dict(self.config, cache_layout='sharded'))
+        assert sharded.migrate_cache_layout() == len(keywords)
+        assert sharded.migrate_cache_layout() == 0
+
+        assert [name for name in os.listdir(self.cachedir) if 'cache' in name] == []
+        for keyword in keywords:
+            assert sharded.get_cached(keyword, 'google', 'http', 1) == '<html>{}</html>'.format(keyword)
+
+        # a reader with an outdated index entry still finds the moved file
+        flat.index.conn.execute('UPDATE entries SET path = ? WHERE name = ?', (stale.path, stale.name))
+        assert flat.get_cached('kw0', 'google', 'http', 1) == '<html>kw0</html>'
+
+        # and back
+        assert flat.migrate_cache_layout() == len(keywords)
+        assert sorted(os.listdir(self.cachedir)) == sorted(
+            [CacheIndex.dirname] + [flat.cached_file_name(kw, 'google', 'http', 1) + '.gz' for kw in keywords])
+
+
+class PackStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': True,
+                       'compressing_algorithm': 'gz', 'cache_backend': 'pack'}
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_pages_are_read_back(self):
+        packs = PackStore(self.cachedir)
+        packs.put('one.cache', '<html>one</html>', 'gz')
+        packs.put('two.cache', '<html>two</html>', 'bz2')
+        packs.put('three.cache', '<html>three</html>')
+
+        assert packs.read('one.cache') == '<html>one</html>'
+        assert packs.read('two.cache') == '<html>two</html>'
+        assert packs.read('three.cache') == '<html>three</html>'
+        assert packs.read('four.cache') is None
+        assert len(packs) == 3
+
+    def test_packs_are_rotated(self):
+        packs = PackStore(self.cachedir, max_pack_size=100)
+        for i in range(10):
+            packs.put('kw{}.cache'.format(i), '<html>{}</html>'.format('x' * 50))
+
+        assert len(packs.pack_numbers()) == 10
+        assert all(os.path.getsize(packs.pack_path(pack)) <= 100 for pack in packs.pack_numbers())
+        assert packs.read('kw9.cache') == '<html>{}</html>'.format('x' * 50)
+
+    def test_compaction_removes_overwritten_pages(self):
+        packs = PackStore(self.cachedir, max_pack_size=1000)
+        for version in range(5):
+            for i in range(10):
+                packs.put('kw{}.cache'.format(i), '<html>{} {}</html>'.format(i, version))
+
+        other = PackStore(self.cachedir, max_pack_size=1000)
+        other.put('other.cache', '<html>other</html>')
+
+        total, live = packs.garbage()
+        freed = packs.compact()
+        assert freed > 0 and packs.garbage()[0] == total - freed
+        assert packs.garbage()[1] == live
+        for i in range(10):
+            assert packs.read('kw{}.cache'.format(i)) == '<html>{} 4</html>'.format(i)
+
+        # a store that kept the removed packs open finds the moved pages and writes to a new pack
+        assert other.read('kw1.cache') == '<html>1 4</html>'
+        other.put('kw0.cache', '<html>new</html>')
+        assert packs.read('kw0.cache') == '<html>new</html>'
+        assert other.read('other.cache') == '<html>other</html>'
+
+    def test_lost_index_is_rebuilt(self):
+        packs = PackStore(self.cachedir)
+        packs.put('one.cache', '<html>old</html>', 'gz')
+        packs.put('one.cache', '<html>one</html>', 'gz')
+        packs.put('two.cache', '<html>two</html>')
+        packs.close()
+        os.remove(os.path.join(self.cachedir, 'packs', 'index.sqlite'))
+
+        packs = PackStore(self.cachedir)
+        assert len(packs) == 0
+        packs.rebuild_index()
+        assert len(packs) == 2
+        assert packs.read('one.cache') == '<html>one</html>'
+
+    def test_cache_manager_with_pack_backend(self):
+        files = CacheManager(dict(self.config, cache_backend='files'))
+        files.cache_results(FakeParser('<html>file</html>'), 'file', 'google', 'http', 1)
+
+        cache_manager = CacheManager(self.config)
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        assert cache_manager.get_cached('one', 'google', 'http', 1) == '<html>one</html>'
+        assert cache_manager.get_cached('file', 'google', 'http', 1) == '<html>file</html>'
+        assert cache_manager.get_cached('two', 'google', 'http', 1) is False
+
+        names = cache_manager._get_cached_file_names()
+        assert len(names) == 2
+        for name, fname in names.items():
+            assert cache_manager.parse_again(fname, 'google', 'http', 'one') is not None
+
+        assert cache_manager.migrate_cache_layout() == 1
+        assert cache_manager._get_all_cache_files() == set()
+        assert cache_manager.get_cached('file', 'google', 'http', 1) == '<html>file</html>'
+
+class CompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': True}
+        with open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')) as fd:
+            self.html = fd.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_all_algorithms_and_backends(self):
+        for algorithm in available_algorithms():
+            for backend in ('files', 'pack', 'dedup'):
+                config = dict(self.config, compressing_algorithm=algorithm, cache_backend=backend)
+                CacheManager(config).cache_results(FakeParser(self.html), algorithm, 'google', backend, 1)
+                assert CacheManager(config).get_cached(algorithm, 'google', backend, 1) == self.html
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstd_dictionary_is_trained_per_search_engine(self):
+        config = dict(self.config, compressing_algorithm='zst', zstd_dictionary_samples=8,
+                      zstd_dictionary_size=16 * 1024)
+        cache_manager = CacheManager(config)
+        pages = [self.html.replace('abrakadabra', 'keyword {}'.format(i)) for i in range(10)]
+        for i, page in enumerate(pages):
+            cache_manager.cache_results(FakeParser(page), str(i), 'google', 'http', 1)
+
+        dictionaries = os.listdir(os.path.join(self.cachedir, 'dictionaries'))
+        assert len(dictionaries) == 1 and dictionaries[0].startswith('google-')
+
+        # the first pages are compressed without, the last ones with the dictionary
+        def frame_dict_id(keyword):
+            path = cache_manager.cached_file_path(cache_manager.cached_file_name(keyword, 'google', 'http', 1))
+            with open(path, 'rb') as fd:
+                return zstandard.get_frame_parameters(fd.read()).dict_id
+        assert frame_dict_id('0') == 0
+        assert frame_dict_id('9') != 0
+        assert cache_manager.dictionaries.dictionary_for('bing') is None
+
+        reader = CacheManager(config)
+        for i, page in enumerate(pages):
+            assert reader.get_cached(str(i), 'google', 'http', 1) == page
+
+    @unittest.skipUnless(zstandard, 'zstandard is not installed')
+    def test_zstd_dictionary_is_trained_without_the_lock(self):
+        store = DictionaryStore(os.path.join(self.cachedir, 'dictionaries'), num_samples=8, dict_size=16 * 1024)
+        pages = [self.html.replace('abrakadabra', 'keyword {}'.format(i)).encode() for i in range(8)]
+        train_dictionary = zstandard.train_dictionary
+
+        def train(*args):
+            assert store.lock.acquire(blocking=False)
+            store.lock.release()
+            # the pages that are cached during the training are compressed without a dictionary
+            assert store.dictionary_for('google', pages[0]) is None
+            return train_dictionary(*args)
+
+        zstandard.train_dictionary = train
+        try:
+            for page in pages:
+                dictionary = store.dictionary_for('google', page)
+        finally:
+            zstandard.train_dictionary = train_dictionary
+
+        assert dictionary is not None
+        assert store.dictionary_for('google') is dictionary
+        assert store.get(dictionary.dict_id()) is dictionary
+
+class ParsedResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': True}
+        with open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')) as fd:
+            self.parser = GoogleParser(config=self.config, query='abrakadabra', html=fd.read())
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_cached_pages_are_not_parsed_again(self):
+        cache_manager = CacheManager(self.config)
+        cache_manager.cache_results(self.parser, 'abrakadabra', 'google', 'http', 1)
+        fname = cache_manager.cached_file_name('abrakadabra', 'google', 'http', 1)
+        path = cache_manager._get_cached_file_names()[fname]
+        version = parser_version(GoogleParser)
+
+        serp = cache_manager.parse_again(path, 'google', 'http', 'abrakadabra')
+        assert serp.num_results == self.parser.num_results > 0
+        assert [link.link for link in serp.links] == [result['link'] for result in self.parser.search_results['results']]
+
+        # the stored results are served
+        cache_manager.parsed_results.put(fname, version, ParsedResults(num_results=42))
+        assert cache_manager.parse_again(path, 'google', 'http', 'abrakadabra').num_results == 42
+
+        # unless they were made by another version of the parser
+        cache_manager.parsed_results.put(fname, 'outdated', ParsedResults(num_results=42))
+        assert cache_manager.parse_again(path, 'google', 'http', 'abrakadabra').num_results == self.parser.num_results
+        assert cache_manager.parsed_results.get(fname, version).num_results == self.parser.num_results
+
+    def test_parser_version_changes_with_the_selectors(self):
+        class ChangedParser(GoogleParser):
+            pass
+        version = parser_version(ChangedParser)
+        ChangedParser.page_number_selectors = ['#nav td.cur::text']
+
+        assert parser_version(GoogleParser) == parser_version(GoogleParser)
+        assert parser_version(GoogleParser) != parser_version(GoogleParser, 'image')
+        assert parser_version(ChangedParser) != version
+
+class CacheReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = dict(get_config(), do_caching=True, cachedir=self.cachedir, print_results='',
+                           output_filename='', cache_replay_batch_size=3, cache_replay_processes=2)
+        init_outfile(self.config, force_reload=True)
+        self.session = get_session(self.config, path=os.path.join(self.cachedir, 'test.db'))()
+        with open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')) as fd:
+            self.html = fd.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def replay(self, scrape_jobs):
+        scraper_search = ScraperSearch()
+        remaining = CacheManager(self.config).parse_all_cached_files(scrape_jobs, self.session, scraper_search)
+        return remaining, scraper_search
+
+    def test_cached_jobs_are_replayed_in_batches(self):
+        keywords = ['kw{}'.format(i) for i in range(20)]
+        cache_manager = CacheManager(self.config)
+        for keyword in keywords[::2]:
+            cache_manager.cache_results(FakeParser(self.html), keyword, 'google', 'http', 1)
+        scrape_jobs = list(default_scrape_jobs_for_keywords(keywords, ['google'], 'http', 1))
+
+        # parsed in two processes
+        remaining, scraper_search = self.replay(scrape_jobs)
+        assert [job['query'] for job in remaining] == keywords[1::2]
+        assert sorted(serp.query for serp in scraper_search.serps) == sorted(keywords[::2])
+        assert all(len(serp.links) > 0 for serp in scraper_search.serps)
+
+        # the replayed SERPs have the values of their jobs and are found in the database
+        remaining, again = self.replay(scrape_jobs)
+        assert [job['query'] for job in remaining] == keywords[1::2]
+        assert {serp.id for serp in again.serps} == {serp.id for serp in scraper_search.serps}
+        assert all(serp.page_number == 1 and serp.search_engine_name == 'google' for serp in again.serps)
+
+    def test_scraped_serps_are_found_in_the_database(self):
+        keywords = ['kw{}'.format(i) for i in range(6)]
+        cache_manager = CacheManager(self.config)
+        for keyword in keywords:
+            cache_manager.cache_results(FakeParser(self.html), keyword, 'google', 'http', 1)
+        scrape_jobs = list(default_scrape_jobs_for_keywords(keywords, ['google'], 'http', 1))
+
+        parser = GoogleParser(config=self.config, html=self.html)
+        scraped = [parse_serp(self.config, parser=parser, scraper=FetchedPage(keyword, 'google', 'http', 1))
+                   for keyword in keywords]
+        self.session.add_all(scraped)
+        self.session.commit()
+
+        remaining, scraper_search = self.replay(scrape_jobs)
+        assert not remaining
+        assert {serp.id for serp in scraper_search.serps} == {serp.id for serp in scraped}
+
+    def test_unreadable_pages_are_scraped_again(self):
+        cache_manager = CacheManager(dict(self.config, compress_cached_files=False, cache_parsed_results=False))
+        cache_manager.cache_results(FakeParser(self.html), 'good', 'google', 'http', 1)
+        cache_manager.cache_results(FakeParser(self.html), 'broken', 'google', 'http', 1)
+        path = cache_manager.cached_file_path(cache_manager.cached_file_name('broken', 'google', 'http', 1))
+        os.rename(path, path + '.gz')
+        cache_manager.index.rebuild()
+
+        remaining, scraper_search = self.replay(default_scrape_jobs_for_keywords(['good', 'broken'], ['google'],
+                                                                                 'http', 1))
+        assert [job['query'] for job in remaining] == ['broken']
+        assert [serp.query for serp in scraper_search.serps] == ['good']
+
+class CacheCompactorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': False}
+        self.keywords = ['kw{}'.format(i) for i in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def fill(self, cache_manager):
+        for keyword in self.keywords:
+            cache_manager.cache_results(FakeParser('<html>{}</html>'.format(keyword * 10)), keyword, 'google', 'http', 1)
+
+    def cached(self, cache_manager):
+        return [keyword for keyword in self.keywords
+                if cache_manager._read_cached_page(cache_manager.cached_file_name(keyword, 'google', 'http', 1))]
+
+    def test_least_recently_read_pages_are_evicted(self):
+        cache_manager = CacheManager(self.config)
+        compactor = CacheCompactor(cache_manager, max_entries=5)
+        self.fill(cache_manager)
+        for keyword in ['kw0', 'kw1', 'kw2', 'missing']:
+            cache_manager.get_cached(keyword, 'google', 'http', 1)
+
+        compactor.compact()
+        assert self.cached(cache_manager) == ['kw0', 'kw1', 'kw2', 'kw9']
+
+        stats = cache_manager.stats.as_dict()
+        assert stats['hits'] == 3 and stats['misses'] == 1 and stats['hit_ratio'] == 0.75
+        assert stats['evicted_entries'] == 6 and stats['evicted_bytes'] > 0
+
+    def test_least_often_read_pages_are_evicted(self):
+        cache_manager = CacheManager(dict(self.config, cache_backend='pack'))
+        self.fill(cache_manager)
+        size = sum(entry[1] for entry in cache_manager.cache_entries())
+        compactor = CacheCompactor(cache_manager, max_bytes=size // 2, policy='lfu')
+        for i, keyword in enumerate(self.keywords):
+            for j in range(i % 3):
+                cache_manager.get_cached(keyword, 'google', 'http', 1)
+
+        compactor.compact()
+        assert self.cached(cache_manager) == ['kw2', 'kw5', 'kw7', 'kw8']
+        assert cache_manager.stats.as_dict()['evicted_bytes'] == size - sum(
+            entry[1] for entry in cache_manager.cache_entries())
+
+        # the garbage of the evicted pages is compacted away
+        total, live = cache_manager.packs.garbage()
+        assert total < 2 * live
+
+    def test_deduplicated_pages_count_once_for_the_quota(self):
+        cache_manager = CacheManager(dict(self.config, cache_backend='dedup'))
+        for keyword in self.keywords:
+            cache_manager.cache_results(FakeParser('<html>the same page</html>'), keyword, 'google', 'http', 1)
+        blob_bytes = cache_manager.dedup_report()['blob_bytes']
+
+        # the entries are streamed
+        def cache_entries():
+            raise AssertionError('the entries of the cache are loaded at once')
+        cache_manager.cache_entries = cache_entries
+
+        assert round(sum(entry[1] for entry in cache_manager.iter_cache_entries())) == blob_bytes
+        CacheCompactor(cache_manager, max_bytes=2 * blob_bytes).compact()
+        assert self.cached(cache_manager) == self.keywords
+
+    def test_accesses_are_only_collected_for_a_compactor(self):
+        cache_manager = CacheManager(self.config)
+        self.fill(cache_manager)
+        cache_manager.get_cached('kw0', 'google', 'http', 1)
+        assert cache_manager.stats.hits == 1 and cache_manager.stats.accesses == {}
+
+        compactor = CacheCompactor(cache_manager, max_entries=100)
+        cache_manager.get_cached('kw0', 'google', 'http', 1)
+        assert len(cache_manager.stats.accesses) == 1
+
+        compactor.stop()
+        cache_manager.get_cached('kw0', 'google', 'http', 1)
+        assert cache_manager.stats.accesses == {}
+
+    def test_old_pages_expire(self):
+        cache_manager = CacheManager(self.config)
+        self.fill(cache_manager)
+        cache_manager.index.conn.execute('UPDATE entries SET mtime = 0 WHERE name = ?',
+                                         (cache_manager.cached_file_name('kw3', 'google', 'http', 1),))
+
+        CacheCompactor(cache_manager, max_entries=100).compact()
+        assert 'kw3' not in self.cached(cache_manager) and len(self.cached(cache_manager)) == 9
+        assert cache_manager.stats.as_dict()['expired_entries'] == 1
+
+    def test_compactor_runs_in_the_background(self):
+        cache_manager = CacheManager(dict(self.config, cache_max_entries=2, cache_compaction_interval=0.01))
+        compactor = cache_manager.start_compactor()
+        self.fill(cache_manager)
+        for i in range(100):
+            if len(cache_manager.cache_entries()) <= 2:
+                break
+            compactor.stopped.wait(0.05)
+        compactor.stop()
+
+        assert not compactor.is_alive()
+        assert len(cache_manager.cache_entries()) <= 2
+        assert CacheManager(self.config).start_compactor() is None
+
+class AtomicWriteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_concurrent_writers_and_readers(self):
+        for compress in (False, True):
+            cache_manager = CacheManager({'do_caching': True, 'cachedir': self.cachedir,
+                                          'compress_cached_files': compress})
+            pages = ['<html>{}</html>'.format(str(i) * 10000) for i in range(10)]
+            errors = []
+
+            def write(i):
+                for j in range(20):
+                    cache_manager.cache_results(FakeParser(pages[(i + j) % 10]), 'same', 'google', 'http', 1)
+                    cache_manager.cache_results(FakeParser(pages[i]), 'own {}'.format(i), 'google', 'http', 1)
+
+            def read():
+                for j in range(100):
+                    html = cache_manager.get_cached('same', 'google', 'http', 1)
+                    if html and html not in pages:
+                        errors.append(html[:50])
+
+            threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+            threads += [threading.Thread(target=read) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            assert errors == []
+            assert cache_manager.get_cached('same', 'google', 'http', 1) in pages
+            for i in range(8):
+                assert cache_manager.get_cached('own {}'.format(i), 'google', 'http', 1) == pages[i]
+            leftovers = [name for dirpath, dirnames, filenames in os.walk(self.cachedir)
+                         for name in filenames if name.startswith('.tmp-')]
+            assert leftovers == []
+
+class CacheBackendTestCase(unittest.TestCase):
+
+    def test_incomplete_backends_cannot_be_created(self):
+        class ReadOnlyBackend(CacheBackend):
+            def get(self, name):
+                return None
+
+        with self.assertRaises(TypeError):
+            ReadOnlyBackend()
+
+
+class KeyValueBackendTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # the stand-in server runs in its own process, like a server on another host
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        cls.server = context.Process(target=run_server, args=(('localhost', 0), ready), daemon=True)
+        cls.server.start()
+        cls.address = '{}:{}'.format(*ready.get(timeout=30))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.join()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = 'test:{}:'.format(self.id())
+        self.config = {'do_caching': True, 'cache_backend': 'kv', 'cache_server_address': self.address,
+                       'cache_key_prefix': self.prefix, 'compress_cached_files': True, 'compressing_algorithm': 'gz'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def host(self, name, **options):
+        cachedir = os.path.join(self.tmpdir, name)
+        return CacheManager(dict(self.config, cachedir=cachedir, **options))
+
+    def test_pages_are_shared_between_hosts(self):
+        one, two = self.host('one'), self.host('two', compressing_algorithm='bz2')
+        one.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        two.cache_results(FakeParser('<html>two</html>'), 'two', 'google', 'http', 1)
+
+        for host in (one, two):
+            assert host.get_cached('one', 'google', 'http', 1) == '<html>one</html>'
+            assert host.get_cached('two', 'google', 'http', 1) == '<html>two</html>'
+            assert host.get_cached('three', 'google', 'http', 1) is False
+        assert sorted(one._get_cached_file_names()) == sorted(
+            one.cached_file_name(kw, 'google', 'http', 1) for kw in ('one', 'two'))
+        assert one._get_all_cache_files() == set()
+
+        one.evict([one.cached_file_name('one', 'google', 'http', 1)])
+        assert two.get_cached('one', 'google', 'http', 1) is False
+
+    def test_pipelined_lookups(self):
+        backend = KeyValueBackend(self.address, prefix=self.prefix, chunk_size=100)
+        names = ['page{}'.format(i) for i in range(1000)]
+        for i, name in enumerate(names[::3]):
+            backend.put(name, name.encode(), '')
+
+        assert backend.find(names) == set(names[::3])
+        pages = backend.get_many(names)
+        assert sorted(pages) == sorted(names[::3])
+        assert all(page.data == name.encode() and page.compression == '' for name, page in pages.items())
+        assert sorted(backend.names()) == sorted(names[::3])
+        assert sum(size for name, size, mtime in backend.entries()) > 0
+
+        backend.remove(names[:30])
+        assert len(backend.find(names)) == len(names[::3]) - 10
+
+        # a lost connection is opened again
+        backend.connection().sock.close()
+        assert backend.get(names[999]).data == names[999].encode()
+        backend.close()
+
+    def test_unreachable_server_is_a_miss(self):
+        cache_manager = self.host('one', cache_server_address='localhost:1')
+        cache_manager.cache_results(FakeParser('<html>one</html>'), 'one', 'google', 'http', 1)
+        assert cache_manager.get_cached('one', 'google', 'http', 1) is False
+
+    def test_jobs_cached_by_another_host_are_replayed(self):
+        with open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')) as fd:
+            html = fd.read()
+        keywords = ['kw{}'.format(i) for i in range(6)]
+
+        # cached by one host as files, which are moved to the server, and by another host directly
+        files = self.host('one', cache_backend='files')
+        for keyword in keywords[:2]:
+            files.cache_results(FakeParser(html), keyword, 'google', 'http', 1)
+        one = self.host('one')
+        assert one.migrate_cache_layout() == 2
+        one.cache_results(FakeParser(html), keywords[2], 'google', 'http', 1)
+
+        config = dict(get_config(), **self.config)
+        config.update(cachedir=os.path.join(self.tmpdir, 'two'), print_results='', output_filename='')
+        init_outfile(config, force_reload=True)
+        session = get_session(config, path=os.path.join(self.tmpdir, 'test.db'))()
+        scraper_search = ScraperSearch()
+        scrape_jobs = list(default_scrape_jobs_for_keywords(keywords, ['google'], 'http', 1))
+
+        remaining = CacheManager(config).parse_all_cached_files(scrape_jobs, session, scraper_search)
+        assert [job['query'] for job in remaining] == keywords[3:]
+        assert sorted(serp.query for serp in scraper_search.serps) == keywords[:3]
+        assert all(len(serp.links) > 0 for serp in scraper_search.serps)
+
+
+class NegativeCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.job = list(default_scrape_jobs_for_keywords(['one'], ['google'], 'http', 1))[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_failures_are_remembered_per_proxy(self):
+        negative = NegativeCache(self.cachedir)
+        negative.record(self.job, '1.2.3.4:80', 'blocked')
+        negative.record(self.job, 'localhost', 'timeout')
+
+        assert negative.get(self.job, '1.2.3.4:80') == 'blocked'
+        assert negative.get(dict(self.job, page_number=2), '1.2.3.4:80') is None
+        assert negative.failed_proxies(self.job) == {'1.2.3.4:80': 'blocked', 'localhost': 'timeout'}
+
+        # shared with the other processes of a scrape
+        assert NegativeCache(self.cachedir).get(self.job, 'localhost') == 'timeout'
+        assert negative.num_recorded == 2
+
+    def test_records_expire_after_the_ttl_of_their_reason(self):
+        negative = NegativeCache(self.cachedir, ttls={'no_results': 0})
+        negative.record(self.job, 'localhost', 'no_results')
+        assert len(negative) == 0
+
+        negative.record(self.job, 'localhost', 'blocked')
+        negative.record(dict(self.job, query='two'), 'localhost', 'timeout')
+        negative.connection().execute('UPDATE failures SET expires = 0 WHERE reason = ?', ('timeout',))
+        assert negative.get(dict(self.job, query='two'), 'localhost') is None
+        assert len(negative) == 1
+
+        negative.purge()
+        assert negative.connection().execute('SELECT COUNT(*) FROM failures').fetchone()[0] == 1
+
+    def test_negative_caching_can_be_disabled(self):
+        assert CacheManager({'do_caching': True, 'cachedir': self.cachedir}).negative is not None
+        assert CacheManager({'do_caching': True, 'cachedir': self.cachedir,
+                             'negative_caching': False}).negative is None
+
+
+class CacheArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmpdir, 'cache.tar.gz')
+        self.keywords = ['kw{}'.format(i) for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def host(self, name, **config):
+        return CacheManager(dict({'do_caching': True, 'cachedir': os.path.join(self.tmpdir, name),
+                                  'compress_cached_files': True, 'compressing_algorithm': 'gz'}, **config))
+
+    def fill(self, cache_manager):
+        for keyword in self.keywords:
+            cache_manager.cache_results(FakeParser('<html>{}</html>'.format(keyword)), keyword, 'google', 'http', 1)
+
+    def html(self, cache_manager, keyword):
+        return cache_manager.get_cached(keyword, 'google', 'http', 1)
+
+    def test_pages_are_moved_to_another_host(self):
+        one = self.host('one')
+        self.fill(one)
+        old = one.cached_file_name('old', 'google', 'http', 1)
+        one.backend.put(old, b'<html>old</html>', mtime=time.time() - 3 * 24 * 60 * 60)
+
+        assert export_cache(one, self.archive) == 5
+
+        two = self.host('two', cache_backend='pack', compressing_algorithm='bz2')
+        assert import_cache(two, self.archive) == {'imported': 5, 'skipped': 0, 'damaged': 0}
+        assert [self.html(two, keyword) for keyword in self.keywords] == [
+            '<html>{}</html>'.format(keyword) for keyword in self.keywords]
+        assert {entry[2] for entry in two.cache_entries()} == {entry[2] for entry in one.cache_entries()
+                                                               if entry[0] != old}
+        assert two.packs.get(one.cached_file_name('kw0', 'google', 'http', 1)).compression == 'bz2'
+
+        # nothing newer to import the second time
+        assert import_cache(two, self.archive)['skipped'] == 5
+
+    def test_pages_of_some_jobs_are_exported(self):
+        one = self.host('one')
+        self.fill(one)
+        jobs = default_scrape_jobs_for_keywords(['kw1', 'kw3', 'missing'], ['google', 'bing'], 'http', 2)
+
+        assert export_cache(one, self.archive, jobs=jobs) == 2
+
+        with tarfile.open(self.archive) as tar:
+            assert sorted(member.pax_headers['GoogleScraper.query'] for member in tar) == ['kw1', 'kw3']
+
+        two = self.host('two')
+        import_cache(two, self.archive)
+        assert [keyword for keyword in self.keywords if self.html(two, keyword)] == ['kw1', 'kw3']
+
+    def test_export_streams_the_entries_of_the_backends(self):
+        one = self.host('one', cache_backend='pack')
+        self.fill(one)
+        # cached in the pack and as file, exported once
+        one.files.put(one.cached_file_name('kw0', 'google', 'http', 1), b'<html>file</html>')
+        one.files.put(one.cached_file_name('file', 'google', 'http', 1), b'<html>file</html>')
+
+        assert export_cache(one, self.archive) == 6
+        two = self.host('two')
+        import_cache(two, self.archive)
+        assert self.html(two, 'kw0') == '<html>kw0</html>'
+        assert self.html(two, 'file') == '<html>file</html>'
+
+        entries = sorted(one.packs.connection().execute('SELECT name, length, mtime FROM entries'))
+        assert list(iter_rows(one.packs.lock, one.packs.connection,
+                              'SELECT name, length, mtime FROM entries WHERE name > ?', chunk_size=2)) == entries
+
+    def test_damaged_pages_are_skipped(self):
+        one = self.host('one')
+        self.fill(one)
+        export_cache(one, self.archive)
+
+        # change a page, rename one and add a page without hash
+        damaged = os.path.join(self.tmpdir, 'damaged.tar')
+        with tarfile.open(self.archive) as source, tarfile.open(damaged, 'w', format=tarfile.PAX_FORMAT) as tar:
+            for i, member in enumerate(source):
+                data = source.extractfile(member).read()
+                if i == 0:
+                    data = data.replace(b'kw', b'KW')
+                elif i == 1:
+                    member.name = '../' + member.name
+                tar.addfile(member, io.BytesIO(data))
+            tar.addfile(tarfile.TarInfo('a' * 64 + '.cache'), io.BytesIO(b''))
+
+        two = self.host('two')
+        assert import_cache(two, damaged) == {'imported': 3, 'skipped': 0, 'damaged': 3}
+        assert len(two.cache_entries()) == 3
+
+
+class DedupBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.config = {'do_caching': True, 'cachedir': self.cachedir, 'compress_cached_files': True,
+                       'compressing_algorithm': 'gz', 'cache_backend': 'dedup'}
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def blobs(self):
+        return [fname for dirpath, dirnames, filenames in os.walk(os.path.join(self.cachedir, 'blobs'))
+                for fname in filenames if not fname.startswith('blobs.sqlite')]
+
+    def test_identical_pages_are_stored_once(self):
+        cache_manager = CacheManager(self.config)
+        empty = '<html>no results</html>' * 20
+        for method in ('http', 'selenium', 'http-async'):
+            cache_manager.cache_results(FakeParser(empty), 'one', 'google', method, 1)
+        cache_manager.cache_results(FakeParser(empty), 'two', 'bing', 'http', 1)
+        cache_manager.cache_results(FakeParser('<html>two</html>'), 'two', 'google', 'http', 1)
+
+        assert len(self.blobs()) == 2
+        assert cache_manager.get_cached('one', 'google', 'selenium', 1) == empty
+        assert cache_manager.get_cached('two', 'google', 'http', 1) == '<html>two</html>'
+
+        report = cache_manager.dedup_report()
+        assert report['pages'] == 5 and report['blobs'] == 2
+        assert report['saved_bytes'] == report['page_bytes'] - report['blob_bytes'] > 0
+        assert CacheManager(dict(self.config, cache_backend='files')).dedup_report() is None
+
+    def test_blobs_are_removed_with_their_last_reference(self):
+        cache_manager = CacheManager(self.config)
+        for keyword in ('one', 'two'):
+            cache_manager.cache_results(FakeParser('<html>same</html>'), keyword, 'google', 'http', 1)
+        names = [cache_manager.cached_file_name(keyword, 'google', 'http', 1) for keyword in ('one', 'two')]
+
+        cache_manager.evict(names[:1])
+        assert cache_manager.get_cached('two', 'google', 'http', 1) == '<html>same</html>'
+        assert len(self.blobs()) == 1
+
+        # caching another page under the name releases the old blob
+        cache_manager.cache_results(FakeParser('<html>new</html>'), 'two', 'google', 'http', 1)
+        assert cache_manager.get_cached('two', 'google', 'http', 1) == '<html>new</html>'
+        assert len(self.blobs()) == 1
+
+        cache_manager.evict(names[1:])
+        assert self.blobs() == [] and cache_manager.cache_entries() == []
+
+    def test_cache_files_are_deduplicated_when_migrated(self):
+        files = CacheManager(dict(self.config, cache_backend='files'))
+        for keyword in ('one', 'two', 'three'):
+            files.cache_results(FakeParser('<html>same</html>'), keyword, 'google', 'http', 1)
+
+        cache_manager = CacheManager(self.config)
+        assert cache_manager.migrate_cache_layout() == 3
+        assert len(self.blobs()) == 1
+        assert cache_manager.get_cached('three', 'google', 'http', 1) == '<html>same</html>'
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
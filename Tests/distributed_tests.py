@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for running one scrape with a coordinator and several workers.
+
+python -m pytest Tests/distributed_tests.py
+"""
+
+import os
+import shutil
+import datetime
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.config import get_config
+from GoogleScraper.database import ScraperSearch, get_session
+from GoogleScraper.distributed import Coordinator, DistributedWorker, send_message
+from GoogleScraper.output_converter import init_outfile
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+
+def run_worker(config, address):
+    DistributedWorker(config, [None], address=address).run()
+
+
+class CoordinatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = {'lease_size': 2, 'lease_timeout': 10, 'print_results': '', 'output_filename': ''}
+        init_outfile(self.config, force_reload=True)
+        self.session = get_session(self.config, path=os.path.join(self.tmpdir, 'test.db'))()
+        self.scraper_search = ScraperSearch()
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmpdir)
+
+    def coordinator(self, keywords, pages=1):
+        jobs = default_scrape_jobs_for_keywords(keywords, ['google'], 'http', pages)
+        return Coordinator(self.config, jobs, session=self.session, scraper_search=self.scraper_search,
+                           address=('localhost', 0))
+
+    def serps_for(self, jobs):
+        return [{'query': job['query'], 'search_engine_name': job['search_engine'], 'scrape_method': job['scrape_method'],
+                 'page_number': job['page_number'], 'requested_at': '2026-01-01T12:00:00', 'links': []}
+                for job in jobs]
+
+    def test_pages_of_a_keyword_stay_in_one_lease(self):
+        coordinator = self.coordinator(['one', 'two'], pages=3)
+
+        answer = coordinator.handle_message({'op': 'lease', 'worker': 'a'})
+        assert [(job['query'], job['page_number']) for job in answer['jobs']] == [('one', 1), ('one', 2), ('one', 3)]
+
+    def test_expired_lease_is_handed_out_again(self):
+        coordinator = self.coordinator(['one', 'two', 'three'])
+        clock = [0]
+        coordinator.now = lambda: clock[0]
+
+        first = coordinator.handle_message({'op': 'lease', 'worker': 'a'})
+        assert coordinator.handle_message({'op': 'renew', 'lease': first['lease']})['status'] == 'ok'
+
+        clock[0] = 11
+        second = coordinator.handle_message({'op': 'lease', 'worker': 'b'})
+        assert second['jobs'] == first['jobs']
+        assert coordinator.num_reissued == 1
+        assert coordinator.handle_message({'op': 'renew', 'lease': first['lease']})['status'] == 'expired'
+
+        # the late worker still delivers, the second delivery is a duplicate
+        answer = coordinator.handle_message({'op': 'complete', 'lease': first['lease'], 'serps': self.serps_for(first['jobs'])})
+        assert answer['accepted'] == 2
+        answer = coordinator.handle_message({'op': 'complete', 'lease': second['lease'], 'serps': self.serps_for(second['jobs'])})
+        assert answer['accepted'] == 0 and coordinator.num_duplicates == 2
+
+        third = coordinator.handle_message({'op': 'lease', 'worker': 'b'})
+        assert [job['query'] for job in third['jobs']] == ['three']
+        assert coordinator.handle_message({'op': 'lease', 'worker': 'a'})['status'] == 'wait'
+
+        coordinator.handle_message({'op': 'complete', 'lease': third['lease'], 'serps': self.serps_for(third['jobs'])})
+        assert coordinator.handle_message({'op': 'lease', 'worker': 'a'})['status'] == 'done'
+        assert coordinator.finished()
+        assert sorted(serp.query for serp in self.scraper_search.serps) == ['one', 'three', 'two']
+
+    def test_every_message_is_answered(self):
+        deadline = datetime.datetime(2026, 1, 1, 12)
+        jobs = [dict(job, deadline=deadline) for job in default_scrape_jobs_for_keywords(['one'], ['google'], 'http', 1)]
+        coordinator = Coordinator(self.config, jobs, session=self.session, scraper_search=self.scraper_search,
+                                  address=('localhost', 0))
+        coordinator.start()
+
+        def serve(messages):
+            thread = threading.Thread(target=lambda: [coordinator.server.handle_request() for m in messages])
+            thread.start()
+            answers = [send_message(coordinator.address, message) for message in messages]
+            thread.join()
+            return answers
+
+        try:
+            lease, broken, unknown = serve([{'op': 'lease', 'worker': 'a'},
+                                            {'op': 'complete', 'lease': 0, 'serps': [{'query': 'one'}]},
+                                            {'op': 'fly'}])
+        finally:
+            coordinator.server.server_close()
+
+        assert lease['status'] == 'lease' and lease['jobs'][0]['deadline'] == deadline.timestamp()
+        assert broken['status'] == 'error' and 'KeyError' in broken['message']
+        assert unknown['status'] == 'error'
+
+        # the rejected delivery neither completes the lease nor stores a SERP
+        assert 0 in coordinator.leases and not coordinator.completed
+        assert not self.scraper_search.serps
+
+    def test_worker_delivers_the_serps_again_without_answer(self):
+        coordinator = self.coordinator(['one'])
+        lease = coordinator.handle_message({'op': 'lease', 'worker': 'a'})
+        messages = []
+
+        def send(message):
+            messages.append(message)
+            if len(messages) == 1:
+                raise ConnectionAbortedError('The coordinator closed the connection without an answer.')
+            return coordinator.handle_message(message)
+
+        worker = DistributedWorker(self.config, [None], address=('localhost', 0))
+        worker.send = send
+        answer = worker.complete(lease['lease'], self.serps_for(lease['jobs']))
+
+        assert len(messages) == 2
+        assert answer == {'status': 'ok', 'accepted': 1}
+        assert coordinator.finished()
+
+    def test_scrape_with_local_worker_processes(self):
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(cachedir)
+        cache_manager = CacheManager({'do_caching': True, 'cachedir': cachedir})
+        html = open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')).read()
+
+        keywords = ['kw{}'.format(i) for i in range(7)]
+        for keyword in keywords:
+            with open(os.path.join(cachedir, cache_manager.cached_file_name(keyword, 'google', 'http', 1)), 'w') as fd:
+                fd.write(html)
+
+        coordinator = self.coordinator(keywords)
+        coordinator.start()
+
+        worker_config = dict(get_config(), do_caching=True, cachedir=cachedir, num_workers=1, print_results='')
+        # forked workers would inherit the listening socket of the coordinator
+        context = multiprocessing.get_context('spawn')
+        workers = [context.Process(target=run_worker, args=(worker_config, coordinator.address), daemon=True)
+                   for i in range(2)]
+        for worker in workers:
+            worker.start()
+
+        thread = threading.Thread(target=coordinator.run, daemon=True)
+        thread.start()
+        thread.join(60)
+        for worker in workers:
+            worker.join(10)
+
+        assert not thread.is_alive()
+        assert all(worker.exitcode == 0 for worker in workers)
+        assert sorted(serp.query for serp in self.scraper_search.serps) == keywords
+        assert all(len(serp.links) > 0 for serp in self.scraper_search.serps)
+
+    def test_pages_from_the_cache_of_a_worker_are_not_dropped(self):
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        os.mkdir(cachedir)
+        cache_manager = CacheManager({'do_caching': True, 'cachedir': cachedir})
+        html = open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')).read()
+
+        keywords = ['one', 'two']
+        for keyword in keywords:
+            for page in (1, 2, 3):
+                cache_manager.backend.put(cache_manager.cached_file_name(keyword, 'google', 'http', page), html.encode())
+
+        coordinator = self.coordinator(keywords, pages=3)
+        coordinator.start()
+
+        worker_config = dict(get_config(), do_caching=True, cachedir=cachedir, num_workers=1, print_results='')
+        worker = threading.Thread(target=run_worker, args=(worker_config, coordinator.address), daemon=True)
+        worker.start()
+        coordinator.run()
+        worker.join(10)
+
+        assert coordinator.num_duplicates == 0
+        assert sorted((serp.query, serp.page_number) for serp in self.scraper_search.serps) == \
+            [(keyword, page) for keyword in keywords for page in (1, 2, 3)]
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
+import tempfile
 import unittest
 from GoogleScraper import scrape_with_config
 from GoogleScraper.parsing import get_parser_by_search_engine
@@ -16,10 +18,16 @@ all_search_engines = config.get('supported_search_engines')
 
 class GoogleScraperIntegrationTestCase(unittest.TestCase):
     def setUp(self):
-        pass
+        self.tmpdir = tempfile.mkdtemp()
 
     def tearDown(self):
-        pass
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def fixture_cachedir(self, name):
+        """Copy a fixture cache, the scrapes write their index and journals into the cache directory."""
+        cachedir = os.path.join(self.tmpdir, name)
+        shutil.copytree(os.path.join(base, 'data', name), cachedir)
+        return cachedir
 
     ### Test (very) static parsing for all search engines. The html files are saved in 'data/uncompressed_serp_pages/'
     # The sample files may become old and the SERP format may change over time. But this is the only
@@ -163,7 +171,7 @@ class GoogleScraperIntegrationTestCase(unittest.TestCase):
             'search_engines': all_search_engines,
             'num_pages_for_keyword': 2,
             'scrape_method': 'selenium',
-            'cachedir': os.path.join(base, 'data/csv_tests/'),
+            'cachedir': self.fixture_cachedir('csv_tests'),
             'do_caching': True,
             'verbosity': 0,
             'output_filename': csv_outfile,
@@ -208,7 +216,7 @@ class GoogleScraperIntegrationTestCase(unittest.TestCase):
             'search_engines': all_search_engines,
             'num_pages_for_keyword': 2,
             'scrape_method': 'selenium',
-            'cachedir': os.path.join(base, 'data/json_tests/'),
+            'cachedir': self.fixture_cachedir('json_tests'),
             'do_caching': True,
             'verbosity': 0,
             'output_filename': json_outfile
@@ -300,7 +308,7 @@ class GoogleScraperIntegrationTestCase(unittest.TestCase):
             'search_engines': all_search_engines,
             'num_pages_for_keyword': 1,
             'scrape_method': 'selenium',
-            'cachedir': os.path.join(base, 'data/no_results/'),
+            'cachedir': self.fixture_cachedir('no_results'),
             'do_caching': True,
             'verbosity': 1,
         }
@@ -320,9 +328,9 @@ class GoogleScraperIntegrationTestCase(unittest.TestCase):
                                                                                                  serp.links)
 
             # some search engine do alternative searches instead of yielding
-            # nothing at all.
+            # nothing at all. The google page of the fixture has no alternative search.
 
-            if serp.search_engine_name in ('google', 'bing'):
+            if serp.search_engine_name in ('bing',):
                 assert serp.effective_query, '{} must have an effective query when a keyword has no results.'.format(
                     serp.search_engine_name)
 
@@ -351,7 +359,7 @@ class GoogleScraperIntegrationTestCase(unittest.TestCase):
             'search_engines': all_search_engines,
             'num_pages_for_keyword': 2,
             'scrape_method': 'selenium',
-            'cachedir': os.path.join(base, 'data/csv_tests/'),
+            'cachedir': self.fixture_cachedir('csv_tests'),
             'do_caching': True,
             'verbosity': 0,
             'output_filename': csv_outfile_1,
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the journal of completed scrape jobs.
+
+python -m pytest Tests/journal_tests.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import GoogleScraper.scrape_config
+from GoogleScraper import scrape_with_config
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.database import ScraperSearch, SearchEngineResultsPage
+from GoogleScraper.journal import CompletionJournal, skip_completed_jobs, init_journal, close_journal, journal_path, \
+    record_job
+from GoogleScraper.output_converter import init_outfile, store_serp_result
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # scrape_with_config() sets the options on the global configuration
+        self.scrape_config = dict(vars(GoogleScraper.scrape_config))
+        self.path = os.path.join(self.tmpdir, '1.journal')
+
+    def tearDown(self):
+        members = vars(GoogleScraper.scrape_config)
+        for name in set(members) - set(self.scrape_config):
+            del members[name]
+        members.update(self.scrape_config)
+        shutil.rmtree(self.tmpdir)
+
+    def test_completed_jobs_are_skipped(self):
+        jobs = list(default_scrape_jobs_for_keywords(['a', 'b', 'c'], ['google', 'bing'], 'http', 2))
+
+        journal = CompletionJournal(self.path)
+        assert journal.load() == set()
+        journal.record('a', 'google', 'http', 1)
+        journal.record('b', 'bing', 'http', 2)
+        journal.close()
+
+        completed = CompletionJournal(self.path).load()
+        remaining = list(skip_completed_jobs(jobs, completed))
+
+        assert len(remaining) == len(jobs) - 2
+        assert {'query': 'a', 'search_engine': 'google', 'scrape_method': 'http', 'page_number': 1} not in remaining
+        assert {'query': 'a', 'search_engine': 'google', 'scrape_method': 'http', 'page_number': 2} in remaining
+
+    def test_torn_record_is_ignored(self):
+        journal = CompletionJournal(self.path)
+        journal.record('a', 'google', 'http', 1)
+        journal.close()
+
+        with open(self.path, 'ab') as fd:
+            fd.write(b'\x01\x02\x03')
+
+        assert CompletionJournal(self.path).load() == {CompletionJournal.key('a', 'google', 'http', 1)}
+
+        # the torn record is dropped before appending
+        journal = CompletionJournal(self.path)
+        journal.record('b', 'google', 'http', 1)
+        journal.close()
+        assert CompletionJournal(self.path).load() == {CompletionJournal.key('a', 'google', 'http', 1),
+                                                       CompletionJournal.key('b', 'google', 'http', 1)}
+
+    def test_only_successful_requests_are_journaled(self):
+        config = {'journal_dir': self.tmpdir, 'output_filename': '', 'print_results': ''}
+        init_outfile(config, force_reload=True)
+        init_journal(config, ScraperSearch(id=1))
+        try:
+            for query, num_results, outcome in (('a', 10, None), ('b', 10, 'blocked'), ('c', 0, None)):
+                serp = SearchEngineResultsPage(query=query, search_engine_name='google', scrape_method='http',
+                                               page_number=1, num_results=num_results)
+                store_serp_result(serp, config, outcome=outcome)
+        finally:
+            close_journal()
+
+        path = journal_path(config, ScraperSearch(id=1))
+        assert CompletionJournal(path).load() == {CompletionJournal.key('a', 'google', 'http', 1)}
+
+    def test_journals_are_kept_in_the_cache_directory(self):
+        config = {'cachedir': self.tmpdir}
+        init_journal(config, ScraperSearch(id=1))
+        close_journal()
+        assert os.path.isdir(os.path.join(self.tmpdir, 'journal'))
+
+    def test_journals_of_different_databases_are_apart(self):
+        one = {'journal_dir': self.tmpdir, 'database_name': os.path.join(self.tmpdir, 'one')}
+        two = dict(one, database_name=os.path.join(self.tmpdir, 'two'))
+        assert journal_path(one, ScraperSearch(id=1)) != journal_path(two, ScraperSearch(id=1))
+
+        # a new ScraperSearch does not inherit the journal of a deleted database
+        init_journal(one, ScraperSearch(id=1))
+        record_job({'query': 'a', 'search_engine': 'google', 'scrape_method': 'http', 'page_number': 1})
+        init_journal(one, ScraperSearch(id=1), new=True)
+        close_journal()
+        assert CompletionJournal(journal_path(one, ScraperSearch(id=1))).load() == set()
+
+    def test_continued_scrape_skips_completed_jobs(self):
+        cachedir = os.path.join(self.tmpdir, 'cache')
+        os.makedirs(cachedir)
+        cache_manager = CacheManager({'do_caching': True, 'cachedir': cachedir})
+        html = open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')).read()
+
+        keywords = ['kw{}'.format(i) for i in range(4)]
+        for keyword in keywords:
+            with open(os.path.join(cachedir, cache_manager.cached_file_name(keyword, 'google', 'http', 1)), 'w') as fd:
+                fd.write(html)
+
+        keyword_file = os.path.join(self.tmpdir, 'keywords.txt')
+        with open(keyword_file, 'w') as fd:
+            fd.write('\n'.join(keywords))
+
+        config = {
+            'keyword': '',
+            'keyword_file': keyword_file,
+            'search_engines': ['google'],
+            'scrape_method': 'http',
+            'do_caching': True,
+            'cachedir': cachedir,
+            'continue_last_scrape': True,
+            'journal_dir': os.path.join(self.tmpdir, 'journal'),
+            'database_name': os.path.join(self.tmpdir, 'test'),
+            'output_filename': '',
+            'print_results': '',
+            'use_own_ip': True,
+        }
+
+        first = scrape_with_config(config)
+        assert len(first.serps) == len(keywords)
+        first_id = first.id
+
+        # without the cache, the jobs could only be scraped over the network
+        shutil.rmtree(cachedir)
+        os.makedirs(cachedir)
+
+        second = scrape_with_config(config)
+        assert second.id == first_id
+        assert len(second.serps) == len(keywords)
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
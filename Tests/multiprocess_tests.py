@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for sharding a scrape across several processes.
+
+python -m pytest Tests/multiprocess_tests.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import GoogleScraper.scrape_config
+from GoogleScraper import scrape_with_config
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.multiprocess_mode import shard_scrape_jobs, serp_to_dict, serp_from_dict
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+
+class MultiprocessTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        # scrape_with_config() sets the options on the global configuration
+        self.scrape_config = dict(vars(GoogleScraper.scrape_config))
+
+    def tearDown(self):
+        members = vars(GoogleScraper.scrape_config)
+        for name in set(members) - set(self.scrape_config):
+            del members[name]
+        members.update(self.scrape_config)
+        shutil.rmtree(self.tmpdir)
+
+    def test_jobs_of_a_keyword_stay_in_one_shard(self):
+        keywords = ['kw{}'.format(i) for i in range(10)]
+        jobs = list(default_scrape_jobs_for_keywords(keywords, ['google', 'bing'], 'http', 3))
+
+        shards = shard_scrape_jobs(jobs, 3)
+
+        assert sorted(map(len, shards)) == [18, 18, 24]
+        for i, shard in enumerate(shards):
+            for other in shards[i + 1:]:
+                assert not {job['query'] for job in shard} & {job['query'] for job in other}
+
+    def test_cached_scrape_in_two_processes(self):
+        cache_manager = CacheManager({'do_caching': True, 'cachedir': self.tmpdir})
+        html = open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')).read()
+
+        keywords = ['kw{}'.format(i) for i in range(6)]
+        for keyword in keywords:
+            with open(os.path.join(self.tmpdir, cache_manager.cached_file_name(keyword, 'google', 'http', 1)), 'w') as fd:
+                fd.write(html)
+
+        search = scrape_with_config({
+            'keyword': '',
+            'keyword_file': '',
+            'keywords': keywords,
+            'search_engines': ['google'],
+            'scrape_method': 'http',
+            'do_caching': True,
+            'cachedir': self.tmpdir,
+            'num_processes': 2,
+            'database_name': os.path.join(self.tmpdir, 'test'),
+            'output_filename': '',
+            'print_results': '',
+            'use_own_ip': True,
+        })
+
+        assert sorted(serp.query for serp in search.serps) == keywords
+        for serp in search.serps:
+            assert serp.id is not None
+            assert len(serp.links) > 0
+
+        copy = serp_from_dict(serp_to_dict(search.serps[0]))
+        assert copy.query == search.serps[0].query
+        assert len(copy.links) == len(search.serps[0].links)
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
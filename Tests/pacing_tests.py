@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the pacing of the requests to the search engines.
+
+python -m pytest Tests/pacing_tests.py
+"""
+
+import threading
+import unittest
+from GoogleScraper.pacing import PacingScheduler, SleepingDistribution
+
+
+class PacingTestCase(unittest.TestCase):
+
+    def scheduler(self, **config):
+        config.setdefault('sleeping_ranges', {100: (2, 3)})
+        scheduler = PacingScheduler(config)
+        self.clock = [100.0]
+        scheduler.now = lambda: self.clock[0]
+        return scheduler
+
+    def test_sleeping_ranges_must_sum_up_to_100(self):
+        with self.assertRaises(AssertionError):
+            SleepingDistribution({50: (1, 2), 20: (2, 3)})
+
+        distribution = SleepingDistribution({70: (1, 3), 30: (5, 6)})
+        assert all(distribution.sample() in (1, 2, 5) for i in range(100))
+
+    def test_requests_of_a_proxy_are_spaced(self):
+        scheduler = self.scheduler()
+
+        assert scheduler.reserve('google', 'proxy1') == 102
+        assert scheduler.reserve('google', 'proxy1') == 104
+
+        # other proxies and search engines have their own pace
+        assert scheduler.reserve('google', 'proxy2') == 102
+        assert scheduler.reserve('bing', 'proxy1') == 102
+
+        # the delay is counted from the last request, not from now
+        self.clock[0] = 110
+        assert scheduler.reserve('google', 'proxy1') == 110
+
+    def test_search_engine_specific_and_fixed_sleeping_ranges(self):
+        scheduler = self.scheduler(bing_sleeping_ranges={100: (7, 8)}, fixed_sleeping_ranges={1: (100, 101)})
+
+        assert scheduler.reserve('bing') == 107
+        assert scheduler.reserve('bing') == 107 + 7 + 100
+        assert scheduler.reserve('google') == 102
+
+    def test_no_delay_without_sleeping(self):
+        scheduler = self.scheduler(do_sleep=False)
+
+        assert scheduler.reserve('google') == 100
+        assert scheduler.reserve('google') == 100
+        assert not scheduler.states
+
+    def test_timer_thread_wakes_in_order_of_eligibility(self):
+        scheduler = PacingScheduler({'sleeping_ranges': {100: (2, 3)}})
+        woken = []
+        done = threading.Event()
+
+        now = scheduler.now()
+        scheduler.call_at(now + 0.2, lambda: (woken.append('late'), done.set()))
+        scheduler.call_at(now + 0.1, lambda: woken.append('early'))
+
+        assert done.wait(5)
+        assert woken == ['early', 'late']
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
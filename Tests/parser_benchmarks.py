@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Throughput and memory of the SERP parsers on the pages in Tests/data.
+
+Every SERP page under Tests/data, the html files as well as the compressed
+cache files, is parsed with the parser of its search engine. Per parser the
+suite reports the pages per second, the microseconds per parsed result and
+the peak memory that parsing the pages takes.
+
+Run the suite:
+
+python Tests/parser_benchmarks.py
+
+Save the results of a base revision and check a change against them. The
+check fails with exit status 1 when a parser got slower than the threshold:
+
+python Tests/parser_benchmarks.py --save /tmp/parsers.json
+python Tests/parser_benchmarks.py --check /tmp/parsers.json --threshold 0.2
+
+Measure the parsers as used for rank tracking, which only parse the link and
+rank of the organic results:
+
+python Tests/parser_benchmarks.py --link-only
+
+The throughput depends on the machine, so compare runs on the same machine.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.compression import ALGORITHMS, decompress
+from GoogleScraper.parsing import get_parser_by_search_engine
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+search_engines = ['google', 'bing', 'yandex', 'yahoo', 'baidu', 'duckduckgo', 'ask']
+
+# the configuration of the parsers with --link-only
+link_only = {'parse_result_types': ['results'], 'parse_result_fields': ['link']}
+
+# the cached pages in Tests/data/csv_tests and Tests/data/json_tests were scraped for this keyword
+fixture_keyword = 'some words'
+
+
+def search_engine_of(path, html):
+    """Returns the search engine a fixture page was scraped from.
+
+    Named pages carry the search engine in their file name. The cache files of the
+    integration tests are named by their scrape job, the search engine of the others
+    is the one whose domain the page mentions most.
+    """
+    fname = os.path.basename(path)
+    for search_engine in search_engines:
+        if search_engine in fname:
+            return search_engine
+
+    cache_manager = CacheManager({'do_caching': False})
+    name = fname.split('.cache')[0] + '.cache'
+    for search_engine in search_engines:
+        for scrape_method in ('selenium', 'http'):
+            for page_number in (1, 2):
+                if cache_manager.cached_file_name(fixture_keyword, search_engine, scrape_method, page_number) == name:
+                    return search_engine
+
+    return max(search_engines, key=lambda search_engine: html.count(search_engine + '.'))
+
+
+def load_fixtures():
+    """Returns a dictionary of the search engines to the (path, html) of their pages in Tests/data."""
+    fixtures = {search_engine: [] for search_engine in search_engines}
+    for dirpath, dirnames, filenames in sorted(os.walk(os.path.join(base, 'data'))):
+        for fname in sorted(filenames):
+            path = os.path.join(dirpath, fname)
+            extension = fname.rsplit('.', 1)[-1]
+            if extension in ('html', 'cache'):
+                with open(path, 'rb') as fd:
+                    data = fd.read()
+            elif extension in ALGORITHMS and '.cache.' in fname:
+                with open(path, 'rb') as fd:
+                    data = decompress(fd.read(), extension)
+            else:
+                continue
+            html = data.decode('utf-8', errors='replace')
+            fixtures[search_engine_of(path, html)].append((os.path.relpath(path, base), html))
+    return fixtures
+
+
+def peak_rss():
+    """Returns the peak resident memory of this process in bytes or None if it is unknown."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def measure(search_engine, pages, rounds=5, min_time=0.2, config=None):
+    """Time the parser of a search engine on its pages.
+
+    The pages are parsed again until a round took min_time seconds, the fastest of
+    the rounds counts. Meant to run in a process of its own, so that the growth of
+    its peak memory is the memory that parsing takes. The parsers get the config.
+
+    Returns:
+        A dictionary with the number of pages and results, the pages per second,
+        the microseconds per result and the peak memory in bytes.
+    """
+    parser_class = get_parser_by_search_engine(search_engine)
+    config = config or {}
+    memory_before = peak_rss()
+    # the first parse compiles the selectors
+    num_results = sum(parser_class(config, html=html).num_results for path, html in pages)
+
+    best = float('inf')
+    for i in range(rounds):
+        num_parsed = 0
+        started = time.perf_counter()
+        while True:
+            for path, html in pages:
+                parser_class(config, html=html)
+            num_parsed += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / num_parsed)
+
+    memory_after = peak_rss()
+    return {
+        'parser': parser_class.__name__,
+        'pages': len(pages),
+        'results': num_results,
+        'pages_per_second': len(pages) / best,
+        'us_per_result': best / num_results * 1e6 if num_results else None,
+        'peak_memory': memory_after - memory_before if memory_before is not None else None,
+    }
+
+
+def run_suite(engines=None, rounds=5, min_time=0.2, config=None):
+    """Measure the parsers of some search engines, each in a fresh process.
+
+    Returns:
+        A dictionary of the search engines to the results of measure().
+    """
+    fixtures = load_fixtures()
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+
+    results = {}
+    for search_engine in engines or search_engines:
+        if not fixtures[search_engine]:
+            continue
+        with context.Pool(1) as pool:
+            args = (search_engine, fixtures[search_engine], rounds, min_time, config)
+            results[search_engine] = pool.apply(measure, args)
+    return results
+
+
+def regressions(results, baseline, threshold=0.2):
+    """Returns the (search engine, pages per second, baseline pages per second) of the parsers that are
+    more than threshold slower than in the baseline. Search engines missing in the baseline are ignored.
+    """
+    slower = []
+    for search_engine, stats in sorted(results.items()):
+        if search_engine in baseline:
+            before = baseline[search_engine]['pages_per_second']
+            if stats['pages_per_second'] < before * (1 - threshold):
+                slower.append((search_engine, stats['pages_per_second'], before))
+    return slower
+
+
+def print_results(results, baseline=None):
+    print('{:>12} {:>18} {:>6} {:>8} {:>10} {:>10} {:>12} {:>9}'.format(
+        'engine', 'parser', 'pages', 'results', 'pages/s', 'us/result', 'peak [KiB]', 'change'))
+    for search_engine, stats in sorted(results.items()):
+        change = ''
+        if baseline and search_engine in baseline:
+            change = '{:+.1%}'.format(stats['pages_per_second'] / baseline[search_engine]['pages_per_second'] - 1)
+        print('{:>12} {:>18} {:>6} {:>8} {:>10.1f} {:>10} {:>12} {:>9}'.format(
+            search_engine, stats['parser'], stats['pages'], stats['results'], stats['pages_per_second'],
+            '{:.1f}'.format(stats['us_per_result']) if stats['us_per_result'] is not None else '-',
+            stats['peak_memory'] // 1024 if stats['peak_memory'] is not None else '-', change))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the SERP parsers on the pages in Tests/data.')
+    parser.add_argument('engines', nargs='*', metavar='engine',
+                        help='The search engines whose parsers to measure: {}. All by default.'.format(
+                            ', '.join(search_engines)))
+    parser.add_argument('--rounds', type=int, default=5, help='How often to time each parser, the best round '
+                                                              'counts.')
+    parser.add_argument('--min-time', type=float, default=0.2, help='The minimal seconds of a round.')
+    parser.add_argument('--link-only', action='store_true', help='Only parse the link and rank of the organic '
+                                                                 'results.')
+    parser.add_argument('--save', metavar='FILE', help='Save the results as json.')
+    parser.add_argument('--check', metavar='FILE', help='Compare to results saved with --save and fail when a '
+                                                        'parser is slower by more than the threshold.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='The tolerated loss of throughput, '
+                                                                     '0.2 is 20%%.')
+    args = parser.parse_args(args)
+    for search_engine in args.engines:
+        if search_engine not in search_engines:
+            parser.error('No parser for search engine {}'.format(search_engine))
+
+    baseline = None
+    if args.check:
+        with open(args.check) as fd:
+            baseline = json.load(fd)
+
+    results = run_suite(args.engines, rounds=args.rounds, min_time=args.min_time,
+                        config=link_only if args.link_only else None)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        slower = regressions(results, baseline, args.threshold)
+        for search_engine, pages_per_second, before in slower:
+            print('REGRESSION: {} parses {:.1f} pages/s, {:.1f} before.'.format(
+                search_engine, pages_per_second, before))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
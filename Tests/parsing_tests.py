@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the parsers of the SERP pages.
+
+python -m pytest Tests/parsing_tests.py
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import lxml.html
+import parser_benchmarks
+from GoogleScraper.parsing import compile_selector, compile_css, get_parser_by_search_engine, parser_version
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+
+class CompiledSelectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dom = lxml.html.document_fromstring(
+            '<div id="main"><div class="g"><a href="/one">One <b>1</b></a><a href="/two">Two</a></div>'
+            '<div class="g"><a>Three</a></div></div>')
+
+    def test_pseudo_elements(self):
+        first, second = compile_css('#main .g')(self.dom)
+        assert compile_selector('a::text')(first) == 'One 1'
+        assert compile_selector('a')(first) == 'One 1'
+        assert compile_selector('a::attr(href)')(first) == '/one'
+        assert compile_selector('a::attr(href)')(second) is None
+        assert compile_selector('span::text')(second) is None
+        assert compile_selector('span, a:last-child::attr(href)')(first) == '/two'
+
+    def test_selectors_are_compiled_once(self):
+        assert compile_selector('.g a::text') is compile_selector('.g a::text')
+        assert compile_css('.g') is compile_css('.g')
+
+    def test_parsers_use_the_compiled_selectors(self):
+        pages_dir = os.path.join(base, 'data/uncompressed_serp_pages/')
+        with open(os.path.join(pages_dir, 'abrakadabra_google_de_ip.html')) as fd:
+            parser = get_parser_by_search_engine('google')({}, html=fd.read())
+        assert parser.num_results == 15
+        assert parser.search_results['results'][3]['link'] == 'http://www.youtube.com/watch?v=4BKtw5NEYkg'
+
+
+
+class SelectiveParsingTestCase(unittest.TestCase):
+
+    def parse(self, search_engine, fname, config={}, **kwargs):
+        with open(os.path.join(base, 'data/uncompressed_serp_pages/', fname)) as fd:
+            return get_parser_by_search_engine(search_engine)(config, html=fd.read(), **kwargs)
+
+    def test_only_the_configured_results_and_fields_are_parsed(self):
+        full = self.parse('google', 'abrakadabra_google_de_ip.html')
+        parser = self.parse('google', 'abrakadabra_google_de_ip.html',
+                            {'parse_result_types': 'results', 'parse_result_fields': 'link'})
+        assert list(parser.search_results.keys()) == ['results']
+        assert parser.num_results == 15
+        assert parser.search_results['results'] == [{'link': result['link'], 'rank': result['rank']}
+                                                    for result in full.search_results['results']]
+
+    def test_the_arguments_override_the_config(self):
+        parser = self.parse('google', 'abrakadabra_google_de_ip.html', {'parse_result_types': ['ads_main']},
+                            result_types=['results'], result_fields=['title'])
+        assert list(parser.search_results.keys()) == ['results']
+        assert set(parser.search_results['results'][3]) == {'link', 'title', 'rank'}
+
+    def test_the_fields_after_parsing_needs_are_parsed(self):
+        full = self.parse('yahoo', 'snow_yahoo_de_ip.html')
+        parser = self.parse('yahoo', 'snow_yahoo_de_ip.html', result_fields=['link'])
+        assert parser.result_fields == ('link', 'visible_link')
+        assert [result['link'] for result in parser.search_results['results']] == \
+            [result['link'] for result in full.search_results['results']]
+
+    def test_the_parser_version_depends_on_the_selection(self):
+        parser_class = get_parser_by_search_engine('google')
+        assert parser_version(parser_class, 'normal', (), ()) == parser_version(parser_class, 'normal')
+        assert parser_version(parser_class, 'normal', ('results',), ('link',)) != parser_version(parser_class)
+        assert parser_version(parser_class, 'normal', (), ('link',)) == \
+            parser_version(parser_class, 'normal', (), ('link',) + parser_class.required_fields)
+
+
+class ParserBenchmarkTestCase(unittest.TestCase):
+
+    def test_fixtures_are_assigned_to_their_search_engines(self):
+        fixtures = parser_benchmarks.load_fixtures()
+        assert all(fixtures[search_engine] for search_engine in parser_benchmarks.search_engines)
+        paths = {path: search_engine for search_engine, pages in fixtures.items() for path, html in pages}
+        assert paths['data/uncompressed_serp_pages/hello_bing_de_ip.html'] == 'bing'
+        assert paths['data/csv_tests/9079e67314b280f0050f0f9b241e523e5c8dcc74c046ba36ae306d92724e099d.cache.gz'] == \
+            'duckduckgo'
+
+    def test_slower_parsers_fail_the_check(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            baseline = os.path.join(tmpdir, 'baseline.json')
+            args = ['ask', '--rounds', '1', '--min-time', '0']
+            assert parser_benchmarks.main(args + ['--save', baseline]) == 0
+            with open(baseline) as fd:
+                results = json.load(fd)
+            assert results['ask']['pages'] > 0 and results['ask']['us_per_result'] > 0
+
+            assert parser_benchmarks.regressions(results, results) == []
+            results['ask']['pages_per_second'] *= 100
+            with open(baseline, 'w') as fd:
+                json.dump(results, fd)
+            assert parser_benchmarks.main(args + ['--check', baseline]) == 1
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
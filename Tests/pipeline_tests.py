@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the fetch -> parse -> store pipeline.
+
+python -m pytest Tests/pipeline_tests.py
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.config import get_config
+from GoogleScraper.database import ScraperSearch, get_session
+from GoogleScraper.output_converter import init_outfile
+from GoogleScraper.pipeline import ScrapePipeline, FetchedPage
+
+base = os.path.dirname(os.path.realpath(__file__))
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = dict(get_config(), print_results='', output_filename='', pipeline_queue_size=1)
+        init_outfile(self.config, force_reload=True)
+        self.session = get_session(self.config, path=os.path.join(self.tmpdir, 'test.db'))()
+        self.scraper_search = ScraperSearch()
+        self.html = open(os.path.join(base, 'data/uncompressed_serp_pages/abrakadabra_google_de_ip.html')).read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def page(self, query, html, outcome=None):
+        return FetchedPage(query, 'google', 'http', 1, requested_by='localhost', html=html, outcome=outcome)
+
+    def test_fetched_pages_are_parsed_and_stored(self):
+        pipeline = ScrapePipeline(self.config, self.session, self.scraper_search, threading.Lock()).start()
+
+        for i in range(5):
+            pipeline.submit(self.page('kw{}'.format(i), self.html))
+        pipeline.submit(self.page('failed', ''))
+        pipeline.close()
+
+        serps = {serp.query: serp for serp in self.scraper_search.serps}
+        assert sorted(serps) == ['failed', 'kw0', 'kw1', 'kw2', 'kw3', 'kw4']
+        assert all(serp.id is not None for serp in serps.values())
+        assert len(serps['kw0'].links) > 0 and serps['kw0'].search_engine_name == 'google'
+        assert len(serps['failed'].links) == 0
+
+        report = pipeline.report()
+        assert report['parse']['items'] == 6 and report['store']['items'] == 6
+        assert report['parse']['max_queue_depth'] <= 1
+
+    def test_failed_pages_go_to_the_negative_cache(self):
+        cache_manager = CacheManager(dict(self.config, do_caching=True, cachedir=os.path.join(self.tmpdir, 'cache')))
+        pipeline = ScrapePipeline(self.config, self.session, self.scraper_search, threading.Lock(),
+                                  cache_manager=cache_manager).start()
+
+        pipeline.submit(self.page('good', self.html))
+        pipeline.submit(self.page('blocked', self.html, outcome='blocked'))
+        pipeline.submit(self.page('empty', '<html><body></body></html>'))
+        pipeline.close()
+
+        cached = [query for query in ('good', 'blocked', 'empty') if cache_manager.get_cached(query, 'google', 'http', 1)]
+        assert cached == ['good']
+        negative = cache_manager.negative
+        job = {'search_engine': 'google', 'scrape_method': 'http', 'page_number': 1}
+        assert negative.get(dict(job, query='blocked'), 'localhost') == 'blocked'
+        assert negative.get(dict(job, query='empty'), 'localhost') == 'no_results'
+        assert negative.get(dict(job, query='good'), 'localhost') is None
+
+    def test_full_queue_blocks_the_fetchers(self):
+        pipeline = ScrapePipeline(self.config, self.session, self.scraper_search, threading.Lock())
+
+        pipeline.submit(self.page('first', self.html))
+        fetcher = threading.Thread(target=pipeline.submit, args=(self.page('second', self.html),))
+        fetcher.start()
+        fetcher.join(0.5)
+        assert fetcher.is_alive()
+
+        pipeline.start()
+        fetcher.join(10)
+        assert not fetcher.is_alive()
+        pipeline.close()
+
+        assert len(self.scraper_search.serps) == 2
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
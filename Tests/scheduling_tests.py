@@ -0,0 +1,302 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the distribution of scrape jobs among the scrape workers.
+
+python -m pytest Tests/scheduling_tests.py
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from GoogleScraper.caching import CacheManager
+from GoogleScraper.config import get_config
+from GoogleScraper.database import ScraperSearch, get_session
+from GoogleScraper.negative_cache import NegativeCache
+from GoogleScraper.output_converter import init_outfile
+from GoogleScraper.proxies import Proxy
+from GoogleScraper.scheduling import ScrapeJobDispatcher, JobQueue
+from GoogleScraper.scrape_jobs import default_scrape_jobs_for_keywords, KeywordFileReader, prioritize_scrape_jobs, \
+    enforce_deadlines
+from GoogleScraper.scraping import ScrapeWorkerFactory
+
+base = os.path.dirname(os.path.realpath(__file__))
+all_search_engines = get_config().get('supported_search_engines')
+
+
+def make_workers(search_engines, num_proxies, mode='http'):
+    return [ScrapeWorkerFactory({}, mode=mode, proxy=proxy, search_engine=search_engine)
+            for search_engine in search_engines for proxy in range(num_proxies)]
+
+
+class ScrapeJobDispatcherTestCase(unittest.TestCase):
+
+    def test_jobs_are_balanced_among_suitable_workers(self):
+        workers = make_workers(['google', 'bing'], 3)
+        dispatcher = ScrapeJobDispatcher(workers)
+
+        keywords = ['kw{}'.format(i) for i in range(30)]
+        num = dispatcher.dispatch_all(default_scrape_jobs_for_keywords(keywords, ['google', 'bing'], 'http', 1))
+
+        assert num == 60
+        for worker in workers:
+            assert len(worker.jobs) == 10, len(worker.jobs)
+
+    def test_pages_of_a_keyword_stay_on_one_worker(self):
+        workers = make_workers(['google'], 4, mode='selenium')
+        dispatcher = ScrapeJobDispatcher(workers)
+
+        dispatcher.dispatch_all(default_scrape_jobs_for_keywords(['one', 'two'], ['google'], 'selenium', 5))
+
+        assigned = [w for w in workers if w.jobs]
+        assert len(assigned) == 2
+        for worker in assigned:
+            for query, pages in worker.jobs.items():
+                assert pages == [1, 2, 3, 4, 5]
+
+    def test_job_without_suitable_worker_is_skipped(self):
+        dispatcher = ScrapeJobDispatcher(make_workers(['google'], 1))
+
+        jobs = list(default_scrape_jobs_for_keywords(['one'], ['google', 'yandex'], 'http', 1))
+        assert dispatcher.dispatch(jobs[1]) is None
+        assert dispatcher.dispatch(jobs[0]) is not None
+        assert dispatcher.num_dispatched == 1 and dispatcher.num_undispatched == 1
+
+
+    def test_jobs_avoid_the_proxies_they_failed_with(self):
+        with tempfile.TemporaryDirectory() as cachedir:
+            negative = NegativeCache(cachedir)
+            workers = [ScrapeWorkerFactory({}, mode='http', proxy=Proxy('http', '10.0.0.{}'.format(i), 80, '', ''),
+                                           search_engine='google') for i in range(2)]
+            dispatcher = ScrapeJobDispatcher(workers, negative_cache=negative)
+            one, two = default_scrape_jobs_for_keywords(['one', 'two'], ['google'], 'http', 1)
+
+            # the round robin would assign the first job to the first worker
+            negative.record(one, '10.0.0.0:80', 'blocked')
+            assert dispatcher.dispatch(one) is workers[1]
+
+            negative.record(two, '10.0.0.0:80', 'blocked')
+            negative.record(two, '10.0.0.1:80', 'timeout')
+            assert dispatcher.dispatch(two) is None
+            assert dispatcher.num_failed_recently == 1 and negative.num_avoided == 1
+            negative.close()
+
+
+class WorkStealingTestCase(unittest.TestCase):
+
+    def fill(self, job_queue, keywords):
+        for job in default_scrape_jobs_for_keywords(keywords, ['google'], 'http', 1):
+            job_queue.put_job(job)
+        job_queue.close()
+
+    def test_idle_worker_steals_from_stalled_worker(self):
+        job_queue = JobQueue(prefetch=5)
+        slow, fast = job_queue.register_consumer(), job_queue.register_consumer()
+        self.fill(job_queue, ['kw{}'.format(i) for i in range(5)])
+
+        # the slow worker prefetches all units and then stalls on the first one
+        assert job_queue.get(slow) == ('kw0', [1])
+
+        stolen = []
+        while True:
+            unit = job_queue.get(fast)
+            if unit is None:
+                break
+            stolen.append(unit[0])
+
+        assert stolen == ['kw4', 'kw3', 'kw2', 'kw1']
+        assert job_queue.num_stolen == 4
+        assert job_queue.get(slow) is None
+
+    def test_buffer_of_stopped_worker_is_not_lost(self):
+        job_queue = JobQueue(prefetch=3)
+        stopped, other = job_queue.register_consumer(), job_queue.register_consumer()
+        self.fill(job_queue, ['one', 'two', 'three'])
+
+        job_queue.get(stopped)
+        job_queue.unregister_consumer(stopped)
+
+        assert job_queue.get(other) == ('three', [1])
+        assert job_queue.get(other) == ('two', [1])
+        assert job_queue.get(other) is None
+
+    def test_no_more_workers_than_work_units_are_started(self):
+        workers = make_workers(['google', 'bing'], 4)
+        dispatcher = ScrapeJobDispatcher(workers, shared_queues=True)
+
+        dispatcher.dispatch_all(default_scrape_jobs_for_keywords(['one', 'two'], ['google'], 'http', 3))
+        dispatcher.close()
+
+        started = list(dispatcher.workers())
+        assert len(started) == 2
+        assert all(worker.search_engine == 'google' for worker in started)
+
+
+class PriorityTestCase(unittest.TestCase):
+
+    def job(self, query, page_number=1, **kwargs):
+        return dict(query=query, search_engine='google', scrape_method='http', page_number=page_number, **kwargs)
+
+    def drain(self, job_queue):
+        consumer = job_queue.register_consumer()
+        units = []
+        while True:
+            unit = job_queue.get(consumer)
+            if unit is None:
+                return units
+            units.append(unit)
+
+    def test_urgent_jobs_are_served_first(self):
+        job_queue = JobQueue()
+        for job in [self.job('long tail'), self.job('money', priority=10), self.job('money', 2, priority=10),
+                    self.job('soon', deadline=time.time() + 60), self.job('later', deadline=time.time() + 3600)]:
+            job_queue.put_job(job)
+        job_queue.close()
+
+        assert self.drain(job_queue) == [('money', [1, 2]), ('soon', [1]), ('later', [1]), ('long tail', [1])]
+
+    def test_expired_jobs_are_dropped_or_deferred(self):
+        jobs = [self.job('expired', deadline=time.time() - 1), self.job('in time', deadline=time.time() + 60),
+                self.job('no deadline')]
+
+        job_queue = JobQueue()
+        for job in jobs:
+            job_queue.put_job(job)
+        job_queue.close()
+        assert self.drain(job_queue) == [('in time', [1]), ('no deadline', [1])]
+        assert job_queue.num_expired == 1
+
+        job_queue = JobQueue(expired_jobs='defer')
+        for job in jobs:
+            job_queue.put_job(job)
+        job_queue.close()
+        assert self.drain(job_queue) == [('in time', [1]), ('no deadline', [1]), ('expired', [1])]
+
+        assert [job['query'] for job in enforce_deadlines(jobs, 'defer')] == ['in time', 'no deadline', 'expired']
+        assert [job['query'] for job in enforce_deadlines(jobs)] == ['in time', 'no deadline']
+
+    def test_prioritized_jobs_keep_the_pages_of_a_keyword_together(self):
+        jobs = list(default_scrape_jobs_for_keywords(['a', 'b'], ['google'], 'http', 2))
+        jobs.append(self.job('c', priority=1))
+
+        assert [(job['query'], job['page_number']) for job in prioritize_scrape_jobs(jobs)] == \
+            [('c', 1), ('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+
+
+class StreamingTestCase(unittest.TestCase):
+
+    def test_keyword_file_reader_removes_duplicates_across_chunks(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as fd:
+            fd.write('one\ntwo\n\none\nthree\n  two  \nfour\n')
+
+        reader = KeywordFileReader(fd.name, chunk_size=2)
+        try:
+            assert list(reader) == ['one', 'two', 'three', 'four']
+            assert reader.num_keywords == 4
+        finally:
+            os.remove(fd.name)
+
+    def test_keyword_file_reader_with_a_dedup_file_can_be_read_again(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'keywords.txt')
+            with open(path, 'w') as fd:
+                fd.write('one\ntwo\none\n')
+
+            reader = KeywordFileReader(path, dedup_file=os.path.join(tmpdir, 'dedup.db'))
+            assert list(reader) == ['one', 'two']
+            assert list(reader) == ['one', 'two']
+            assert reader.num_keywords == 2
+            # a later run with the same dedup file
+            assert list(KeywordFileReader(path, dedup_file=os.path.join(tmpdir, 'dedup.db'))) == ['one', 'two']
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_workers_pull_from_bounded_job_queue(self):
+        job_queue = JobQueue(maxsize=2)
+        consumed = []
+
+        def consume(consumer):
+            while True:
+                unit = job_queue.get(consumer)
+                if unit is None:
+                    break
+                consumed.append(unit)
+            job_queue.unregister_consumer(consumer)
+
+        consumers = []
+        for i in range(3):
+            consumers.append(threading.Thread(target=consume, args=(job_queue.register_consumer(),)))
+
+        for t in consumers:
+            t.start()
+
+        keywords = ['kw{}'.format(i) for i in range(50)]
+        for job in default_scrape_jobs_for_keywords(keywords, ['google'], 'http', 2):
+            job_queue.put_job(job)
+        job_queue.close()
+
+        for t in consumers:
+            t.join()
+
+        assert sorted(consumed) == sorted((kw, [1, 2]) for kw in keywords)
+        assert job_queue.num_dropped == 0
+
+    def test_jobs_are_dropped_when_no_worker_is_left(self):
+        job_queue = JobQueue(maxsize=1)
+        job_queue.unregister_consumer(job_queue.register_consumer())
+
+        for job in default_scrape_jobs_for_keywords(['one', 'two', 'three'], ['google'], 'http', 1):
+            job_queue.put_job(job)
+        job_queue.close()
+
+        # the first keyword still fits into the queue
+        assert job_queue.num_dropped == 2
+
+    def test_streamed_jobs_are_read_from_cache(self):
+        # the cache manager writes its index into the cache directory, leave the fixture untouched
+        cachedir = os.path.join(tempfile.mkdtemp(), 'csv_tests')
+        shutil.copytree(os.path.join(base, 'data/csv_tests/'), cachedir)
+        config = get_config()
+        config.update({
+            'cachedir': cachedir,
+            'do_caching': True,
+            'print_results': '',
+        })
+        init_outfile(config, force_reload=True)
+        cache_manager = CacheManager(config)
+        session = get_session(config, path=os.path.join(tempfile.mkdtemp(), 'test.db'))()
+        scraper_search = ScraperSearch()
+
+        jobs = default_scrape_jobs_for_keywords(['some words', 'not cached'], all_search_engines, 'selenium', 2)
+
+        remaining = list(cache_manager.iter_uncached_jobs(jobs, session, scraper_search, db_lock=threading.Lock()))
+
+        assert len(remaining) == len(all_search_engines) * 2
+        assert all(job['query'] == 'not cached' for job in remaining)
+        assert len(scraper_search.serps) == len(all_search_engines) * 2
+
+    def test_a_failing_cached_page_releases_the_database_lock(self):
+        cachedir = tempfile.mkdtemp()
+        try:
+            cache_manager = CacheManager({'do_caching': True, 'cachedir': cachedir})
+            cache_manager.backend.put(cache_manager.cached_file_name('kw', 'google', 'http', 1), b'<html></html>')
+
+            def corrupt(*args):
+                raise ValueError('corrupt cache file')
+            cache_manager._serp_from_cache = corrupt
+
+            db_lock = threading.Lock()
+            jobs = default_scrape_jobs_for_keywords(['kw'], ['google'], 'http', 1)
+            with self.assertRaises(ValueError):
+                list(cache_manager.iter_uncached_jobs(jobs, None, ScraperSearch(), db_lock=db_lock))
+            assert not db_lock.locked()
+        finally:
+            shutil.rmtree(cachedir)
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
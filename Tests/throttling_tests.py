@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests for the adaptive throttling of the requests per search engine and proxy.
+
+python -m pytest Tests/throttling_tests.py
+"""
+
+import threading
+import unittest
+from GoogleScraper.pacing import PacingScheduler
+from GoogleScraper.throttling import AdaptiveThrottle
+
+
+class AdaptiveThrottleTestCase(unittest.TestCase):
+
+    def request(self, throttle, latency=0.5, **outcome):
+        throttle.acquire('google', 'proxy')
+        throttle.release('google', 'proxy', latency=latency, **outcome)
+        return throttle.states['google', 'proxy']
+
+    def test_clean_responses_raise_concurrency_and_lower_delays(self):
+        throttle = AdaptiveThrottle({}, max_concurrency=4)
+
+        for i in range(30):
+            state = self.request(throttle)
+
+        assert state.limit == 4
+        assert state.delay_factor == 0.25
+
+    def test_block_halves_concurrency_and_doubles_delays(self):
+        throttle = AdaptiveThrottle({}, max_concurrency=8)
+        for i in range(40):
+            self.request(throttle)
+
+        state = self.request(throttle, blocked=True)
+        assert state.limit == 4
+        assert state.delay_factor == 0.5
+        assert state.num_blocks == 1
+
+        for i in range(10):
+            state = self.request(throttle, blocked=True)
+        assert state.limit == 1
+        assert state.delay_factor == 16
+
+    def test_rising_latency_backs_off(self):
+        throttle = AdaptiveThrottle({'throttle_latency_tolerance': 2}, max_concurrency=8)
+        for i in range(40):
+            self.request(throttle, latency=0.5)
+
+        state = throttle.states['google', 'proxy']
+        while state.limit == 8:
+            state = self.request(throttle, latency=5)
+
+        assert state.limit == 4
+        assert state.delay_factor == 0.25 * 1.5
+
+    def test_acquire_blocks_at_the_limit(self):
+        throttle = AdaptiveThrottle({}, max_concurrency=4)
+        throttle.acquire('google', 'proxy')
+
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (throttle.acquire('google', 'proxy'), acquired.set()))
+        thread.start()
+
+        # the limit starts at one concurrent request
+        assert not acquired.wait(0.2)
+
+        throttle.release('google', 'proxy', latency=0.5)
+        assert acquired.wait(5)
+        thread.join()
+
+        # other proxies are not affected
+        throttle.acquire('google', 'other proxy')
+
+    def test_delay_factor_scales_the_pacing(self):
+        throttle = AdaptiveThrottle({})
+        scheduler = PacingScheduler({'sleeping_ranges': {100: (4, 5)}}, throttle=throttle)
+        scheduler.now = lambda: 0
+
+        assert scheduler.reserve('google', 'proxy') == 4
+        self.request(throttle, blocked=True)
+        assert scheduler.reserve('google', 'proxy') == 4 + 8
+
+if __name__ == '__main__':
+    unittest.main(warnings='ignore')
@@ -25,5 +25,6 @@ setup(name='GoogleScraper',
       packages=['GoogleScraper'],
       entry_points={'console_scripts': ['GoogleScraper = GoogleScraper.core:main']},
       package_dir={'examples': 'examples'},
-      install_requires=requirements
+      install_requires=requirements,
+      extras_require={'zstd': ['zstandard'], 'lz4': ['lz4']}
 )